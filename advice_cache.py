@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class AdviceCache:
+    """
+    Persistent cache for the trilingual advice text.
+    Advice only depends on the disease name, so entries are keyed by
+    (disease, LLM model, prompt version). Fresh entries are served for ttl seconds;
+    expired ones are kept as a stale fallback for when Groq is failing.
+    Entries live in memory and, if a directory is given, as one JSON file per key
+    so every Gunicorn worker shares them.
+    """
+    def __init__(self, cache_dir=None, ttl=7 * 24 * 3600, max_entries=64):
+        self.cache_dir = cache_dir or None
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(disease, model, prompt_version):
+        raw = f"{disease}|{model}|{prompt_version}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _load(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, disease, model, prompt_version, allow_stale=False):
+        """Return (en, ta, hi) or None. allow_stale also returns expired entries."""
+        entry = self._load(self.key(disease, model, prompt_version))
+        if entry is None:
+            if not allow_stale:
+                self.misses += 1
+            return None
+        fresh = time.time() - entry["created"] < self.ttl
+        if not fresh and not allow_stale:
+            self.misses += 1
+            return None
+        if fresh:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+        return entry["en"], entry["ta"], entry["hi"]
+
+    def put(self, disease, model, prompt_version, advice):
+        en, ta, hi = advice
+        key = self.key(disease, model, prompt_version)
+        entry = {"disease": disease, "model": model, "prompt_version": prompt_version,
+                 "created": time.time(), "en": en, "ta": ta, "hi": hi}
+        self._remember(key, entry)
+        if self.cache_dir:
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, self._path(key))
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Keep at most max_entries files, dropping the oldest first
+        files = [os.path.join(self.cache_dir, n) for n in os.listdir(self.cache_dir) if n.endswith(".json")]
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda p: os.path.getmtime(p))
+        for path in files[:len(files) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"entries_memory": len(self._memory), "hits": self.hits,
+                "stale_hits": self.stale_hits, "misses": self.misses, "ttl_seconds": self.ttl}
+
+
+def advice_cache_from_env():
+    """ADVICE_CACHE_DIR / ADVICE_CACHE_TTL / ADVICE_CACHE_SIZE; ADVICE_CACHE=0 disables it."""
+    if os.environ.get("ADVICE_CACHE", "1").lower() in ("0", "false", "off", "no"):
+        return None
+    return AdviceCache(
+        cache_dir=os.environ.get("ADVICE_CACHE_DIR", "cache/advice"),
+        ttl=float(os.environ.get("ADVICE_CACHE_TTL", str(7 * 24 * 3600))),
+        max_entries=int(os.environ.get("ADVICE_CACHE_SIZE", "64")),
+    )
@@ -1,14 +1,21 @@
 import os
-import cv2
-import torch
-import numpy as np
-import timm
-import zipfile
-from flask import Flask, request, render_template, jsonify
-from torchvision import transforms
-from llm_advisor import CaricaCareAdvisor
+import json
+import time
+from flask import Flask, request, render_template, jsonify, Response, stream_with_context
+from llm_advisor import CaricaCareAdvisor, advice_failed
+from advice_cache import advice_cache_from_env
+from transcription import AudioUpload, AudioLimitError, transcript_cache_from_env, audio_limits_from_env
 from sms_service import sms_handler
-from PIL import Image
+from prediction_cache import PredictionCache, image_key
+from model_loader import LazyResource
+from inference_service import MODEL_PATH, CLASSES, inference_service_from_env
+from metrics import (REGISTRY, CONTENT_TYPE, PREDICTIONS, REQUESTS, REQUEST_SECONDS, MODEL_READY,
+                     OUTBOUND_CIRCUIT_OPEN, timed, record_error, start_trace, current_trace)
+import outbound
+from reminder_scheduler import reminder_scheduler_from_env
+from sms_queue import sms_queue_from_env
+from vision_advisor import vision_advisor_from_env
+from router import router_from_env
 
 app = Flask(__name__)
 
@@ -17,167 +24,269 @@ GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
 if not GROQ_API_KEY:
     print("⚠️  WARNING: GROQ_API_KEY environment variable not set!")
     print("   Set it in Render dashboard or locally for testing")
-ADVISOR = CaricaCareAdvisor(api_key=GROQ_API_KEY)
-MODEL_PATH = 'models/best_convnext_tiny.pth'
+ADVISOR = CaricaCareAdvisor(api_key=GROQ_API_KEY, cache=advice_cache_from_env(),
+                            transcripts=transcript_cache_from_env())
+AUDIO_LIMITS = audio_limits_from_env()
 ZIP_PATH = 'models/best_convnext_tiny.zip'
-CLASSES = ["Anthracnose", "Bacterial spot", "Curl", "Healthy", "Mealybug", "Mite disease", "Ringspot", "Mosaic"]
-
-device = torch.device("cpu")
-model = timm.create_model('convnext_tiny', pretrained=False, num_classes=8)
-
-# Check for model file, unzip if needed (for cloud deployment)
-if not os.path.exists(MODEL_PATH) and os.path.exists(ZIP_PATH):
-    print("📦 Unzipping model file...")
-    with zipfile.ZipFile(ZIP_PATH, 'r') as zip_ref:
-        zip_ref.extractall('models')
-    print("✅ Model unzipped successfully")
-
-if os.path.exists(MODEL_PATH):
-    model.load_state_dict(torch.load(MODEL_PATH, map_location=device))
-    model.eval()
-    print("✅ Model Loaded Successfully")
-else:
-    print(f"❌ Error: Model not found at {MODEL_PATH}")
-
-class GradCAM:
-    def __init__(self, model, target_layer):
-        self.model = model
-        self.target_layer = target_layer
-        self.gradients = None
-        self.activations = None
-        self.target_layer.register_forward_hook(self.save_act)
-        self.target_layer.register_full_backward_hook(self.save_grad)
-    def save_act(self, m, i, o): self.activations = o
-    def save_grad(self, m, gi, go): self.gradients = go[0]
-    def generate(self, tensor, idx):
-        output = self.model(tensor)
-        self.model.zero_grad()
-        output[0, idx].backward()
-        weights = torch.mean(self.gradients, dim=(2, 3), keepdim=True)
-        cam = torch.sum(weights * self.activations, dim=1).squeeze().detach().numpy()
-        cam = np.maximum(cam, 0)
-        return cam / (np.max(cam) + 1e-7)
+
+# Advice only depends on the disease, so fetch all eight in the background at startup
+if GROQ_API_KEY and os.environ.get("ADVICE_WARMUP", "1").lower() not in ("0", "false", "off", "no"):
+    ADVISOR.warm_cache(CLASSES)
+
+# Grad-CAM: hooks are scoped per call; HEATMAP_MODE sets the default (none|sync|async)
+HEATMAP_MODE = os.environ.get("HEATMAP_MODE", "sync")
+
+# Repeat uploads of the same photo are served from cache (PREDICTION_CACHE_DIR shares it across workers)
+CACHE = PredictionCache(max_entries=int(os.environ.get("PREDICTION_CACHE_SIZE", "256")),
+                        disk_dir=os.environ.get("PREDICTION_CACHE_DIR"),
+                        max_bytes=float(os.environ.get("PREDICTION_CACHE_MAX_MB", "100")) * 1024 * 1024,
+                        max_age=float(os.environ.get("PREDICTION_CACHE_MAX_AGE", "604800")))
+
+
+def build_engine():
+    """
+    Load the model and everything that depends on it. Runs once per worker, either in
+    the warmup thread started below or on the first request. torch / timm / cv2 are
+    only imported here so importing the app stays cheap.
+    """
+    # Threads, backend, batching, cascade, warmup and Grad-CAM all live in the shared inference service
+    return inference_service_from_env(MODEL_PATH, CLASSES, store=HEATMAP_STORE.get())
+
+
+def build_heatmap_store():
+    from artifact_store import artifact_store_from_env
+    return artifact_store_from_env()
+
+
+# Heatmap files and async job records (HEATMAP_STORE_DIR), shared by every worker; a status
+# poll can be answered from here even by a worker whose model has not loaded yet
+HEATMAP_STORE = LazyResource(build_heatmap_store, "heatmap store")
+
+
+# Outbound SMS go through a SQLite queue (SMS_QUEUE_DB): identical bodies are sent as bulk
+# provider calls under per-provider rate limits, and each message keeps its own status
+SMS_QUEUE = sms_queue_from_env(sms_handler)
+SMS_QUEUE.start()
+
+
+def send_reminder_sms(phone, body):
+    # Due reminders are handed to the SMS queue, so a burst of them becomes bulk calls.
+    # Delivery retries are the queue's (SMS_MAX_ATTEMPTS); REMINDER_MAX_ATTEMPTS only covers
+    # handing the message over, and /reminders/<id> reports the queued message's status
+    message_id = SMS_QUEUE.enqueue(phone, body)
+    return {"status": "success", "message": "SMS queued for delivery", "message_id": message_id}
+
+
+# Reminders live in SQLite (REMINDER_DB) and are sent by one dispatcher thread per worker,
+# so they survive restarts; REMINDER_DISPATCHER=0 runs a web-only worker that just stores them
+REMINDERS = reminder_scheduler_from_env(send_reminder_sms)
+REMINDERS.start()
+
+
+ENGINE = LazyResource(build_engine, "model")
+# MODEL_WARMUP=0 defers loading to the first request. Under gunicorn --preload every forked
+# worker starts its own warmup (LazyResource re-arms itself after a fork)
+if os.environ.get("MODEL_WARMUP", "1").lower() not in ("0", "false", "off", "no"):
+    ENGINE.warm()
+
+# Hybrid routing (ROUTER_MODE): the local model answers first; the Groq vision model takes
+# low-confidence leaves, requests while the model is loading or overloaded, and optional
+# hedges, all within ROUTER_BUDGET_MS. Without GROQ_API_KEY everything stays local
+VISION = vision_advisor_from_env(GROQ_API_KEY)
+ROUTER = router_from_env(ENGINE, VISION, CLASSES)
+
+# Trace ids: X-Request-ID from the proxy is reused, otherwise one is generated.
+# TRACE_HEADERS=0 stops echoing X-Trace-Id / Server-Timing to clients.
+TRACE_HEADERS = os.environ.get("TRACE_HEADERS", "1").lower() not in ("0", "false", "off", "no")
+
+@app.before_request
+def begin_trace():
+    from flask import g
+    g.request_started = time.perf_counter()
+    start_trace(request.headers.get("X-Request-ID") or request.headers.get("X-Trace-Id"))
+
+@app.after_request
+def end_trace(response):
+    from flask import g
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    trace = current_trace()
+    if TRACE_HEADERS and trace is not None:
+        response.headers["X-Trace-Id"] = trace.id
+        # Stages that ran before the headers went out (streamed stages only reach /metrics)
+        if trace.spans:
+            response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    MODEL_READY.set(1 if ENGINE.ready else 0)
+    for name, provider in outbound.PROVIDERS.items():
+        OUTBOUND_CIRCUIT_OPEN.set(0 if provider.breaker.state == "closed" else 1, provider=name)
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def prediction_key(data, tta):
+    """
+    (TTA views, cache key) for an upload. Content-addressed: same bytes + model + TTA set ->
+    same response. The router's mode and remote model are part of the key, since they decide
+    which engine answered. Blocks while the model loads unless the router can answer remotely.
+    """
+    from tta_engine import parse_augmentations
+    tta_views = parse_augmentations(tta)
+    if ENGINE.ready or not ROUTER.remote_available():
+        engine = ENGINE.get()
+        tta_views = tta_views or engine.tta.augmentations
+        return tta_views, image_key(data, engine.version, ",".join(tta_views), ROUTER.signature())
+    # Model still loading: the router answers with the vision model
+    return tta_views, image_key(data, "remote:" + VISION.model, ",".join(tta_views or ()), ROUTER.signature())
+
+
+def cached_prediction(cache_key, heatmap_mode):
+    cached = CACHE.get(cache_key, need_heatmap=heatmap_mode != "none")
+    if cached is not None and heatmap_mode == "none":
+        cached["heatmap"] = ""
+    if cached is not None:
+        PREDICTIONS.inc(condition=cached["condition"], cache="hit")
+    return cached
+
+
+def store_prediction(cache_key, result, heatmap_job):
+    """Cache a finished response; returns the stored copy (or result unchanged if it is not cached)."""
+    failed = advice_failed(result.get("advice_en", ""), result.get("advice_ta", ""), result.get("advice_hi", ""))
+    if failed:
+        record_error("advice")
+    if not heatmap_job and not failed:
+        # Async heatmaps are not ready yet and advice errors (even in one section) should be retried
+        try:
+            return CACHE.put(cache_key, result)
+        except Exception as cache_err:
+            print(f"Cache Error: {cache_err}")
+    return result
+
+
+def diagnose(data, heatmap_mode, tta_views, cache_key, stream_advice=False):
+    """
+    Run the /predict pipeline as a sequence of (event, payload) stages:
+    diagnosis -> heatmap -> advice_en / advice_ta / advice_hi -> result.
+    The JSON endpoint only uses the final result; the streaming endpoint sends
+    every stage to the client as soon as it is ready.
+    """
+    # Decode at working size, CLAHE, TTA (or the cascade) in the shared inference service,
+    # or the vision model when the router sends the leaf there. For sync heatmaps the CAM
+    # comes out of the same grad-enabled forward; it is only rendered after the diagnosis has gone out
+    route = ROUTER.route(data, {"tta": tta_views, "cam": heatmap_mode == "sync"})
+    result = diagnosis_fields(route)
+    yield "diagnosis", dict(result)
+
+    result.update(heatmap_fields(route, heatmap_mode))
+    if heatmap_mode != "none":
+        yield "heatmap", {k: v for k, v in result.items() if k.startswith("heatmap")}
+
+    # Fetch Translated 4-Protocol Advice
+    with timed("advice"):
+        if stream_advice:
+            for lang, text in ADVISOR.stream_organic_advice(route.label):
+                result["advice_" + lang] = text
+                yield "advice_" + lang, {"text": text}
+        else:
+            en, ta, hi = ADVISOR.get_organic_advice(route.label)
+            result.update(advice_en=en, advice_ta=ta, advice_hi=hi)
+    yield "result", store_prediction(cache_key, result, result.get("heatmap_job"))
+
+
+# Fields of the "diagnosis" stream event, for live and cached responses alike
+DIAGNOSIS_FIELDS = ("condition", "accuracy", "engine")
+
+
+def diagnosis_fields(route):
+    PREDICTIONS.inc(condition=route.label, cache="miss")
+    return {
+        "condition": route.label,
+        "accuracy": f"{route.confidence*100:.1f}%",
+        "engine": route.engine,
+    }
+
+
+def heatmap_fields(route, heatmap_mode):
+    """
+    Grad-CAM Heatmap Generation (original image gives better visualization); only when the
+    local model ran and agrees with the answer, otherwise it would highlight the wrong class.
+    """
+    prediction = route.prediction
+    fields = {"heatmap": ""}
+    if prediction is not None and prediction.label == route.label:
+        ENGINE.get().attach_heatmap(prediction, heatmap_mode)
+        fields["heatmap"] = prediction.heatmap_url
+        if prediction.heatmap_job:
+            fields["heatmap_job"] = prediction.heatmap_job
+            fields["heatmap_status"] = f"/heatmap/{prediction.heatmap_job}"
+    return fields
+
+
+def replay(cached):
+    """Stages for a cached response, so streaming clients see the same event sequence."""
+    yield "diagnosis", {key: cached[key] for key in DIAGNOSIS_FIELDS if key in cached}
+    if cached.get("heatmap"):
+        yield "heatmap", {"heatmap": cached["heatmap"]}
+    for lang in ("en", "ta", "hi"):
+        yield "advice_" + lang, {"text": cached.get("advice_" + lang, "")}
+    yield "result", cached
+
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def sse(stages):
+    """Format pipeline stages as Server-Sent Events."""
+    try:
+        for event, payload in stages:
+            yield sse_event(event, payload)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield sse_event("error", {"error": str(e)})
+
+
 @app.route('/predict', methods=['POST'])
 def predict():
+    from heatmap import parse_heatmap_mode
+    from tta_engine import parse_augmentations
+    try:
+        heatmap_mode = parse_heatmap_mode(request.form.get('heatmap') or request.args.get('heatmap'), HEATMAP_MODE)
+        parse_augmentations(request.form.get('tta'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # stream=1 sends the diagnosis as soon as the CNN finishes, then the heatmap and advice sections
+    stream = (request.args.get('stream') or request.form.get('stream') or "").lower() in ("1", "true", "yes", "sse")
     try:
         file = request.files['file']
-        img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR)
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        # Enhanced preprocessing function
-        def enhance_image(image):
-            """Apply CLAHE and sharpening to improve image quality"""
-            # Convert to LAB color space for better contrast enhancement
-            lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
-            l, a, b = cv2.split(lab)
-            
-            # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            l = clahe.apply(l)
-            
-            # Merge channels back
-            enhanced = cv2.merge([l, a, b])
-            enhanced = cv2.cvtColor(enhanced, cv2.COLOR_LAB2RGB)
-            
-            # Apply sharpening kernel
-            kernel = np.array([[-1, -1, -1],
-                              [-1,  9, -1],
-                              [-1, -1, -1]])
-            sharpened = cv2.filter2D(enhanced, -1, kernel)
-            
-            # Blend original and sharpened (70% sharpened, 30% original)
-            result = cv2.addWeighted(sharpened, 0.7, enhanced, 0.3, 0)
-            return result
-
-        # Enhance the image
-        img_enhanced = enhance_image(img_rgb)
-
-        # Standard transform
-        transform = transforms.Compose([
-            transforms.ToPILImage(),
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ])
-
-        # Test-Time Augmentation (TTA)
-        def predict_with_tta(image):
-            """Run prediction on multiple augmentations and average"""
-            predictions = []
-            
-            # 1. Original image
-            input_tensor = transform(image).unsqueeze(0)
-            with torch.no_grad():
-                output = model(input_tensor)
-                prob = torch.nn.functional.softmax(output[0], dim=0)
-                predictions.append(prob)
-            
-            # 2. Horizontal flip
-            flipped = cv2.flip(image, 1)
-            input_tensor = transform(flipped).unsqueeze(0)
-            with torch.no_grad():
-                output = model(input_tensor)
-                prob = torch.nn.functional.softmax(output[0], dim=0)
-                predictions.append(prob)
-            
-            # 3. Slight rotation (+5 degrees)
-            from PIL import Image as PILImage
-            pil_img = PILImage.fromarray(image)
-            rotated_pil = pil_img.rotate(5, expand=False, fillcolor=(0, 0, 0))
-            rotated = np.array(rotated_pil)  # Convert back to numpy array
-            input_tensor = transform(rotated).unsqueeze(0)
-            with torch.no_grad():
-                output = model(input_tensor)
-                prob = torch.nn.functional.softmax(output[0], dim=0)
-                predictions.append(prob)
-            
-            # 4. Slight rotation (-5 degrees)
-            rotated_pil = pil_img.rotate(-5, expand=False, fillcolor=(0, 0, 0))
-            rotated = np.array(rotated_pil)  # Convert back to numpy array
-            input_tensor = transform(rotated).unsqueeze(0)
-            with torch.no_grad():
-                output = model(input_tensor)
-                prob = torch.nn.functional.softmax(output[0], dim=0)
-                predictions.append(prob)
-            
-            # Average all predictions
-            avg_prob = torch.stack(predictions).mean(dim=0)
-            return avg_prob
-
-        # Get prediction with TTA
-        prob = predict_with_tta(img_enhanced)
-        idx = torch.argmax(prob).item()
-        disease = CLASSES[idx]
-        
-        # Use original image for heatmap (better visualization)
-        input_tensor = transform(img_rgb).unsqueeze(0)
+        data = file.read()
 
-        # Grad-CAM Heatmap Generation
-        try:
-            target_layer = model.stages[3].blocks[-1]
-            cam = GradCAM(model, target_layer).generate(input_tensor, idx)
-            heatmap = cv2.applyColorMap(np.uint8(255 * cv2.resize(cam, (img.shape[1], img.shape[0]))), cv2.COLORMAP_JET)
-            overlay = cv2.addWeighted(img, 0.6, heatmap, 0.4, 0)
-            cv2.imwrite('static/temp/heatmap.png', overlay)
-        except Exception as cam_err:
-            print(f"Heatmap Error: {cam_err}")
-
-        # Fetch Translated 4-Protocol Advice
-        en, ta, hi = ADVISOR.get_organic_advice(disease)
-
-        return jsonify({
-            "condition": disease,
-            "accuracy": f"{prob[idx].item()*100:.1f}%",
-            "advice_en": en,
-            "advice_ta": ta,
-            "advice_hi": hi,
-            "heatmap": "/static/temp/heatmap.png"
-        })
+        tta_views, cache_key = prediction_key(data, request.form.get('tta'))
+        cached = cached_prediction(cache_key, heatmap_mode)
+
+        if stream:
+            stages = replay(cached) if cached is not None else diagnose(data, heatmap_mode, tta_views, cache_key, stream_advice=True)
+            response = Response(stream_with_context(sse(stages)), mimetype='text/event-stream')
+            response.headers["Cache-Control"] = "no-cache"
+            response.headers["X-Accel-Buffering"] = "no"
+        else:
+            if cached is not None:
+                result = cached
+            else:
+                for _, result in diagnose(data, heatmap_mode, tta_views, cache_key):
+                    pass
+            response = jsonify(result)
+        response.headers["X-Cache"] = "HIT" if cached is not None else "MISS"
+        return response
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -186,9 +295,67 @@ def predict():
              error_msg += " (Check GROQ_API_KEY or network)"
         return jsonify({"error": error_msg}), 500
 
+@app.route('/heatmap/<job_id>')
+def heatmap_status(job_id):
+    status = ENGINE.get().heatmaps.status(job_id) if ENGINE.ready else HEATMAP_STORE.get().get_job(job_id)
+    if status is None:
+        return jsonify({"status": "error", "message": "Unknown heatmap job"}), 404
+    return jsonify(status)
+
+@app.route('/metrics/cache')
+def cache_metrics():
+    stats = {"predictions": CACHE.stats()}
+    if ADVISOR.cache is not None:
+        stats["advice"] = ADVISOR.cache.stats()
+    if ADVISOR.transcripts is not None:
+        stats["transcripts"] = ADVISOR.transcripts.stats()
+    if ENGINE.ready:
+        stats["heatmaps"] = ENGINE.get().heatmaps.store.stats()
+    return jsonify(stats)
+
+@app.route('/metrics/batching')
+def batching_metrics():
+    engine = ENGINE.get() if ENGINE.ready else None
+    if engine is not None and engine.server is not None:
+        # Batches form in the model server; report the replica that answers this channel
+        return jsonify(dict(enabled=True, server=engine.server.stats()))
+    scheduler = engine.scheduler if engine is not None else None
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(enabled=True, **scheduler.stats()))
+
+@app.route('/metrics/cascade')
+def cascade_metrics():
+    # Per stage: images entered / answered and the early-exit hit rate
+    cascade = ENGINE.get().cascade if ENGINE.ready else None
+    if cascade is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(enabled=True, **cascade.stats()))
+
+@app.route('/metrics/router')
+def router_metrics():
+    # Per engine latency, routing decisions and local/remote agreement
+    return jsonify(ROUTER.stats())
+
+@app.route('/metrics/outbound')
+def outbound_metrics():
+    # Per provider: calls, retries, failures, busy/open rejections, circuit state
+    return jsonify(outbound.stats())
+
+@app.route('/ready')
+def ready():
+    # Readiness probe: 503 until the model is loaded and warmed up
+    status = ENGINE.status()
+    return jsonify(status), (200 if status["ready"] else 503)
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     try:
+        # Reject oversized bodies before Werkzeug parses (and spools) the multipart form
+        max_bytes = AUDIO_LIMITS["max_bytes"]
+        if max_bytes and request.content_length and request.content_length > max_bytes + 64 * 1024:
+            return jsonify({"status": "error", "message": f"Audio is larger than {max_bytes / (1024 * 1024):.0f} MB"}), 413
+
         if 'file' not in request.files:
             return jsonify({"status": "error", "message": "No file part"}), 400
         
@@ -196,48 +363,71 @@ def transcribe():
         if file.filename == '':
             return jsonify({"status": "error", "message": "No selected file"}), 400
 
-        # Save temporarily
-        temp_path = os.path.join('static/temp', 'recording.webm')
-        file.save(temp_path)
+        # The upload stays in Werkzeug's per-request spooled file: hashed and checked against
+        # the size / duration limits, then streamed to Whisper (or answered from the cache)
+        try:
+            audio = AudioUpload.from_stream(file.stream, file.filename, **AUDIO_LIMITS)
+        except AudioLimitError as e:
+            return jsonify({"status": "error", "message": str(e)}), 413
 
-        # Transcribe
-        text = ADVISOR.transcribe_audio(temp_path)
+        with audio, timed("transcribe"):
+            text = ADVISOR.transcribe_audio(audio)
         
         if text:
             return jsonify({"status": "success", "transcript": text})
         else:
+            record_error("transcribe")
             return jsonify({"status": "error", "message": "Transcription failed"}), 500
             
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/send-sms', methods=['POST'])
-def send_sms():
+def queue_sms(data):
+    """/send-sms body -> (response dict, status code)."""
     try:
-        data = request.json
+        # Missing or malformed JSON body (both apps pass None): a client error, not a 500
+        data = data if isinstance(data, dict) else {}
         phone = data.get('phone')
         message = data.get('message')
         
         if not phone or not message:
-            return jsonify({"status": "error", "message": "Missing phone or message"}), 400
+            return {"status": "error", "message": "Missing phone or message"}, 400
             
-        result = sms_handler.send_sms(phone, message)
-        return jsonify(result)
+        message_id = SMS_QUEUE.enqueue(phone, message)
+        return {"status": "success", "message": "SMS queued for delivery",
+                "message_id": message_id, "status_url": f"/sms/{message_id}"}, 200
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return {"status": "error", "message": str(e)}, 500
 
-@app.route('/schedule-reminder', methods=['POST'])
-def schedule_reminder():
-    import threading
+@app.route('/send-sms', methods=['POST'])
+def send_sms():
+    payload, status = queue_sms(request.get_json(silent=True))
+    return jsonify(payload), status
+
+@app.route('/sms/<message_id>')
+def sms_status(message_id):
+    message = SMS_QUEUE.get(message_id)
+    if message is None:
+        return jsonify({"status": "error", "message": "Unknown message"}), 404
+    return jsonify(message)
+
+@app.route('/metrics/sms')
+def sms_metrics():
+    return jsonify(SMS_QUEUE.stats())
+
+def schedule_reminder_request(data):
+    """/schedule-reminder body -> (response dict, status code)."""
     try:
-        data = request.json
+        # No usable body -> 400, as in queue_sms
+        data = data if isinstance(data, dict) else {}
         phone = data.get('phone')
         days = data.get('days') # 7, 15, or 'DEMO_1_MIN'
         
         if not phone or not days:
-            return jsonify({"status": "error", "message": "Missing info"}), 400
+            return {"status": "error", "message": "Missing info"}, 400
 
         sms_body = "🌿 விவசாயி நண்பருக்கு நினைவூட்டல்\n\nஇன்று மருந்து தெளிப்பதற்கான நாள்.\nநோய் பரவாமல் இருக்க\nதயவு செய்து மருந்து தெளியுங்கள்.\n\n– Leaf Disease Alert System"
+        now = time.time()
 
         if days == 'DEMO_1_MIN':
             print(f"\n{'='*40}")
@@ -246,26 +436,53 @@ def schedule_reminder():
             print(f"REMINDER_DAYS: {days}")
             print(f"{'='*40}\n")
             
-            # Start a timer to send SMS in 5 seconds
-            def send_later():
-                print(f"\n🚀 [ACTIVATE DEMO SMS] Starting delivery to {phone}...")
-                result = sms_handler.send_sms(phone, sms_body)
-                print(f"📊 SYSTEM STATUS: {result['message']}")
-                print(f"{'='*40}\n")
-
-            timer = threading.Timer(5.0, send_later)
-            timer.start()
-            return jsonify({"status": "success", "message": "Demo reminder scheduled for 5 seconds."})
-        else:
-            print(f"\n{'='*40}")
-            print(f"✅ REMINDER SET SUCCESSFULLY")
-            print(f"CONFIRMED_MOBILE_NUMBER: {phone}")
-            print(f"REMINDER_DAYS: {days}")
-            print(f"{'='*40}\n")
-            return jsonify({"status": "success", "message": f"Reminder scheduled for {days} days."})
+            # Demo reminder goes out in 5 seconds, through the same durable queue
+            reminder_id, _ = REMINDERS.schedule(phone, sms_body, now + 5, dedup_key=f"{phone}:demo:{int(now // 60)}")
+            return {"status": "success", "message": "Demo reminder scheduled for 5 seconds.",
+                    "reminder_id": reminder_id}, 200
+
+        try:
+            days = int(days)
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "days must be a number of days or DEMO_1_MIN"}, 400
+        if not 1 <= days <= 365:
+            return {"status": "error", "message": "days must be between 1 and 365"}, 400
+
+        # Same phone + interval on the same day is one reminder (double taps, client retries)
+        dedup_key = f"{phone}:{days}:{time.strftime('%Y-%m-%d', time.localtime(now))}"
+        reminder_id, created = REMINDERS.schedule(phone, sms_body, now + days * 86400, dedup_key=dedup_key)
+        print(f"\n{'='*40}")
+        print(f"✅ REMINDER SET SUCCESSFULLY" if created else f"ℹ️  REMINDER ALREADY SCHEDULED")
+        print(f"CONFIRMED_MOBILE_NUMBER: {phone}")
+        print(f"REMINDER_DAYS: {days}")
+        print(f"{'='*40}\n")
+        return {"status": "success", "message": f"Reminder scheduled for {days} days.",
+                "reminder_id": reminder_id}, 200
 
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return {"status": "error", "message": str(e)}, 500
+
+@app.route('/schedule-reminder', methods=['POST'])
+def schedule_reminder():
+    payload, status = schedule_reminder_request(request.get_json(silent=True))
+    return jsonify(payload), status
+
+@app.route('/reminders/<int:reminder_id>')
+def reminder_status(reminder_id):
+    reminder = REMINDERS.get(reminder_id)
+    if reminder is None:
+        return jsonify({"status": "error", "message": "Unknown reminder"}), 404
+    message = SMS_QUEUE.get(reminder["message_id"]) if reminder.get("message_id") else None
+    if message is not None:
+        # "sent" on the reminder only means handed to the SMS queue; report the delivery itself
+        reminder["status"] = {"sent": "sent", "failed": "failed"}.get(message["status"], "queued")
+        reminder["last_error"] = message["error"] or reminder["last_error"]
+        reminder["sms"] = message
+    return jsonify(reminder)
+
+@app.route('/metrics/reminders')
+def reminder_metrics():
+    return jsonify(REMINDERS.stats())
 
 
 # Ensure temp directory exists (runs on import for Gunicorn)
@@ -1,8 +1,7 @@
 import os
-import base64
-import json
 from flask import Flask, request, render_template, jsonify
-from groq import Groq
+from outbound import ProviderBusyError, CircuitOpenError
+from vision_advisor import vision_advisor_from_env
 
 # Initialize Flask App
 app = Flask(__name__)
@@ -13,7 +12,9 @@ GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
 if not GROQ_API_KEY:
     print("⚠️  WARNING: GROQ_API_KEY is missing! Set it in Render dashboard.")
 
-client = Groq(api_key=GROQ_API_KEY)
+# Uploads are shrunk to VISION_MAX_SIDE / VISION_JPEG_QUALITY before they go upstream, results
+# are cached by image hash and at most OUTBOUND_GROQ_VISION_CONCURRENCY calls are in flight
+VISION = vision_advisor_from_env(GROQ_API_KEY)
 
 @app.route('/')
 def index():
@@ -26,71 +27,10 @@ def predict():
             return jsonify({"error": "No file uploaded"}), 400
             
         file = request.files['file']
-        
-        # Read and encode image
         image_data = file.read()
-        base64_image = base64.b64encode(image_data).decode('utf-8')
-        
-        # Create vision API request
-        MODEL = "llama-3.2-11b-vision-preview"
-        
-        print(f"🤖 analyzing image with {MODEL}...")
         
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """You are an expert plant pathologist. Analyze this leaf image.
-
-Identify the disease from these 8 categories ONLY:
-1. Anthracnose
-2. Bacterial spot
-3. Curl
-4. Healthy
-5. Mealybug
-6. Mite disease
-7. Ringspot
-8. Mosaic
-
-Return valid JSON with this structure:
-{
-    "condition": "Disease Name",
-    "confidence": "95%",
-    "advice_en": { "about": "...", "cause": "...", "prevention": "...", "treatment": "..." },
-    "advice_ta": { "about": "...", "cause": "...", "prevention": "...", "treatment": "..." },
-    "advice_hi": { "about": "...", "cause": "...", "prevention": "...", "treatment": "..." }
-}
-Please ensure the JSON is valid and keys match exactly.
-"""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            temperature=0.1,
-            max_tokens=1000,
-            response_format={"type": "json_object"} # Ensure JSON response
-        )
-        
-        # Parse response
-        content = response.choices[0].message.content
-        print(f"✅ AI Response: {content[:100]}...")
-        
-        try:
-            result = json.loads(content)
-        except json.JSONDecodeError:
-            # Fallback if model returns markdown block
-            clean_content = content.replace("```json", "").replace("```", "")
-            result = json.loads(clean_content)
+        print(f"🤖 analyzing image with {VISION.model}...")
+        result = VISION.diagnose(image_data)
         
         return jsonify({
             "condition": result.get("condition", "Unknown"),
@@ -101,6 +41,10 @@ Please ensure the JSON is valid and keys match exactly.
             "heatmap": ""  # No heatmap available in vision-only mode
         })
         
+    except (ProviderBusyError, CircuitOpenError) as e:
+        # Queue full or upstream failing: tell the client to retry instead of piling on
+        print(f"❌ Error: {e}")
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -110,6 +54,10 @@ Please ensure the JSON is valid and keys match exactly.
              error_msg += " (Check GROQ_API_KEY or network)"
         return jsonify({"error": error_msg}), 500
 
+@app.route('/metrics/vision')
+def vision_metrics():
+    return jsonify(VISION.stats())
+
 # Ensure temp directory exists
 os.makedirs('static/temp', exist_ok=True)
 
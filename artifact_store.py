@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import cv2
+
+FORMATS = {
+    "png": (".png", lambda q: [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+    "jpeg": (".jpg", lambda q: [cv2.IMWRITE_JPEG_QUALITY, q]),
+    "webp": (".webp", lambda q: [cv2.IMWRITE_WEBP_QUALITY, q]),
+}
+# Only files named like this are managed (and ever deleted) by the store
+_ARTIFACT_NAME = re.compile(r"^[0-9a-f]{32}\.(png|jpg|webp)$")
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ArtifactStore:
+    """
+    Bounded on-disk store for generated images (Grad-CAM overlays).
+    Images are encoded in memory and written under a content-addressed name, so every
+    result gets its own URL and identical results share one file. Old files are evicted
+    once the directory exceeds max_bytes or a file is older than max_age seconds.
+    Async heatmap jobs keep a small JSON record under jobs/, so any worker sharing the
+    directory can answer a status poll.
+    """
+    def __init__(self, root='static/temp/heatmaps', fmt="jpeg", quality=85,
+                 max_bytes=200 * 1024 * 1024, max_age=24 * 3600, evict_every=32):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported heatmap format: {fmt} (use {', '.join(FORMATS)})")
+        self.root = root
+        self.fmt = fmt
+        self.quality = int(quality)
+        self.max_bytes = int(max_bytes)
+        self.max_age = float(max_age)
+        self.evict_every = max(1, int(evict_every))
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def encode(self, image_bgr, fmt=None, quality=None):
+        """Encode an image in memory. Returns (bytes, extension)."""
+        ext, params = FORMATS[fmt or self.fmt]
+        ok, buf = cv2.imencode(ext, image_bgr, params(self.quality if quality is None else int(quality)))
+        if not ok:
+            raise ValueError(f"Could not encode heatmap as {fmt or self.fmt}")
+        return buf.tobytes(), ext
+
+    def put_image(self, image_bgr, fmt=None, quality=None):
+        """Encode and store an image; returns its URL path."""
+        data, ext = self.encode(image_bgr, fmt, quality)
+        return self.put_bytes(data, ext)
+
+    def put_bytes(self, data, ext):
+        name = hashlib.sha256(data).hexdigest()[:32] + ext
+        path = os.path.join(self.root, name)
+        if os.path.exists(path):
+            # Same content already stored: refresh its age instead of rewriting
+            os.utime(path, None)
+        else:
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.evict_every == 0
+        if due:
+            self.evict()
+        return self.url(path)
+
+    @staticmethod
+    def url(path):
+        return "/" + path.replace(os.sep, "/")
+
+    def path_for(self, url):
+        return url.lstrip("/")
+
+    def exists(self, url):
+        return bool(url) and os.path.exists(self.path_for(url))
+
+    def _job_path(self, job_id):
+        if not _JOB_ID.match(job_id or ""):
+            return None
+        return os.path.join(self.root, "jobs", job_id + ".json")
+
+    def put_job(self, job_id, record):
+        """Write a job's status record (atomically, so readers never see half of it)."""
+        path = self._job_path(job_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def get_job(self, job_id):
+        """A job's status record, or None for unknown (or expired) ids."""
+        path = self._job_path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _evict_jobs(self, now):
+        jobs = os.path.join(self.root, "jobs")
+        for name in os.listdir(jobs) if os.path.isdir(jobs) else ():
+            path = os.path.join(jobs, name)
+            try:
+                if now - os.stat(path).st_mtime > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if not _ARTIFACT_NAME.match(name):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """Delete expired files, then the oldest ones until the store fits in max_bytes."""
+        now = time.time()
+        self._evict_jobs(now)
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def stats(self):
+        entries = self._entries()
+        return {"files": len(entries), "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes, "max_age_seconds": self.max_age,
+                "format": self.fmt, "quality": self.quality}
+
+
+def artifact_store_from_env(root='static/temp/heatmaps'):
+    """HEATMAP_FORMAT / HEATMAP_QUALITY / HEATMAP_STORE_DIR / HEATMAP_STORE_MAX_MB / HEATMAP_STORE_MAX_AGE."""
+    return ArtifactStore(
+        root=os.environ.get("HEATMAP_STORE_DIR", root),
+        fmt=os.environ.get("HEATMAP_FORMAT", "jpeg").lower(),
+        quality=int(os.environ.get("HEATMAP_QUALITY", "85")),
+        max_bytes=int(float(os.environ.get("HEATMAP_STORE_MAX_MB", "200")) * 1024 * 1024),
+        max_age=float(os.environ.get("HEATMAP_STORE_MAX_AGE", str(24 * 3600))),
+    )
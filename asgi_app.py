@@ -0,0 +1,228 @@
+"""
+ASGI serving mode: the endpoints and responses of app.py on an asyncio event loop.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 2
+    gunicorn -k uvicorn.workers.UvicornWorker asgi_app:app
+
+Groq calls (vision, advice, Whisper) are awaited, so a farmer waiting on the LLM costs a
+coroutine instead of a whole worker. CPU-bound steps (model loading, inference, Grad-CAM,
+JPEG re-encoding) run on a bounded thread pool (ASGI_INFERENCE_WORKERS); short SQLite and
+disk-cache operations run on Starlette's threadpool. The model, caches, queues and router
+are the ones app.py builds, and the status / metrics endpoints are app.py's own views, so
+both modes answer the same.
+"""
+import os
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route, Mount
+from starlette.staticfiles import StaticFiles
+import app as web
+from app import (ENGINE, ROUTER, ADVISOR, AUDIO_LIMITS, HEATMAP_MODE, TRACE_HEADERS,
+                 prediction_key, cached_prediction, store_prediction, diagnosis_fields, heatmap_fields,
+                 replay, sse_event, queue_sms, schedule_reminder_request)
+from transcription import AudioUpload, AudioLimitError
+from metrics import REQUESTS, REQUEST_SECONDS, timed, record_error, start_trace, current_trace
+
+# CPU-bound work gets a few threads of its own; the event loop never runs a forward pass
+INFERENCE_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("ASGI_INFERENCE_WORKERS", "4")),
+                                    thread_name_prefix="inference")
+
+
+async def offload(fn, *args):
+    """Run a CPU-bound call on the inference pool (stage timings stay in the request trace)."""
+    return await asyncio.get_running_loop().run_in_executor(INFERENCE_POOL, contextvars.copy_context().run, fn, *args)
+
+
+def rule(path):
+    # Same endpoint labels as the Flask app in the request metrics
+    return path.replace("{reminder_id:int}", "<int:reminder_id>").replace("{", "<").replace("}", ">")
+
+
+async def trace_requests(request, call_next):
+    started = time.perf_counter()
+    start_trace(request.headers.get("X-Request-ID") or request.headers.get("X-Trace-Id"))
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = rule(route.path) if isinstance(route, Route) else "unmatched"
+    if isinstance(route, Mount):
+        endpoint = "/static/<path:filename>"
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    trace = current_trace()
+    if TRACE_HEADERS and trace is not None:
+        response.headers["X-Trace-Id"] = trace.id
+        if trace.spans:
+            response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+def flask_view(view):
+    """Serve one of app.py's cheap views (page, status, metrics) unchanged."""
+    async def endpoint(request):
+        def render():
+            with web.app.test_request_context(request.url.path, query_string=request.url.query):
+                return web.app.make_response(view(**request.path_params))
+        rv = await run_in_threadpool(render)
+        return Response(rv.get_data(), status_code=rv.status_code, headers={"Content-Type": rv.content_type})
+    return endpoint
+
+
+async def diagnose(data, heatmap_mode, tta_views, cache_key, stream_advice=False):
+    """asyncio version of app.diagnose: the same stages, with the network steps awaited."""
+    route = await ROUTER.aroute(data, {"tta": tta_views, "cam": heatmap_mode == "sync"}, INFERENCE_POOL)
+    result = diagnosis_fields(route)
+    yield "diagnosis", dict(result)
+
+    result.update(await offload(heatmap_fields, route, heatmap_mode))
+    if heatmap_mode != "none":
+        yield "heatmap", {k: v for k, v in result.items() if k.startswith("heatmap")}
+
+    with timed("advice"):
+        if stream_advice:
+            async for lang, text in ADVISOR.astream_organic_advice(route.label):
+                result["advice_" + lang] = text
+                yield "advice_" + lang, {"text": text}
+        else:
+            en, ta, hi = await ADVISOR.aget_organic_advice(route.label)
+            result.update(advice_en=en, advice_ta=ta, advice_hi=hi)
+    yield "result", await run_in_threadpool(store_prediction, cache_key, result, result.get("heatmap_job"))
+
+
+async def areplay(cached):
+    for stage in replay(cached):
+        yield stage
+
+
+async def sse(stages):
+    try:
+        async for event, payload in stages:
+            yield sse_event(event, payload)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield sse_event("error", {"error": str(e)})
+
+
+async def predict(request):
+    from heatmap import parse_heatmap_mode
+    from tta_engine import parse_augmentations
+    form = await request.form()
+    try:
+        heatmap_mode = parse_heatmap_mode(form.get('heatmap') or request.query_params.get('heatmap'), HEATMAP_MODE)
+        parse_augmentations(form.get('tta'))
+    except ValueError as e:
+        await form.close()
+        return JSONResponse({"error": str(e)}, 400)
+    stream = (request.query_params.get('stream') or form.get('stream') or "").lower() in ("1", "true", "yes", "sse")
+    try:
+        data = await form['file'].read()
+
+        # The cache key needs the model version, so this can wait for the model to load
+        tta_views, cache_key = await offload(prediction_key, data, form.get('tta'))
+        cached = await run_in_threadpool(cached_prediction, cache_key, heatmap_mode)
+
+        if stream:
+            stages = areplay(cached) if cached is not None else diagnose(data, heatmap_mode, tta_views, cache_key, stream_advice=True)
+            response = StreamingResponse(sse(stages), media_type='text/event-stream')
+            response.headers["Cache-Control"] = "no-cache"
+            response.headers["X-Accel-Buffering"] = "no"
+        else:
+            if cached is not None:
+                result = cached
+            else:
+                async for _, result in diagnose(data, heatmap_mode, tta_views, cache_key):
+                    pass
+            response = JSONResponse(result)
+        response.headers["X-Cache"] = "HIT" if cached is not None else "MISS"
+        return response
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        error_msg = str(e)
+        if "Connection error" in error_msg:
+             error_msg += " (Check GROQ_API_KEY or network)"
+        return JSONResponse({"error": error_msg}, 500)
+    finally:
+        await form.close()
+
+
+async def transcribe(request):
+    try:
+        max_bytes = AUDIO_LIMITS["max_bytes"]
+        length = int(request.headers.get("content-length") or 0)
+        if max_bytes and length > max_bytes + 64 * 1024:
+            return JSONResponse({"status": "error", "message": f"Audio is larger than {max_bytes / (1024 * 1024):.0f} MB"}, 413)
+
+        async with request.form() as form:
+            if 'file' not in form:
+                return JSONResponse({"status": "error", "message": "No file part"}, 400)
+            file = form['file']
+            if not getattr(file, "filename", ""):
+                return JSONResponse({"status": "error", "message": "No selected file"}, 400)
+
+            try:
+                audio = await run_in_threadpool(AudioUpload.from_stream, file.file, file.filename, **AUDIO_LIMITS)
+            except AudioLimitError as e:
+                return JSONResponse({"status": "error", "message": str(e)}, 413)
+
+            with audio, timed("transcribe"):
+                text = await ADVISOR.atranscribe_audio(audio)
+
+        if text:
+            return JSONResponse({"status": "success", "transcript": text})
+        record_error("transcribe")
+        return JSONResponse({"status": "error", "message": "Transcription failed"}, 500)
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 500)
+
+
+async def json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def send_sms(request):
+    payload, status = await run_in_threadpool(queue_sms, await json_body(request))
+    return JSONResponse(payload, status)
+
+
+async def schedule_reminder(request):
+    payload, status = await run_in_threadpool(schedule_reminder_request, await json_body(request))
+    return JSONResponse(payload, status)
+
+
+routes = [
+    Route('/', flask_view(web.index)),
+    Route('/predict', predict, methods=['POST']),
+    Route('/transcribe', transcribe, methods=['POST']),
+    Route('/send-sms', send_sms, methods=['POST']),
+    Route('/schedule-reminder', schedule_reminder, methods=['POST']),
+    Route('/heatmap/{job_id}', flask_view(web.heatmap_status)),
+    Route('/sms/{message_id}', flask_view(web.sms_status)),
+    Route('/reminders/{reminder_id:int}', flask_view(web.reminder_status)),
+    Route('/ready', flask_view(web.ready)),
+    Route('/metrics', flask_view(web.prometheus_metrics)),
+    Route('/metrics/cache', flask_view(web.cache_metrics)),
+    Route('/metrics/batching', flask_view(web.batching_metrics)),
+    Route('/metrics/cascade', flask_view(web.cascade_metrics)),
+    Route('/metrics/router', flask_view(web.router_metrics)),
+    Route('/metrics/outbound', flask_view(web.outbound_metrics)),
+    Route('/metrics/sms', flask_view(web.sms_metrics)),
+    Route('/metrics/reminders', flask_view(web.reminder_metrics)),
+    Mount('/static', StaticFiles(directory='static'), name='static'),
+]
+
+app = Starlette(routes=routes, middleware=[Middleware(BaseHTTPMiddleware, dispatch=trace_requests)])
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5000)
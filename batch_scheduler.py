@@ -0,0 +1,145 @@
+import os
+import time
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import Future
+import torch
+
+
+class _Job:
+    __slots__ = ("batch", "future", "enqueued")
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class InferenceScheduler:
+    """
+    Dynamic micro-batching across requests.
+    Each request submits its own [k, 3, H, W] tensor (k = number of TTA views); a single
+    dispatcher thread concatenates whatever is queued (up to max_batch_size rows or
+    max_wait_ms), runs one forward and hands every request its own softmax rows back.
+    """
+    def __init__(self, model, max_batch_size=32, max_wait_ms=5.0, softmax=True):
+        self.model = model
+        # softmax=False hands back raw logits (the model server, whose clients apply softmax)
+        self.softmax = softmax
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._pending = None
+
+        # Metrics
+        self.batches_total = 0
+        self.requests_total = 0
+        self.rows_total = 0
+        self.errors_total = 0
+        self.batch_sizes = Counter()
+        self.wait_ms_total = 0.0
+
+    def _ensure_started(self):
+        # Threads do not survive a fork (Gunicorn --preload), so start lazily per process
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pending = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+            self._thread.start()
+
+    def submit(self, batch):
+        """Queue a [k, 3, H, W] tensor. Returns a Future resolving to [k, num_classes] probabilities."""
+        self._ensure_started()
+        job = _Job(batch)
+        self._queue.put(job)
+        return job.future
+
+    def infer(self, batch, timeout=None):
+        """Blocking helper: submit and wait for the probabilities."""
+        return self.submit(batch).result(timeout=timeout)
+
+    def _collect(self):
+        # Block for the first job, then gather more until the batch is full or the window closes
+        first = self._pending or self._queue.get()
+        self._pending = None
+        jobs = [first]
+        rows = first.batch.shape[0]
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if rows + job.batch.shape[0] > self.max_batch_size:
+                # Does not fit: keep it for the next batch instead of splitting a request
+                self._pending = job
+                break
+            jobs.append(job)
+            rows += job.batch.shape[0]
+        return jobs, rows
+
+    def _run(self):
+        while True:
+            jobs, rows = self._collect()
+            started = time.perf_counter()
+            try:
+                inputs = jobs[0].batch if len(jobs) == 1 else torch.cat([j.batch for j in jobs], dim=0)
+                with torch.no_grad():
+                    probs = self.model(inputs)
+                    if self.softmax:
+                        probs = torch.nn.functional.softmax(probs, dim=1)
+                offset = 0
+                for job in jobs:
+                    k = job.batch.shape[0]
+                    job.future.set_result(probs[offset:offset + k])
+                    offset += k
+            except Exception as e:
+                self.errors_total += 1
+                for job in jobs:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            self.batches_total += 1
+            self.requests_total += len(jobs)
+            self.rows_total += rows
+            self.batch_sizes[rows] += 1
+            self.wait_ms_total += sum(started - j.enqueued for j in jobs) * 1000.0
+
+    def stats(self):
+        """Queue depth and batch-size metrics for the /metrics endpoints."""
+        batches = self.batches_total or 1
+        return {
+            "queue_depth": self._queue.qsize() + (1 if self._pending is not None else 0),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches_total": self.batches_total,
+            "requests_total": self.requests_total,
+            "rows_total": self.rows_total,
+            "errors_total": self.errors_total,
+            "avg_batch_rows": round(self.rows_total / batches, 2),
+            "avg_requests_per_batch": round(self.requests_total / batches, 2),
+            "avg_queue_wait_ms": round(self.wait_ms_total / max(self.requests_total, 1), 2),
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+        }
+
+
+def scheduler_from_env(model, softmax=True):
+    """Build the scheduler from INFERENCE_BATCHING / BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS, or None if disabled."""
+    if os.environ.get("INFERENCE_BATCHING", "1").lower() in ("0", "false", "off", "no"):
+        return None
+    return InferenceScheduler(
+        model,
+        max_batch_size=int(os.environ.get("BATCH_MAX_SIZE", "32")),
+        max_wait_ms=float(os.environ.get("BATCH_MAX_WAIT_MS", "5")),
+        softmax=softmax,
+    )
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark for the /predict path and each of its stages.
+
+    python benchmark.py --out baseline.json
+    python benchmark.py --backends eager,onnx --threads 1,4 --compare baseline.json
+
+Stages timed:
+  decode        PREPROCESSOR.decode on a JPEG of the given size
+  enhance       CLAHE + sharpening at working size
+  transform     resize + normalise to a [1, 3, 224, 224] tensor
+  forward       one batched forward per --batch-sizes entry
+  tta           TTAEngine.predict for each --tta view set (views built + one forward)
+  gradcam       Grad-CAM for one image (backends with gradients only)
+  heatmap       overlay render + in-memory encode
+  advice        get_organic_advice with Groq stubbed (--groq-latency-ms simulates the network)
+  predict       end-to-end POST /predict through the Flask test client (cache misses)
+
+Every result has p50/p95/p99/mean in milliseconds and throughput (items per second).
+--compare exits non-zero if any matching result's --metric got slower than the
+baseline by more than --tolerance (a fraction, 0.10 = 10%).
+"""
+import os
+import io
+import sys
+import glob
+import json
+import time
+import platform
+import argparse
+from types import SimpleNamespace
+import cv2
+import numpy as np
+
+MODEL_PATH = 'models/best_convnext_tiny.pth'
+NUM_CLASSES = 8
+CANNED_ADVICE = ("###ENGLISH_SECTION###\n1. Neem oil spray\n###TAMIL_SECTION###\n1. வேப்பெண்ணெய்\n"
+                 "###HINDI_SECTION###\n1. नीम का तेल")
+
+
+class StubGroq:
+    """Stands in for the Groq client: returns canned advice after an optional delay."""
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000.0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        message = SimpleNamespace(content=CANNED_ADVICE)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def parse_list(value, cast=str):
+    return [cast(v.strip()) for v in str(value).split(",") if v.strip()]
+
+
+def parse_size(value):
+    w, h = value.lower().split("x")
+    return int(w), int(h)
+
+
+def sample_jpeg(width, height, source_dir="static/uploads", quality=90):
+    """A real leaf photo scaled to width x height (smooth noise if there is none) as JPEG bytes."""
+    paths = sorted(glob.glob(os.path.join(source_dir, "*.jp*g")))
+    image = cv2.imread(paths[0]) if paths else None
+    if image is None:
+        rng = np.random.default_rng(0)
+        image = cv2.GaussianBlur(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8), (0, 0), 3)
+    image = cv2.resize(image, (width, height), interpolation=cv2.INTER_CUBIC)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def summarize(samples, items=1):
+    ms = np.array(samples) * 1000.0
+    return {
+        "n": len(samples),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "throughput_per_s": round(items * 1000.0 / float(ms.mean()), 3),
+    }
+
+
+def record(results, stage, samples, items=1, **params):
+    entry = {"stage": stage, "backend": None, "threads": None, "image_size": None, "batch_size": None}
+    entry.update(params)
+    entry.update(summarize(samples, items))
+    results.append(entry)
+    label = " ".join(f"{k}={v}" for k, v in params.items() if v is not None)
+    print(f"⏱️  {stage:<10} {label:<45} p50={entry['p50_ms']:.2f}ms p95={entry['p95_ms']:.2f}ms "
+          f"{entry['throughput_per_s']:.1f}/s", file=sys.stderr)
+
+
+def result_key(entry):
+    return (entry["stage"], entry["backend"], entry["threads"], entry["image_size"], entry["batch_size"])
+
+
+def compare(current, baseline, metric="p50_ms", tolerance=0.10):
+    """Match results by stage + parameters. Returns (rows, regressions)."""
+    base = {result_key(e): e for e in baseline.get("results", [])}
+    rows = []
+    for entry in current["results"]:
+        old = base.get(result_key(entry))
+        if old is None or not old.get(metric):
+            continue
+        change = (entry[metric] - old[metric]) / old[metric]
+        rows.append({"stage": entry["stage"], "key": list(result_key(entry)[1:]), "baseline": old[metric],
+                     "current": entry[metric], "change": round(change, 4), "regression": change > tolerance})
+    return rows, [r for r in rows if r["regression"]]
+
+
+def bench_image_stages(results, sizes, threads, iterations, warmup):
+    """Stages whose cost depends on the upload size, not on the model backend."""
+    from preprocessing import PREPROCESSOR
+    from heatmap import render_overlay
+    from artifact_store import ArtifactStore
+    store = ArtifactStore(os.path.join("cache", "benchmark"))
+    cam = cv2.GaussianBlur(np.random.default_rng(1).random((7, 7)).astype(np.float32), (3, 3), 0)
+    for width, height in sizes:
+        size = f"{width}x{height}"
+        data = sample_jpeg(width, height)
+        img = PREPROCESSOR.decode(data)
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        enhanced = PREPROCESSOR.enhance(rgb)
+        record(results, "decode", measure(lambda: PREPROCESSOR.decode(data), iterations, warmup),
+               threads=threads, image_size=size)
+        record(results, "enhance", measure(lambda: PREPROCESSOR.enhance(rgb), iterations, warmup),
+               threads=threads, image_size=size)
+        record(results, "transform", measure(lambda: PREPROCESSOR.prepare(enhanced, enhance=False), iterations, warmup),
+               threads=threads, image_size=size)
+        record(results, "heatmap", measure(lambda: store.encode(render_overlay(img, cam)), iterations, warmup),
+               threads=threads, image_size=size)
+
+
+def bench_model_stages(results, backend, model, batch_sizes, view_sets, threads, iterations, warmup):
+    import torch
+    from tta_engine import TTAEngine
+    from heatmap import GradCAM
+    from preprocessing import PREPROCESSOR
+    rng = np.random.default_rng(2)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (768, 1024, 3), dtype=np.uint8), (0, 0), 3)
+    for batch_size in batch_sizes:
+        batch = torch.randn(batch_size, 3, 224, 224)
+
+        def forward():
+            with torch.inference_mode():
+                backend(batch)
+        record(results, "forward", measure(forward, iterations, warmup), items=batch_size,
+               backend=backend.name, threads=threads, batch_size=batch_size)
+    tta = TTAEngine(backend)
+    for views in view_sets:
+        record(results, "tta", measure(lambda: tta.predict(image, views), iterations, warmup),
+               backend=backend.name, threads=threads, batch_size=len(views))
+    if backend.supports_grad:
+        gradcam = GradCAM(model, model.stages[3].blocks[-1])
+        tensor = PREPROCESSOR.prepare(image, enhance=False)
+        record(results, "gradcam", measure(lambda: gradcam.generate(tensor, 0), iterations, warmup),
+               backend=backend.name, threads=threads, batch_size=1)
+
+
+def bench_advice(results, latency_ms, iterations, warmup):
+    from llm_advisor import CaricaCareAdvisor
+    advisor = CaricaCareAdvisor("benchmark")
+    advisor.client = StubGroq(latency_ms)
+    record(results, "advice", measure(lambda: advisor.get_organic_advice("Anthracnose"), iterations, warmup))
+
+
+def bench_predict(results, sizes, backend, threads, latency_ms, iterations, warmup):
+    """End-to-end POST /predict. Each request gets unique bytes so the prediction cache never hits."""
+    os.environ["INFERENCE_BACKEND"] = backend
+    # Importing the app must not start its background work against real services: no advice
+    # warmup (Groq), no SMS / reminder dispatchers, and no vision-model routing
+    os.environ.update(ADVICE_WARMUP="0", SMS_DISPATCHER="0", REMINDER_DISPATCHER="0", ROUTER_MODE="local")
+    import app as webapp
+    webapp.ADVISOR.cache = None
+    webapp.ADVISOR.client = StubGroq(latency_ms)
+    client = webapp.app.test_client()
+    counter = [0]
+    for width, height in sizes:
+        data = sample_jpeg(width, height)
+
+        def post():
+            counter[0] += 1
+            # Trailing bytes after the JPEG EOI marker are ignored by decoders but change the cache key
+            body = data + counter[0].to_bytes(8, "little")
+            response = client.post('/predict', data={"file": (io.BytesIO(body), "leaf.jpg")},
+                                   content_type='multipart/form-data')
+            if response.status_code != 200:
+                raise RuntimeError(f"/predict returned {response.status_code}: {response.get_data(as_text=True)}")
+        record(results, "predict", measure(post, iterations, warmup),
+               backend=backend, threads=threads, image_size=f"{width}x{height}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the leaf diagnosis pipeline")
+    parser.add_argument("--weights", default=MODEL_PATH)
+    parser.add_argument("--image-sizes", default="1024x768,4032x3024", help="upload sizes, WxH comma separated")
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument("--tta", default="identity;identity,hflip,rot+5,rot-5", help="view sets, ';' separated")
+    parser.add_argument("--threads", default=None, help="torch thread counts (default: current)")
+    parser.add_argument("--backends", default="eager", help="eager,torchscript,onnx,int8-dynamic,onnx-int8")
+    parser.add_argument("--stages", default="image,model,advice,predict", help="groups to run")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--groq-latency-ms", type=float, default=0.0, help="simulated Groq latency")
+    parser.add_argument("--out", help="write the JSON report here (also printed to stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against a saved report")
+    parser.add_argument("--metric", default="p50_ms", choices=("p50_ms", "p95_ms", "p99_ms", "mean_ms"))
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    import torch
+    from model_loader import build_model
+    from inference_service import configure_threads
+    from inference_backends import load_backend
+
+    sizes = [parse_size(s) for s in parse_list(args.image_sizes)]
+    batch_sizes = parse_list(args.batch_sizes, int)
+    view_sets = [tuple(parse_list(v)) for v in args.tta.split(";") if v.strip()]
+    thread_counts = parse_list(args.threads, int) if args.threads else [torch.get_num_threads()]
+    backends = parse_list(args.backends)
+    stages = set(parse_list(args.stages))
+
+    model, loaded = build_model(args.weights, NUM_CLASSES)
+    if not loaded:
+        print("⚠️  Benchmarking an untrained model (timings are still representative)", file=sys.stderr)
+
+    results = []
+    for threads in thread_counts:
+        configure_threads(threads)
+        if "image" in stages:
+            bench_image_stages(results, sizes, threads, args.iterations, args.warmup)
+        if "model" in stages:
+            for name in backends:
+                try:
+                    backend = load_backend(name, model, threads=threads)
+                except (ImportError, OSError) as e:
+                    print(f"⚠️  Skipping backend {name}: {e}", file=sys.stderr)
+                    continue
+                bench_model_stages(results, backend, model, batch_sizes, view_sets, threads,
+                                   args.iterations, args.warmup)
+    if "advice" in stages:
+        bench_advice(results, args.groq_latency_ms, args.iterations, args.warmup)
+    if "predict" in stages:
+        # The app builds its engine once per process, so this uses the first backend / last thread count
+        bench_predict(results, sizes, backends[0], thread_counts[-1], args.groq_latency_ms,
+                      args.iterations, args.warmup)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "torch": torch.__version__, "opencv": cv2.__version__,
+            "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "iterations": args.iterations, "warmup": args.warmup, "weights_loaded": loaded,
+        },
+        "results": results,
+    }
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows, regressions = compare(report, baseline, args.metric, args.tolerance)
+        report["comparison"] = {"baseline": args.compare, "metric": args.metric, "tolerance": args.tolerance,
+                                "rows": rows, "regressions": len(regressions)}
+        for row in rows:
+            mark = "❌" if row["regression"] else "✅"
+            print(f"{mark} {row['stage']:<10} {row['key']} {row['baseline']:.2f} -> {row['current']:.2f}ms "
+                  f"({row['change']:+.1%})", file=sys.stderr)
+        if regressions:
+            exit_code = 1
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Offline bulk diagnosis: re-score a folder (or manifest) of leaf images with LeafAnalyzer.
+
+    python bulk_diagnose.py static/uploads --out results.csv
+    python bulk_diagnose.py season.txt --out season.parquet --workers 4 --threads 2 --heatmaps
+
+Images are split into tasks of --batch-size * --batches-per-task paths and handed to a
+process pool. Each worker pins itself to --threads cores, decodes its images with a
+small prefetching thread pool (decoding the next batch while the current one runs
+through the model) and does one batched forward per batch. Results are appended and
+flushed after every task, so an interrupted run picks up where it stopped (a torn last
+row and rows with errors are dropped and redone); use --restart to ignore existing
+results. Rows are written in completion order.
+
+Outputs: .csv and .jsonl are appended directly. For .parquet, rows are checkpointed to
+<out>.partial.jsonl and converted at the end (needs pandas + pyarrow).
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+MODEL_PATH = 'models/best_convnext_tiny.pth'
+CLASSES = ["Anthracnose", "Bacterial spot", "Curl", "Healthy", "Mealybug", "Mite disease", "Ringspot", "Mosaic"]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+FORMATS = ("csv", "jsonl", "parquet")
+
+# Per-process state, set by init_worker
+_analyzer = None
+_options = None
+
+
+def list_images(source):
+    """Image paths from a directory (recursive) or a manifest (.txt, or .csv with a 'path' column)."""
+    if os.path.isdir(source):
+        return sorted(os.path.join(root, name)
+                      for root, _, names in os.walk(source)
+                      for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+    with open(source, newline="", encoding="utf-8") as f:
+        if source.lower().endswith(".csv"):
+            return [row["path"] for row in csv.DictReader(f) if row.get("path")]
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def output_format(path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown output format '{fmt}' (use {', '.join(FORMATS)})")
+    return fmt
+
+
+def checkpoint_path(out, fmt):
+    """File the rows are appended to while running (the output itself for csv/jsonl)."""
+    return out + ".partial.jsonl" if fmt == "parquet" else out
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def read_rows(path, fmt):
+    """
+    (rows, dropped) of an earlier run's output. Rows that can not be trusted are dropped:
+    a torn last row from a killed run (no trailing newline, missing fields, bad JSON) and
+    rows with an error, so those images are tried again.
+    """
+    rows = []
+    dropped = 0
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            parsed = list(csv.DictReader(f))
+        else:
+            parsed = []
+            for line in f:
+                try:
+                    parsed.append(json.loads(line))
+                except ValueError:
+                    parsed.append(None)
+    if parsed and not _ends_with_newline(path):
+        parsed.pop()
+        dropped += 1
+    for row in parsed:
+        complete = isinstance(row, dict) and row.get("path") and None not in row and \
+            (fmt != "csv" or None not in row.values())
+        if complete and not row.get("error"):
+            rows.append(row)
+        else:
+            dropped += 1
+    return rows, dropped
+
+
+def read_done(path, fmt):
+    """Paths already scored in an earlier (possibly interrupted) run."""
+    if not os.path.exists(path):
+        return set()
+    return {row["path"] for row in read_rows(path, fmt)[0]}
+
+
+def columns(labels):
+    return ["path", "label", "confidence"] + [f"prob_{label}" for label in labels] + ["heatmap", "error"]
+
+
+class ResultWriter:
+    """Append-only csv/jsonl writer, flushed and fsync'd after every task."""
+    def __init__(self, path, fmt, labels):
+        self.fmt = "csv" if fmt == "csv" else "jsonl"
+        self.columns = columns(labels)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            self._compact(path)
+        self.file = open(path, "a", newline="", encoding="utf-8")
+        if self.fmt == "csv":
+            self.writer = csv.DictWriter(self.file, fieldnames=self.columns)
+            if new:
+                self.writer.writeheader()
+
+    def _compact(self, path):
+        """Rewrite an earlier run's output without the rows read_done did not count as done."""
+        rows, dropped = read_rows(path, self.fmt)
+        if not dropped:
+            return
+        tmp = path + ".tmp"
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            if self.fmt == "csv":
+                writer = csv.DictWriter(f, fieldnames=self.columns, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == "csv":
+                self.writer.writerow(row)
+            else:
+                self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def _pandas():
+    try:
+        import pandas
+        import pyarrow
+    except ImportError:
+        raise ImportError("pandas and pyarrow are required for parquet output (pip install pandas pyarrow)")
+    return pandas
+
+
+def to_parquet(partial, out):
+    pd = _pandas()
+    rows = []
+    with open(partial, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue
+    pd.DataFrame(rows, columns=columns(CLASSES)).to_parquet(out, index=False)
+
+
+def pin_threads(slot, threads):
+    """Limit torch/OpenCV threads and, where supported, bind this process to its own cores."""
+    import cv2
+    from inference_service import configure_threads
+    configure_threads(threads, 1)
+    # Decoding already runs on the prefetch threads
+    cv2.setNumThreads(1)
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        start = (slot * threads) % len(cpus)
+        cores = {cpus[(start + i) % len(cpus)] for i in range(threads)}
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError:
+            pass
+
+
+def init_worker(options, counter):
+    global _analyzer, _options
+    with counter.get_lock():
+        slot = counter.value
+        counter.value += 1
+    if options["pin"]:
+        pin_threads(slot, options["threads"])
+    else:
+        from inference_service import configure_threads
+        configure_threads(options["threads"])
+    from artifact_store import ArtifactStore
+    from model_engine import LeafAnalyzer
+    store = None
+    if options["heatmap_dir"]:
+        # Bulk runs keep every overlay: no size/age eviction
+        store = ArtifactStore(options["heatmap_dir"], max_bytes=1 << 62, max_age=float("inf"))
+    _analyzer = LeafAnalyzer(options["weights"], options["labels"], store=store)
+    _options = options
+
+
+def prefetch(paths, load, workers, depth):
+    """Yield (path, result, error) in order while up to depth images decode ahead."""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as pool:
+        pending = deque()
+        items = iter(paths)
+        for path in items:
+            pending.append((path, pool.submit(load, path)))
+            if len(pending) >= depth:
+                break
+        while pending:
+            path, future = pending.popleft()
+            nxt = next(items, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(load, nxt)))
+            try:
+                yield path, future.result(), None
+            except Exception as e:
+                yield path, None, str(e)
+
+
+def score_batch(batch):
+    """Rows for one batch of (path, (raw_bgr, rgb_at_input_size)) pairs."""
+    labels = _options["labels"]
+    probs = _analyzer.predict_batch([rgb for _, (_, rgb) in batch])
+    indices = probs.argmax(dim=1).tolist()
+    heatmaps = [""] * len(batch)
+    if _options["heatmap_dir"]:
+        try:
+            heatmaps = _analyzer.heatmap_batch([raw for _, (raw, _) in batch], [rgb for _, (_, rgb) in batch], indices)
+        except Exception as e:
+            print(f"Heatmap Error: {e}")
+    rows = []
+    for (path, _), p, idx, heatmap in zip(batch, probs.tolist(), indices, heatmaps):
+        row = {"path": path, "label": labels[idx], "confidence": round(p[idx], 6), "heatmap": heatmap, "error": ""}
+        row.update({f"prob_{label}": round(v, 6) for label, v in zip(labels, p)})
+        rows.append(row)
+    return rows
+
+
+def run_task(paths):
+    """Score one task's paths in batches. Decode failures become rows with an error."""
+    batch_size = _options["batch_size"]
+    load = lambda path: _analyzer.load(path, enhance=_options["enhance"])
+    rows = []
+    batch = []
+    for path, loaded, error in prefetch(paths, load, _options["decode_threads"], 2 * batch_size):
+        if error:
+            rows.append({"path": path, "label": "", "confidence": None, "heatmap": "", "error": error})
+            continue
+        batch.append((path, loaded))
+        if len(batch) == batch_size:
+            rows.extend(score_batch(batch))
+            batch = []
+    if batch:
+        rows.extend(score_batch(batch))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-diagnose a folder or manifest of papaya leaf images")
+    parser.add_argument("source", help="image directory, .txt manifest (one path per line) or .csv with a 'path' column")
+    parser.add_argument("--out", default="results.csv", help="output file (.csv, .jsonl or .parquet)")
+    parser.add_argument("--format", choices=FORMATS, help="output format (default: from the --out extension)")
+    parser.add_argument("--weights", default=MODEL_PATH)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="model processes")
+    parser.add_argument("--threads", type=int, default=2, help="torch threads per process")
+    parser.add_argument("--no-pin", action="store_true", help="do not bind processes to CPU cores")
+    parser.add_argument("--decode-threads", type=int, default=2, help="prefetching decoder threads per process")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--batches-per-task", type=int, default=4, help="batches per checkpoint unit")
+    parser.add_argument("--enhance", action="store_true", help="apply the app's CLAHE + sharpening before inference")
+    parser.add_argument("--heatmaps", nargs="?", const="static/heatmaps", default=None, metavar="DIR",
+                        help="also write Grad-CAM overlays (default dir: static/heatmaps)")
+    parser.add_argument("--restart", action="store_true", help="ignore results from an earlier run")
+    args = parser.parse_args(argv)
+
+    fmt = output_format(args.out, args.format)
+    if fmt == "parquet":
+        # Fail before scoring, not after a night of work
+        _pandas()
+    if not os.path.exists(args.weights):
+        print(f"❌ Model not found at {args.weights}")
+        return 1
+    partial = checkpoint_path(args.out, fmt)
+    if args.restart and os.path.exists(partial):
+        os.remove(partial)
+
+    paths = list_images(args.source)
+    done = read_done(partial, fmt)
+    todo = [p for p in paths if p not in done]
+    print(f"🔍 {len(paths)} images, {len(done)} already scored, {len(todo)} to go")
+
+    options = {
+        "weights": args.weights, "labels": CLASSES, "threads": max(1, args.threads), "pin": not args.no_pin,
+        "decode_threads": max(1, args.decode_threads), "batch_size": max(1, args.batch_size),
+        "enhance": args.enhance, "heatmap_dir": args.heatmaps,
+    }
+    task_size = options["batch_size"] * max(1, args.batches_per_task)
+    tasks = [todo[i:i + task_size] for i in range(0, len(todo), task_size)]
+    writer = ResultWriter(partial, fmt, CLASSES)
+    started = time.perf_counter()
+    scored = 0
+    pool = None
+    try:
+        if args.workers <= 1:
+            init_worker(options, multiprocessing.Value("i", 0))
+            results = map(run_task, tasks)
+        else:
+            # spawn: forking a process that may already hold torch/OpenMP threads is unsafe
+            ctx = multiprocessing.get_context("spawn")
+            pool = ctx.Pool(args.workers, initializer=init_worker, initargs=(options, ctx.Value("i", 0)))
+            results = pool.imap_unordered(run_task, tasks)
+        for rows in results:
+            writer.write(rows)
+            scored += len(rows)
+            rate = scored / max(time.perf_counter() - started, 1e-9)
+            print(f"✅ {scored}/{len(todo)} ({rate:.1f} img/s)")
+        if pool is not None:
+            pool.close()
+            pool.join()
+    except KeyboardInterrupt:
+        print("⚠️  Interrupted, rerun the same command to resume")
+        if pool is not None:
+            pool.terminate()
+        return 130
+    finally:
+        writer.close()
+
+    if fmt == "parquet":
+        to_parquet(partial, args.out)
+        os.remove(partial)
+        print(f"✅ Wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Inference cascade with early exit.
+
+    fast (single view, cheap model) --margin >= CASCADE_FAST_MARGIN--> answer
+        |
+    full TTA ConvNeXt ---------------margin >= CASCADE_TTA_MARGIN---> answer  (only if an ensemble follows)
+        |
+    weighted ensemble of checkpoints --------------------------------> answer
+
+The margin is top-1 minus top-2 probability. Clear-cut leaves stop after one cheap
+forward; only ambiguous ones pay for the four-view TTA (and the ensemble).
+"""
+import os
+import threading
+import torch
+from metrics import CASCADE_EXITS
+
+
+def margin(prob):
+    """Top-1 minus top-2 probability of a 1-D probability vector."""
+    top = torch.topk(prob, 2).values
+    return (top[0] - top[1]).item()
+
+
+class Ensemble:
+    """Weighted average of the probabilities of several TTA engines (checkpoints or backbones)."""
+    def __init__(self, engines, weights=None):
+        self.engines = list(engines)
+        weights = list(weights) if weights else [1.0] * len(self.engines)
+        if len(weights) != len(self.engines):
+            raise ValueError(f"Ensemble has {len(self.engines)} models but {len(weights)} weights")
+        total = float(sum(weights))
+        self.weights = [w / total for w in weights]
+
+    def predict(self, image, augmentations=None, known=None):
+        return self.predict_many([image], augmentations, [known] if known else None)[0]
+
+    def predict_many(self, images, augmentations=None, known=None):
+        """
+        [N, num_classes] probabilities. known: one {engine: prob} dict per image with results
+        an earlier cascade stage already computed (those engines are not run again).
+        """
+        known = known or [{} for _ in images]
+        total = 0
+        for engine, weight in zip(self.engines, self.weights):
+            if all(engine in k for k in known):
+                probs = torch.stack([k[engine] for k in known])
+            else:
+                probs = engine.predict_many(images, augmentations)
+            total = total + weight * probs
+        return total
+
+
+class CascadeStage:
+    """
+    One stage: an engine with predict(image, augmentations) and the margin needed to stop
+    there (None for the last stage). Fixed augmentations override the caller's TTA choice.
+    """
+    def __init__(self, name, engine, threshold=None, augmentations=None):
+        self.name = name
+        self.engine = engine
+        self.threshold = threshold
+        self.augmentations = augmentations
+        self.entered = 0
+        self.exited = 0
+
+
+class Cascade:
+    def __init__(self, stages):
+        if not stages:
+            raise ValueError("A cascade needs at least one stage")
+        self.stages = list(stages)
+        self._lock = threading.Lock()
+
+    def predict(self, image, augmentations=None, gradcam=None):
+        """
+        Run stages until one is confident enough. Returns (prob, idx, cam, stage name).
+        With a GradCAM, the last stage uses predict_with_cam so an escalated image gets its
+        CAM from the same forward; earlier exits return cam=None.
+        """
+        return self.predict_many([image], augmentations, gradcam)[0]
+
+    def predict_many(self, images, augmentations=None, gradcam=None):
+        """predict() for a batch: each stage runs once on all images it still has to decide."""
+        results = [None] * len(images)
+        known = [{} for _ in images]
+        pending = list(range(len(images)))
+        for i, stage in enumerate(self.stages):
+            last = i == len(self.stages) - 1
+            views = stage.augmentations or augmentations
+            batch = [images[j] for j in pending]
+            cams = [None] * len(batch)
+            if last and gradcam is not None and hasattr(stage.engine, "predict_with_cam"):
+                outputs = [stage.engine.predict_with_cam(image, gradcam, views) for image in batch]
+                probs = [prob for prob, _, _ in outputs]
+                cams = [cam for _, _, cam in outputs]
+            elif isinstance(stage.engine, Ensemble):
+                # The main model's TTA result from the previous stage is one of the members
+                probs = stage.engine.predict_many(batch, views, [known[j] for j in pending])
+            else:
+                probs = stage.engine.predict_many(batch, views)
+            undecided = []
+            for j, prob, cam in zip(pending, probs, cams):
+                known[j][stage.engine] = prob
+                if last or margin(prob) >= stage.threshold:
+                    results[j] = (prob, torch.argmax(prob).item(), cam, stage.name)
+                else:
+                    undecided.append(j)
+            exited = len(pending) - len(undecided)
+            with self._lock:
+                stage.entered += len(pending)
+                stage.exited += exited
+            if exited:
+                CASCADE_EXITS.inc(exited, stage=stage.name)
+            pending = undecided
+            if not pending:
+                break
+        return results
+
+    def signature(self):
+        """Identifies the configuration (part of the prediction cache version)."""
+        return "cascade:" + ",".join(f"{s.name}@{s.threshold}" for s in self.stages)
+
+    def stats(self):
+        total = self.stages[0].entered
+        stages = []
+        for stage in self.stages:
+            stages.append({
+                "name": stage.name,
+                "threshold": stage.threshold,
+                "entered": stage.entered,
+                "exited": stage.exited,
+                # Share of the images reaching this stage that it answered / share of all images
+                "hit_rate": round(stage.exited / stage.entered, 4) if stage.entered else 0.0,
+                "share": round(stage.exited / total, 4) if total else 0.0,
+            })
+        return {"predictions": total, "stages": stages}
+
+
+def _model_spec(spec):
+    """'arch:path' or just 'path' (same backbone as the main model)."""
+    arch, sep, path = spec.partition(":")
+    return (arch, path) if sep else ("convnext_tiny", spec)
+
+
+def _fast_engine(spec, num_classes):
+    from inference_backends import BACKENDS, EagerBackend, load_backend
+    from batch_scheduler import scheduler_from_env
+    from model_loader import build_model
+    from tta_engine import TTAEngine
+    if spec.lower() in BACKENDS:
+        # An exported / quantized copy of the main ConvNeXt (export_model.py)
+        backend = load_backend(spec)
+    else:
+        arch, path = _model_spec(spec)
+        model, loaded = build_model(path, num_classes=num_classes, arch=arch)
+        if not loaded:
+            raise FileNotFoundError(f"fast stage checkpoint not found at {path}")
+        backend = EagerBackend(model)
+    return TTAEngine(backend, augmentations=("identity",), scheduler=scheduler_from_env(backend))
+
+
+def cascade_from_env(tta, num_classes=8):
+    """
+    INFERENCE_CASCADE=1 turns the cascade on around the main TTA engine; returns None when off.
+    CASCADE_FAST: exported backend name (int8-dynamic, onnx-int8, ...) or arch:checkpoint of a smaller timm model
+    CASCADE_FAST_MARGIN (default 0.5): margin at which the fast stage answers
+    CASCADE_ENSEMBLE: comma separated extra checkpoints (arch:path) averaged with the main model
+    CASCADE_ENSEMBLE_WEIGHTS: one weight per model, main model first (default equal)
+    CASCADE_TTA_MARGIN (default 0.3): margin at which the full TTA answers when an ensemble follows
+    """
+    if os.environ.get("INFERENCE_CASCADE", "0").lower() in ("0", "false", "off", "no"):
+        return None
+    from model_loader import build_model
+    from inference_backends import EagerBackend
+    from tta_engine import TTAEngine
+
+    stages = []
+    fast = os.environ.get("CASCADE_FAST", "int8-dynamic").strip()
+    if fast:
+        try:
+            stages.append(CascadeStage("fast", _fast_engine(fast, num_classes),
+                                       float(os.environ.get("CASCADE_FAST_MARGIN", "0.5")), ("identity",)))
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            print(f"⚠️  Cascade fast stage '{fast}' unavailable ({e}), starting at full TTA")
+
+    members = [s.strip() for s in os.environ.get("CASCADE_ENSEMBLE", "").split(",") if s.strip()]
+    engines = [tta]
+    for spec in members:
+        arch, path = _model_spec(spec)
+        model, loaded = build_model(path, num_classes=num_classes, arch=arch)
+        if not loaded:
+            print(f"⚠️  Ensemble checkpoint {path} not found, skipped")
+            continue
+        engines.append(TTAEngine(EagerBackend(model), augmentations=tta.augmentations))
+    if len(engines) > 1:
+        weights = [float(w) for w in os.environ.get("CASCADE_ENSEMBLE_WEIGHTS", "").split(",") if w.strip()]
+        if weights and len(weights) != len(engines):
+            print(f"⚠️  CASCADE_ENSEMBLE_WEIGHTS has {len(weights)} weights for {len(engines)} models, using equal weights")
+            weights = None
+        stages.append(CascadeStage("tta", tta, float(os.environ.get("CASCADE_TTA_MARGIN", "0.3"))))
+        stages.append(CascadeStage("ensemble", Ensemble(engines, weights)))
+    else:
+        stages.append(CascadeStage("tta", tta))
+    print("✅ Inference cascade: " + " -> ".join(stage.name for stage in stages))
+    return Cascade(stages)
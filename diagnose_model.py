@@ -1,62 +1,31 @@
-import torch
-import timm
 import numpy as np
-from torchvision import transforms
-from PIL import Image
-import os
-
-# Model setup
-MODEL_PATH = 'models/best_convnext_tiny.pth'
-CLASSES = ["Anthracnose", "Bacterial spot", "Curl", "Healthy", "Mealybug", "Mite disease", "Ringspot", "Mosaic"]
-
-device = torch.device("cpu")
-model = timm.create_model('convnext_tiny', pretrained=False, num_classes=8)
+from inference_service import InferenceService, MODEL_PATH, CLASSES
 
 print("=" * 60)
 print("MODEL DIAGNOSTIC TEST")
 print("=" * 60)
 
-# Load model
-if os.path.exists(MODEL_PATH):
-    state_dict = torch.load(MODEL_PATH, map_location=device)
-    model.load_state_dict(state_dict)
-    model.eval()
-    print("✅ Model loaded successfully")
-else:
+# Load model (same loading, preprocessing and backend as the web app)
+service = InferenceService(MODEL_PATH, CLASSES, batching=False)
+if not service.loaded:
     print(f"❌ Model not found at {MODEL_PATH}")
     exit(1)
+model = service.model
 
 # Test with random inputs
 print("\n" + "=" * 60)
 print("TEST 1: Random Input Predictions")
 print("=" * 60)
 
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+# Test with 5 different random images, predicted as one batch
+random_images = [np.random.randint(0, 255, (224, 224, 3), dtype=np.uint8) for _ in range(5)]
 
-# Test with 5 different random images
-for i in range(5):
-    # Create random RGB image
-    random_array = np.random.randint(0, 255, (224, 224, 3), dtype=np.uint8)
-    random_img = Image.fromarray(random_array)
-    
-    # Transform and predict
-    input_tensor = transform(random_img).unsqueeze(0)
-    
-    with torch.no_grad():
-        output = model(input_tensor)
-        probabilities = torch.nn.functional.softmax(output[0], dim=0)
-        predicted_idx = torch.argmax(probabilities).item()
-        confidence = probabilities[predicted_idx].item()
-    
+for i, prediction in enumerate(service.predict(random_images)):
     print(f"\nRandom Image {i+1}:")
-    print(f"  Predicted: {CLASSES[predicted_idx]}")
-    print(f"  Confidence: {confidence*100:.2f}%")
+    print(f"  Predicted: {prediction.label}")
+    print(f"  Confidence: {prediction.confidence*100:.2f}%")
     print(f"  All probabilities:")
-    for idx, prob in enumerate(probabilities):
+    for idx, prob in enumerate(prediction.prob):
         print(f"    {CLASSES[idx]}: {prob.item()*100:.2f}%")
 
 # Test model weights statistics
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Export best_convnext_tiny.pth to faster CPU inference formats.
+
+    python export_model.py --format all --calib-dir static/uploads --holdout-dir data/holdout --check
+
+Formats:
+  torchscript   frozen fp32 TorchScript
+  onnx          fp32 ONNX (dynamic batch axis)
+  int8-dynamic  TorchScript with dynamically quantized int8 Linear layers
+  onnx-int8     ONNX Runtime static int8 quantization, calibrated on real leaf images
+
+--check compares every export against the eager model (top-1 agreement and max
+probability difference) on held-out images the int8 calibration did not see, and exits
+non-zero if agreement drops below --min-agreement.
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+import torch
+import timm
+import cv2
+import numpy as np
+from inference_backends import DEFAULT_PATHS, load_backend
+from preprocessing import PREPROCESSOR
+
+MODEL_PATH = 'models/best_convnext_tiny.pth'
+NUM_CLASSES = 8
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def load_eager(weights):
+    model = timm.create_model('convnext_tiny', pretrained=False, num_classes=NUM_CLASSES)
+    if weights and os.path.exists(weights):
+        model.load_state_dict(torch.load(weights, map_location="cpu"))
+    else:
+        print(f"⚠️  Weights not found at {weights}, exporting an untrained model")
+    return model.eval()
+
+
+def image_paths(folder):
+    if not folder:
+        return []
+    return sorted(p for p in glob.glob(os.path.join(folder, "**", "*"), recursive=True)
+                  if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def split_paths(paths, holdout_fraction):
+    """(calibration, held-out): every k-th image is held out, so both sets cover every class folder."""
+    if holdout_fraction <= 0 or len(paths) < 2:
+        return paths, []
+    step = max(2, int(round(1.0 / holdout_fraction)))
+    return ([p for i, p in enumerate(paths) if i % step != step - 1],
+            [p for i, p in enumerate(paths) if i % step == step - 1])
+
+
+def image_batches(paths, batch_size=8):
+    """Preprocessed [B, 3, 224, 224] batches from image files (unreadable files are skipped)."""
+    tensors = []
+    for path in paths:
+        try:
+            # Same working-size decode as /predict, so calibration sees the same pixels
+            img = PREPROCESSOR.read(path)
+        except (OSError, ValueError):
+            continue
+        # Same CLAHE + sharpening the server applies before inference
+        tensors.append(PREPROCESSOR.prepare(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)))
+    if not tensors:
+        return []
+    return list(torch.split(torch.cat(tensors), batch_size))
+
+
+def random_batches(limit, batch_size=8, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return [torch.randn(batch_size, 3, 224, 224, generator=generator) for _ in range(max(1, limit // batch_size))]
+
+
+def calibration_batches(calib_dir, limit, batch_size=8, holdout_dir=None, holdout_fraction=0.25):
+    """
+    (calibration, parity) batches. The parity check runs on images the int8 calibration
+    never saw: --holdout-dir if given, otherwise a slice split off the calibration folder.
+    Random inputs (different seeds for the two sets) when there are no images.
+    """
+    paths = image_paths(calib_dir)[:limit]
+    holdout = image_paths(holdout_dir)[:limit] if holdout_dir else []
+    if not holdout:
+        paths, holdout = split_paths(paths, holdout_fraction)
+    calibration = image_batches(paths, batch_size)
+    if not calibration:
+        print("⚠️  No calibration images found, using random inputs (int8 accuracy will suffer)")
+        calibration = random_batches(limit, batch_size, seed=0)
+    check = image_batches(holdout, batch_size)
+    if not check:
+        print("⚠️  No held-out images for the parity check, using random inputs")
+        check = random_batches(limit, batch_size, seed=1)
+    return calibration, check
+
+
+def export_torchscript(model, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.randn(1, 3, 224, 224))
+        traced = torch.jit.freeze(traced)
+    traced.save(path)
+
+
+def export_onnx(model, path):
+    with torch.no_grad():
+        torch.onnx.export(
+            model, torch.randn(1, 3, 224, 224), path,
+            input_names=["input"], output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=17, dynamo=False,
+        )
+
+
+def export_int8_dynamic(model, path):
+    # ConvNeXt spends most of its FLOPs in the MLP Linear layers, which quantize well dynamically
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized, torch.randn(1, 3, 224, 224))
+    traced.save(path)
+
+
+def export_onnx_int8(model, path, batches):
+    try:
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError:
+        raise ImportError("onnxruntime is required for onnx-int8 (pip install onnxruntime)")
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.items = iter([{"input": b.numpy()} for b in batches])
+
+        def get_next(self):
+            return next(self.items, None)
+
+    fp32_path = DEFAULT_PATHS["onnx"]
+    if not os.path.exists(fp32_path):
+        export_onnx(model, fp32_path)
+    prepped = path + ".prep.onnx"
+    quant_pre_process(fp32_path, prepped)
+    try:
+        quantize_static(prepped, path, Reader(), quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    finally:
+        if os.path.exists(prepped):
+            os.remove(prepped)
+
+
+def parity(model, backend, batches):
+    """Top-1 agreement and max softmax difference of a backend against the eager model."""
+    agree = total = 0
+    max_diff = 0.0
+    with torch.no_grad():
+        for batch in batches:
+            ref = torch.softmax(model(batch), dim=1)
+            out = torch.softmax(backend(batch).float(), dim=1)
+            agree += (ref.argmax(1) == out.argmax(1)).sum().item()
+            total += batch.shape[0]
+            max_diff = max(max_diff, (ref - out).abs().max().item())
+    return {"agreement": agree / max(total, 1), "max_prob_diff": round(max_diff, 6), "samples": total}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the ConvNeXt leaf model for fast CPU inference")
+    parser.add_argument("--weights", default=MODEL_PATH)
+    parser.add_argument("--format", default="all", choices=("all",) + tuple(DEFAULT_PATHS))
+    parser.add_argument("--out-dir", default=os.path.dirname(DEFAULT_PATHS["onnx"]))
+    parser.add_argument("--calib-dir", default="static/uploads", help="folder of leaf images for int8 calibration")
+    parser.add_argument("--calib-limit", type=int, default=64)
+    parser.add_argument("--holdout-dir", help="leaf images for the parity check (default: split off --calib-dir)")
+    parser.add_argument("--holdout-fraction", type=float, default=0.25,
+                        help="share of --calib-dir held out for the parity check when --holdout-dir is not given")
+    parser.add_argument("--check", action="store_true", help="run the accuracy-parity check after exporting")
+    parser.add_argument("--min-agreement", type=float, default=0.98)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for fmt in DEFAULT_PATHS:
+        DEFAULT_PATHS[fmt] = os.path.join(args.out_dir, os.path.basename(DEFAULT_PATHS[fmt]))
+
+    model = load_eager(args.weights)
+    formats = list(DEFAULT_PATHS) if args.format == "all" else [args.format]
+    batches, check_batches = calibration_batches(args.calib_dir, args.calib_limit, holdout_dir=args.holdout_dir,
+                                                 holdout_fraction=args.holdout_fraction)
+
+    report = {}
+    for fmt in formats:
+        path = DEFAULT_PATHS[fmt]
+        print(f"📦 Exporting {fmt} -> {path}")
+        try:
+            if fmt == "torchscript":
+                export_torchscript(model, path)
+            elif fmt == "onnx":
+                export_onnx(model, path)
+            elif fmt == "int8-dynamic":
+                export_int8_dynamic(model, path)
+            else:
+                export_onnx_int8(model, path, batches)
+        except Exception as e:
+            print(f"❌ {fmt} export failed: {e}")
+            report[fmt] = {"error": str(e)}
+            continue
+        report[fmt] = {"path": path, "size_mb": round(os.path.getsize(path) / (1024 * 1024), 2)}
+        if args.check:
+            report[fmt].update(parity(model, load_backend(fmt, path=path), check_batches))
+        print(f"✅ {fmt}: {report[fmt]}")
+
+    print(json.dumps(report, indent=2))
+    failed = [f for f, r in report.items() if "error" in r or r.get("agreement", 1.0) < args.min_agreement]
+    if failed:
+        print(f"❌ Failed or below parity threshold: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import os
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import torch
+import numpy as np
+from metrics import timed
+
+HEATMAP_MODES = ("none", "sync", "async")
+
+
+class GradCAM:
+    """
+    Grad-CAM with hooks scoped to a single generate() call.
+    The forward hook is registered just before the forward and removed as soon as it returns,
+    and only records activations produced by the calling thread with grad enabled, so
+    concurrent no_grad inference (TTA, the batching scheduler) is never captured.
+    Gradients come from torch.autograd.grad, so no parameter .grad buffers are touched.
+    """
+    def __init__(self, model, target_layer):
+        self.model = model
+        self.target_layer = target_layer
+
+    def capture(self):
+        """Context manager that records the target layer's output for this thread."""
+        return _ActivationCapture(self.target_layer)
+
+    @staticmethod
+    def cam_from(activations, score, row=0):
+        """
+        Build a normalised CAM from captured activations and a scalar class score.
+        For batched activations, row selects the sample the score was taken from.
+        """
+        gradients = torch.autograd.grad(score, activations, retain_graph=False)[0]
+        gradients = gradients[row:row + 1]
+        activations = activations[row:row + 1]
+        weights = torch.mean(gradients, dim=(2, 3), keepdim=True)
+        cam = torch.sum(weights * activations, dim=1).squeeze().detach().numpy()
+        cam = np.maximum(cam, 0)
+        return cam / (np.max(cam) + 1e-7)
+
+    @staticmethod
+    def cams_from(activations, scores):
+        """
+        CAMs for every row of a batch from one backward pass. scores holds one class score
+        per row; samples do not interact in ConvNeXt, so the gradient of their sum is per-row.
+        """
+        gradients = torch.autograd.grad(scores.sum(), activations, retain_graph=False)[0]
+        weights = torch.mean(gradients, dim=(2, 3), keepdim=True)
+        cams = torch.sum(weights * activations, dim=1).detach().clamp_(min=0).numpy()
+        return [cam / (np.max(cam) + 1e-7) for cam in cams]
+
+    def generate(self, tensor, idx):
+        with torch.enable_grad(), self.capture() as captured:
+            output = self.model(tensor)
+        return self.cam_from(captured.activations, output[0, idx])
+
+    def generate_many(self, batch, indices):
+        """CAMs for a batch (one class index per row) from one forward/backward."""
+        with torch.enable_grad(), self.capture() as captured:
+            output = self.model(batch)
+        scores = output[torch.arange(len(indices)), torch.as_tensor(indices)]
+        return self.cams_from(captured.activations, scores)
+
+
+class _ActivationCapture:
+    def __init__(self, layer):
+        self.layer = layer
+        self.activations = None
+        self._handle = None
+        self._thread = None
+
+    def _hook(self, module, inputs, output):
+        if threading.get_ident() == self._thread and torch.is_grad_enabled():
+            self.activations = output
+
+    def __enter__(self):
+        self._thread = threading.get_ident()
+        self._handle = self.layer.register_forward_hook(self._hook)
+        return self
+
+    def __exit__(self, *exc):
+        self._handle.remove()
+        self._handle = None
+        return False
+
+
+# Longest side of the stored overlay; the CAM itself is only 7x7, so more pixels add nothing
+HEATMAP_MAX_SIDE = int(os.environ.get("HEATMAP_MAX_SIDE", "640"))
+
+
+def render_overlay(image_bgr, cam, max_side=None):
+    """Colour-map a CAM onto the BGR image, downscaled to the display resolution first."""
+    max_side = HEATMAP_MAX_SIDE if max_side is None else max_side
+    h, w = image_bgr.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / float(max(h, w))
+        w, h = max(1, round(w * scale)), max(1, round(h * scale))
+        image_bgr = cv2.resize(image_bgr, (w, h), interpolation=cv2.INTER_AREA)
+    heatmap = cv2.applyColorMap(np.uint8(255 * cv2.resize(cam, (w, h))), cv2.COLORMAP_JET)
+    return cv2.addWeighted(image_bgr, 0.6, heatmap, 0.4, 0)
+
+
+class HeatmapService:
+    """
+    Grad-CAM heatmaps for /predict in three modes:
+      none  - skip the CAM entirely
+      sync  - compute it on the request thread (previous behaviour)
+      async - compute it on a small background pool; the client polls /heatmap/<job_id>
+    Job status is also written to the artifact store, so the poll may hit any worker.
+    """
+    def __init__(self, model, target_layer, store, workers=1, max_jobs=256, cam=None):
+        # cam: anything with generate() / generate_many(), e.g. the model server's RemoteGradCAM
+        self.cam = cam or GradCAM(model, target_layer)
+        # ArtifactStore: unique content-addressed file per overlay, bounded on disk
+        self.store = store
+        self.max_jobs = max_jobs
+        self._workers = max(1, int(workers))
+        self._executor = None
+        self._pid = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Executor threads do not survive a fork, so create the pool lazily per process
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="gradcam")
+            self._pid = os.getpid()
+        return self._executor
+
+    def compute(self, image_bgr, tensor, idx):
+        """Generate the CAM, render the overlay and store it. Returns its URL."""
+        with timed("gradcam"):
+            return self.save(image_bgr, self.cam.generate(tensor, idx))
+
+    def save(self, image_bgr, cam):
+        """Render an already computed CAM (e.g. from the shared TTA forward) and store it."""
+        return self.store.put_image(render_overlay(image_bgr, cam))
+
+    def render_sync(self, image_bgr, tensor, idx):
+        try:
+            return self.compute(image_bgr, tensor, idx)
+        except Exception as cam_err:
+            print(f"Heatmap Error: {cam_err}")
+            return ""
+
+    def _run_job(self, job_id, image_bgr, tensor, idx):
+        try:
+            url = self.compute(image_bgr, tensor, idx)
+        except Exception as e:
+            self.store.put_job(job_id, {"status": "error", "message": str(e)})
+            raise
+        self.store.put_job(job_id, {"status": "ready", "heatmap": url})
+        return url
+
+    def submit(self, image_bgr, tensor, idx):
+        """Queue a CAM job and return its id."""
+        job_id = uuid.uuid4().hex
+        self.store.put_job(job_id, {"status": "pending"})
+        future = self._pool().submit(self._run_job, job_id, image_bgr, tensor, idx)
+        with self._lock:
+            self._jobs[job_id] = future
+            while len(self._jobs) > self.max_jobs:
+                _, old_future = self._jobs.popitem(last=False)
+                old_future.cancel()
+        return job_id
+
+    def status(self, job_id):
+        """Job status dict for the polling endpoint, or None for unknown ids."""
+        with self._lock:
+            future = self._jobs.get(job_id)
+        if future is None:
+            # Submitted by another worker (or evicted from this one's table)
+            return self.store.get_job(job_id)
+        if not future.done():
+            return {"status": "pending"}
+        try:
+            return {"status": "ready", "heatmap": future.result()}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+
+def parse_heatmap_mode(value, default="sync"):
+    value = (value or default).strip().lower()
+    if value not in HEATMAP_MODES:
+        raise ValueError(f"heatmap must be one of: {', '.join(HEATMAP_MODES)}")
+    return value
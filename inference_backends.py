@@ -0,0 +1,91 @@
+import os
+import torch
+import numpy as np
+
+BACKENDS = ("eager", "torchscript", "onnx", "int8-dynamic", "onnx-int8")
+
+# Default file for each exported backend (written by export_model.py)
+EXPORT_DIR = 'models/exported'
+DEFAULT_PATHS = {
+    "torchscript": os.path.join(EXPORT_DIR, "convnext_tiny.ts"),
+    "onnx": os.path.join(EXPORT_DIR, "convnext_tiny.onnx"),
+    "int8-dynamic": os.path.join(EXPORT_DIR, "convnext_tiny_int8_dynamic.ts"),
+    "onnx-int8": os.path.join(EXPORT_DIR, "convnext_tiny_int8_static.onnx"),
+}
+
+
+class EagerBackend:
+    """Plain PyTorch fp32 model. The only backend that supports gradients (Grad-CAM)."""
+    name = "eager"
+    supports_grad = True
+
+    def __init__(self, model):
+        self.model = model.eval()
+
+    def __call__(self, batch):
+        return self.model(batch)
+
+
+class TorchScriptBackend:
+    """TorchScript module (fp32, or int8 after dynamic quantization)."""
+    supports_grad = False
+
+    def __init__(self, path, name="torchscript"):
+        self.name = name
+        self.model = torch.jit.load(path, map_location="cpu").eval()
+
+    def __call__(self, batch):
+        with torch.no_grad():
+            return self.model(batch)
+
+
+class OnnxBackend:
+    """ONNX Runtime CPU session (fp32 or statically quantized int8)."""
+    supports_grad = False
+
+    def __init__(self, path, name="onnx", threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("onnxruntime is required for the ONNX backends (pip install onnxruntime)")
+        self.name = name
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        array = batch.detach().cpu().numpy().astype(np.float32, copy=False)
+        return torch.from_numpy(self.session.run(None, {self.input_name: array})[0])
+
+
+def load_backend(name, model=None, path=None, threads=None):
+    """
+    Build an inference backend by name. The eager backend wraps the given model;
+    the others load the file produced by export_model.py.
+    """
+    name = (name or "eager").lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name} (use {', '.join(BACKENDS)})")
+    if name == "eager":
+        return EagerBackend(model)
+    path = path or DEFAULT_PATHS[name]
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{name} backend file not found at {path} (run export_model.py first)")
+    if name in ("torchscript", "int8-dynamic"):
+        return TorchScriptBackend(path, name)
+    return OnnxBackend(path, name, threads)
+
+
+def backend_from_env(model):
+    """INFERENCE_BACKEND / INFERENCE_BACKEND_PATH. Falls back to eager if the export is unusable."""
+    name = os.environ.get("INFERENCE_BACKEND", "eager")
+    try:
+        backend = load_backend(name, model, os.environ.get("INFERENCE_BACKEND_PATH"))
+    except (ImportError, OSError, RuntimeError) as e:
+        print(f"⚠️  Inference backend '{name}' unavailable ({e}), using eager PyTorch")
+        return EagerBackend(model)
+    print(f"✅ Inference backend: {backend.name}")
+    return backend
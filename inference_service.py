@@ -0,0 +1,271 @@
+"""
+The one inference engine behind every entry point: the web app, LeafAnalyzer
+(bulk_diagnose.py) and the diagnostic scripts.
+
+    service = inference_service_from_env()
+    [result] = service.predict([jpeg_bytes], {"tta": "none", "heatmap": "async"})
+    result.label, result.confidence, result.heatmap_url
+
+It owns everything that has to be identical everywhere: torch thread pools, weight
+loading, backend selection, micro-batching, the cascade, warmup, preprocessing
+(reduced decode, CLAHE + sharpening, TTA views) and Grad-CAM. torch is only imported
+when a service is built, so importing this module stays cheap.
+"""
+import os
+
+MODEL_PATH = 'models/best_convnext_tiny.pth'
+CLASSES = ["Anthracnose", "Bacterial spot", "Curl", "Healthy", "Mealybug", "Mite disease", "Ringspot", "Mosaic"]
+
+DEFAULT_OPTIONS = {
+    "tta": None,        # augmentation list, "none" for a single view, None for TTA_AUGMENTATIONS
+    "enhance": True,    # CLAHE + sharpening before classification
+    "heatmap": "none",  # none | sync | async
+    "cam": False,       # compute the Grad-CAM in the classification forward when possible
+    "cascade": True,    # use the cascade when INFERENCE_CASCADE is on
+}
+
+
+def configure_threads(threads=None, interop_threads=None):
+    """
+    torch intra-op threads (INFERENCE_THREADS) and inter-op threads (INFERENCE_INTEROP_THREADS);
+    0 / unset keeps torch's default. Inter-op threads can only be set once per process,
+    before any parallel work, so later calls keep the first value. Returns the intra-op count.
+    """
+    import torch
+    threads = threads or int(os.environ.get("INFERENCE_THREADS", "0") or 0)
+    interop_threads = interop_threads or int(os.environ.get("INFERENCE_INTEROP_THREADS", "0") or 0)
+    if threads:
+        torch.set_num_threads(int(threads))
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError:
+            pass
+    return torch.get_num_threads()
+
+
+class Prediction:
+    """Result for one image. to_dict() is the JSON-safe part."""
+    def __init__(self, labels, prob, idx, stage, image, cam=None, enhanced=True):
+        self.labels = labels
+        self.prob = prob
+        self.index = idx
+        self.label = labels[idx]
+        self.confidence = prob[idx].item()
+        # Which cascade stage answered ("tta" without a cascade)
+        self.stage = stage
+        # Decoded BGR image at working size (heatmaps are drawn on it)
+        self.image = image
+        # Whether classification saw the enhanced image (a later CAM uses the same input)
+        self.enhanced = enhanced
+        self.cam = cam
+        self.heatmap_url = ""
+        self.heatmap_job = None
+
+    def to_dict(self):
+        result = {
+            "label": self.label,
+            "confidence": round(self.confidence, 6),
+            "stage": self.stage,
+            "probabilities": {label: round(p, 6) for label, p in zip(self.labels, self.prob.tolist())},
+            "heatmap": self.heatmap_url,
+        }
+        if self.heatmap_job:
+            result["heatmap_job"] = self.heatmap_job
+        return result
+
+
+class InferenceService:
+    def __init__(self, model_path=MODEL_PATH, labels=None, backend=None, batching=True, cascade=True,
+                 store=None, heatmap_workers=1, threads=None, interop_threads=None, warmup=True, server=None):
+        """
+        backend: inference backend name, None for INFERENCE_BACKEND. batching / cascade turn the
+        env-configured micro-batching scheduler and cascade on or off for this service.
+        store: ArtifactStore for heatmaps (default from HEATMAP_* env).
+        server: ModelServerClient that runs the model out of process, None for
+        MODEL_SERVER_ADDRESS, False to always load the model here.
+        """
+        import torch
+        from model_loader import build_model, safetensors_path
+        from inference_backends import load_backend, backend_from_env
+        from batch_scheduler import scheduler_from_env
+        from tta_engine import TTAEngine
+        from heatmap import HeatmapService
+        from artifact_store import artifact_store_from_env
+        from cascade import cascade_from_env
+        from prediction_cache import model_version
+        from model_server import model_server_from_env, RemoteGradCAM
+
+        self.threads = configure_threads(threads, interop_threads)
+        self.labels = list(labels or CLASSES)
+        store = store if store is not None else artifact_store_from_env()
+        self.server = model_server_from_env() if server is None else (server or None)
+
+        if self.server is not None:
+            # MODEL_SERVER_ADDRESS: the model server owns weights, backend, batching and Grad-CAM;
+            # this process only preprocesses and hands tensors over through shared memory
+            info = self.server.info()
+            self.model, self.loaded = None, info["loaded"]
+            self.backend = self.server
+            # Batches are formed in the server, across all web workers
+            self.scheduler = None
+            self.heatmaps = HeatmapService(None, None, store, workers=heatmap_workers,
+                                           cam=RemoteGradCAM(self.server))
+            print(f"✅ Using model server at {self.server.address} ({info['version']})")
+        else:
+            # Weights are converted once to safetensors and memory-mapped (shared between workers)
+            self.model, self.loaded = build_model(model_path, num_classes=len(self.labels))
+            if self.loaded:
+                print("✅ Model Loaded Successfully")
+
+            # Forward-pass backend for classification: eager | torchscript | onnx | int8-dynamic | onnx-int8
+            # (Grad-CAM always uses the eager model since it needs gradients)
+            self.backend = load_backend(backend, self.model) if backend else backend_from_env(self.model)
+
+            # Cross-request micro-batching (INFERENCE_BATCHING=0 disables it)
+            self.scheduler = scheduler_from_env(self.backend) if batching else None
+
+            # Every overlay gets its own content-addressed file; the store is bounded by size and age
+            self.heatmaps = HeatmapService(self.model, self.model.stages[-1].blocks[-1], store,
+                                           workers=heatmap_workers)
+
+        # Augmentation set comes from TTA_AUGMENTATIONS (e.g. "identity,hflip" or "none")
+        self.tta = TTAEngine(self.backend, scheduler=self.scheduler)
+        # INFERENCE_CASCADE=1: a cheap single-view stage answers clear-cut leaves, only low-margin
+        # ones go on to the full TTA (and the CASCADE_ENSEMBLE checkpoints)
+        self.cascade = cascade_from_env(self.tta, num_classes=len(self.labels)) if cascade else None
+
+        # Sync heatmaps reuse the classification forward (one grad-enabled pass) instead of a
+        # second inference; only possible when classification itself runs on the eager model.
+        # With the micro-batching scheduler only the identity view skips the scheduler
+        self.reuse_tta = self.backend.supports_grad and \
+            os.environ.get("HEATMAP_REUSE_TTA", "1").lower() not in ("0", "false", "off", "no")
+
+        if self.server is not None:
+            self.version = f"{info['version']}:{self.backend.name}"
+        else:
+            weights = model_path if os.path.exists(model_path) else safetensors_path(model_path)
+            self.version = f"{model_version(weights)}:{self.backend.name}"
+        if self.cascade is not None:
+            self.version += ":" + self.cascade.signature()
+        self._torch = torch
+        if warmup:
+            self.warmup()
+
+    def warmup(self):
+        """One forward per backend pays for kernel selection / allocator warmup, not the first farmer."""
+        torch = self._torch
+        backends = [self.backend]
+        for stage in (self.cascade.stages if self.cascade is not None else ()):
+            model = getattr(stage.engine, "model", None)
+            if model is not None and model not in backends:
+                backends.append(model)
+        with torch.no_grad():
+            for backend in backends:
+                backend(torch.zeros(1, 3, 224, 224))
+
+    @staticmethod
+    def load(image):
+        """BGR uint8 at working size from encoded bytes, a file path or an already decoded array."""
+        from preprocessing import PREPROCESSOR
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return PREPROCESSOR.decode(bytes(image))
+        if isinstance(image, (str, os.PathLike)):
+            return PREPROCESSOR.read(image)
+        return image
+
+    def predict(self, images, options=None):
+        """
+        Classify a batch of images (encoded bytes, file paths or BGR uint8 arrays) with the
+        options in DEFAULT_OPTIONS. Returns one Prediction per image, in order.
+        """
+        import cv2
+        from preprocessing import PREPROCESSOR
+        from tta_engine import parse_augmentations
+        from heatmap import parse_heatmap_mode
+        from metrics import timed
+
+        options = dict(DEFAULT_OPTIONS, **(options or {}))
+        views = parse_augmentations(options["tta"]) or self.tta.augmentations
+        heatmap_mode = parse_heatmap_mode(options["heatmap"], "none")
+
+        # Big phone photos are decoded straight to working size (IMREAD_REDUCED_*)
+        with timed("decode"):
+            raws = [self.load(image) for image in images]
+            rgbs = [cv2.cvtColor(raw, cv2.COLOR_BGR2RGB) for raw in raws]
+        if options["enhance"]:
+            with timed("enhance"):
+                rgbs = [PREPROCESSOR.enhance(rgb) for rgb in rgbs]
+
+        # One grad-enabled forward gives both the prediction and the CAM (computed on the
+        # enhanced identity view the decision was made on)
+        gradcam = self.heatmaps.cam if (options["cam"] or heatmap_mode == "sync") and self.reuse_tta else None
+        cascade = self.cascade if options["cascade"] else None
+        with timed("inference"):
+            if cascade is not None:
+                outputs = cascade.predict_many(rgbs, views, gradcam)
+            elif gradcam is not None:
+                outputs = [self.tta.predict_with_cam(rgb, gradcam, views) + ("tta",) for rgb in rgbs]
+            else:
+                probs = self.tta.predict_many(rgbs, views)
+                outputs = [(prob, self._torch.argmax(prob).item(), None, "tta") for prob in probs]
+
+        predictions = [Prediction(self.labels, prob, idx, stage, raw, cam, options["enhance"])
+                       for raw, (prob, idx, cam, stage) in zip(raws, outputs)]
+        if heatmap_mode != "none":
+            for prediction in predictions:
+                self.attach_heatmap(prediction, heatmap_mode)
+        return predictions
+
+    def attach_heatmap(self, prediction, mode="sync"):
+        """
+        Render (sync) or queue (async) the Grad-CAM overlay of a prediction. A CAM computed
+        in the classification forward is reused; otherwise the CAM is computed on the same
+        (enhanced or not) input the classification used. Sets heatmap_url / heatmap_job and returns the prediction.
+        """
+        import cv2
+        from preprocessing import PREPROCESSOR
+        from metrics import timed
+        if mode == "none":
+            return prediction
+        if prediction.cam is not None:
+            try:
+                with timed("gradcam"):
+                    prediction.heatmap_url = self.heatmaps.save(prediction.image, prediction.cam)
+            except Exception as cam_err:
+                print(f"Heatmap Error: {cam_err}")
+            return prediction
+        tensor = PREPROCESSOR.prepare(cv2.cvtColor(prediction.image, cv2.COLOR_BGR2RGB), enhance=prediction.enhanced)
+        if mode == "async":
+            prediction.heatmap_job = self.heatmaps.submit(prediction.image, tensor, prediction.index)
+        else:
+            prediction.heatmap_url = self.heatmaps.render_sync(prediction.image, tensor, prediction.index)
+        return prediction
+
+    def probabilities(self, images):
+        """Plain softmax [N, classes] of RGB uint8 images already at input size (no TTA, no cascade)."""
+        from preprocessing import PREPROCESSOR
+        import numpy as np
+        batch = PREPROCESSOR.to_tensor(np.stack(images), PREPROCESSOR.buffer(len(images)))
+        with self._torch.inference_mode():
+            return self._torch.nn.functional.softmax(self.backend(batch), dim=1)
+
+    def heatmap_batch(self, raw_images, images, indices):
+        """Grad-CAM overlays for a batch of input-size RGB images from one forward/backward. Returns URLs."""
+        from preprocessing import PREPROCESSOR
+        from heatmap import render_overlay
+        import numpy as np
+        batch = PREPROCESSOR.to_tensor(np.stack(images))
+        cams = self.heatmaps.cam.generate_many(batch, indices)
+        return [self.heatmaps.store.put_image(render_overlay(raw, cam)) for raw, cam in zip(raw_images, cams)]
+
+    def status(self):
+        return {"backend": self.backend.name, "threads": self.threads, "version": self.version,
+                "batching": self.scheduler is not None, "cascade": self.cascade is not None,
+                "server": self.server.address if self.server is not None else None}
+
+
+def inference_service_from_env(model_path=MODEL_PATH, labels=None, store=None):
+    """The web app's service: everything from env (INFERENCE_*, HEATMAP_WORKERS, ...)."""
+    return InferenceService(model_path, labels, store=store,
+                            heatmap_workers=int(os.environ.get("HEATMAP_WORKERS", "1")))
@@ -1,14 +1,207 @@
-from groq import Groq
-import os
+import threading
+from outbound import GROQ_CHAT, GROQ_WHISPER, groq_client, async_groq_client
+from transcription import AudioUpload
+
+# Bump whenever the advice prompt changes so cached advice is regenerated
+PROMPT_VERSION = "1"
+
+SECTION_MARKERS = (("en", "###TAMIL_SECTION###"), ("ta", "###HINDI_SECTION###"))
+ERROR_ADVICE = ("தகவல் பிழை.", "सूचना त्रुटि")
+
+
+def advice_failed(en, ta, hi):
+    """
+    True when any section is an error placeholder, e.g. a stream that broke after English
+    was sent with no stale copy to fill in the rest. Such advice must not be cached.
+    """
+    return en.startswith("Error:") or ta == ERROR_ADVICE[0] or hi == ERROR_ADVICE[1]
+
+
+class AdviceSectionParser:
+    """
+    Incremental parser for a streamed advice completion.
+    A language section is complete as soon as the next section's marker arrives,
+    so English is emitted at ###TAMIL_SECTION###, Tamil at ###HINDI_SECTION###
+    and Hindi when the stream ends.
+    """
+    def __init__(self):
+        self.text = ""
+        self.emitted = []
+
+    def feed(self, delta):
+        """Add streamed text; returns a list of newly completed (lang, text) sections."""
+        self.text += delta
+        ready = []
+        for i, (lang, marker) in enumerate(SECTION_MARKERS):
+            if lang not in self.emitted and marker in self.text:
+                sections = CaricaCareAdvisor.parse_sections(self.text)
+                for j in range(i + 1):
+                    done = SECTION_MARKERS[j][0]
+                    if done not in self.emitted:
+                        self.emitted.append(done)
+                        ready.append((done, sections[j]))
+        return ready
+
+    def close(self):
+        """Emit whatever sections are left once the stream has finished."""
+        en, ta, hi = CaricaCareAdvisor.parse_sections(self.text)
+        ready = [(lang, text) for lang, text in (("en", en), ("ta", ta), ("hi", hi)) if lang not in self.emitted]
+        self.emitted.extend(lang for lang, _ in ready)
+        return ready
 
 class CaricaCareAdvisor:
-    def __init__(self, api_key):
-        self.client = Groq(api_key=api_key)
+    def __init__(self, api_key, cache=None, transcripts=None):
+        self.api_key = api_key
+        self._client = None
+        self._async_client = None
         self.model = "llama-3.1-8b-instant"  # Faster, uses fewer tokens
+        self.whisper_model = "whisper-large-v3"
+        self.language = "ta"  # Primarily targeting Tamil as per current UI
+        # Optional AdviceCache: advice is a function of the disease name only
+        self.cache = cache
+        # Optional TranscriptCache: a transcript is a function of the audio bytes
+        self.transcripts = transcripts
+
+    @property
+    def client(self):
+        # The groq SDK (httpx, pydantic) is imported on first use to keep worker startup fast;
+        # it runs on a pooled keep-alive httpx client with strict timeouts (see outbound.py)
+        if self._client is None:
+            return groq_client(self.api_key)
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            return async_groq_client(self.api_key)
+        return self._async_client
+
+    @async_client.setter
+    def async_client(self, value):
+        self._async_client = value
+
+    def _messages(self, disease_name):
+        return [{"role": "system", "content": "You are a professional agricultural scientist."},
+                {"role": "user", "content": self.build_prompt(disease_name)}]
 
     def get_organic_advice(self, disease_name):
+        if self.cache is not None:
+            cached = self.cache.get(disease_name, self.model, PROMPT_VERSION)
+            if cached is not None:
+                return cached
         try:
-            prompt = f"""
+            advice = self.fetch_organic_advice(disease_name)
+            if self.cache is not None:
+                self.cache.put(disease_name, self.model, PROMPT_VERSION, advice)
+            return advice
+        except Exception as e:
+            return self._fallback_advice(disease_name, e)
+
+    async def aget_organic_advice(self, disease_name):
+        """asyncio version of get_organic_advice."""
+        if self.cache is not None:
+            cached = self.cache.get(disease_name, self.model, PROMPT_VERSION)
+            if cached is not None:
+                return cached
+        try:
+            advice = await self.afetch_organic_advice(disease_name)
+            if self.cache is not None:
+                self.cache.put(disease_name, self.model, PROMPT_VERSION, advice)
+            return advice
+        except Exception as e:
+            return self._fallback_advice(disease_name, e)
+
+    def _fallback_advice(self, disease_name, error):
+        # Serve expired advice rather than an error while Groq is unavailable
+        if self.cache is not None:
+            stale = self.cache.get(disease_name, self.model, PROMPT_VERSION, allow_stale=True)
+            if stale is not None:
+                print(f"Advice Error (serving cached advice): {error}")
+                return stale
+        return (f"Error: {str(error)}",) + ERROR_ADVICE
+
+    def stream_organic_advice(self, disease_name):
+        """
+        Yield ("en" | "ta" | "hi", text) pairs as each language section of the Groq
+        completion finishes streaming. Cached advice is yielded immediately.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(disease_name, self.model, PROMPT_VERSION)
+            if cached is not None:
+                yield from zip(("en", "ta", "hi"), cached)
+                return
+        parser = AdviceSectionParser()
+        try:
+            # Opening the stream is retried; the Groq slot is held until it is fully read
+            stream = GROQ_CHAT.stream(self.client.chat.completions.create,
+                                      model=self.model,
+                                      messages=self._messages(disease_name),
+                                      temperature=0.2,
+                                      stream=True,
+                                      timeout=GROQ_CHAT.http_timeout)
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield from parser.feed(delta)
+            yield from parser.close()
+            if self.cache is not None:
+                self.cache.put(disease_name, self.model, PROMPT_VERSION, self.parse_sections(parser.text))
+        except Exception as e:
+            # Only the sections that had not been sent yet
+            for lang, text in zip(("en", "ta", "hi"), self._fallback_advice(disease_name, e)):
+                if lang not in parser.emitted:
+                    yield lang, text
+
+    async def astream_organic_advice(self, disease_name):
+        """asyncio version of stream_organic_advice."""
+        if self.cache is not None:
+            cached = self.cache.get(disease_name, self.model, PROMPT_VERSION)
+            if cached is not None:
+                for section in zip(("en", "ta", "hi"), cached):
+                    yield section
+                return
+        parser = AdviceSectionParser()
+        try:
+            stream = GROQ_CHAT.astream(self.async_client.chat.completions.create,
+                                       model=self.model,
+                                       messages=self._messages(disease_name),
+                                       temperature=0.2,
+                                       stream=True,
+                                       timeout=GROQ_CHAT.http_timeout)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    for section in parser.feed(delta):
+                        yield section
+            for section in parser.close():
+                yield section
+            if self.cache is not None:
+                self.cache.put(disease_name, self.model, PROMPT_VERSION, self.parse_sections(parser.text))
+        except Exception as e:
+            for lang, text in zip(("en", "ta", "hi"), self._fallback_advice(disease_name, e)):
+                if lang not in parser.emitted:
+                    yield lang, text
+
+    def warm_cache(self, diseases, background=True):
+        """Pre-fetch advice for every class so the first diagnoses don't wait on the LLM."""
+        if self.cache is None:
+            return
+        def warm():
+            for disease in diseases:
+                if self.cache.get(disease, self.model, PROMPT_VERSION) is None:
+                    self.get_organic_advice(disease)
+        if background:
+            threading.Thread(target=warm, name="advice-warmup", daemon=True).start()
+        else:
+            warm()
+
+    @staticmethod
+    def build_prompt(disease_name):
+        return f"""
             Diagnosis: {disease_name} in Papaya.
             Expert Persona: CaricaCare AI Organic Expert for Farmers.
             
@@ -47,36 +240,95 @@ class CaricaCareAdvisor:
             - Point 3 (short, clear)
             """
 
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "system", "content": "You are a professional agricultural scientist."},
-                          {"role": "user", "content": prompt}],
-                temperature=0.2
-            )
+    @staticmethod
+    def parse_sections(res):
+        """Split the completion into its English / Tamil / Hindi sections."""
+        en = res.split("###ENGLISH_SECTION###")[-1].split("###TAMIL_SECTION###")[0].strip()
+        ta = res.split("###TAMIL_SECTION###")[-1].split("###HINDI_SECTION###")[0].strip()
+        hi = res.split("###HINDI_SECTION###")[-1].strip()
+        return en, ta, hi
 
-            res = completion.choices[0].message.content
-            
-            # Parsing the three sections
-            en = res.split("###ENGLISH_SECTION###")[-1].split("###TAMIL_SECTION###")[0].strip()
-            ta = res.split("###TAMIL_SECTION###")[-1].split("###HINDI_SECTION###")[0].strip()
-            hi = res.split("###HINDI_SECTION###")[-1].strip()
-            
-            return en, ta, hi
+    def fetch_organic_advice(self, disease_name):
+        """Uncached Groq call. Raises on API errors."""
+        completion = GROQ_CHAT.call(self.client.chat.completions.create,
+                                    model=self.model,
+                                    messages=self._messages(disease_name),
+                                    temperature=0.2,
+                                    timeout=GROQ_CHAT.http_timeout)
+        return self.parse_sections(completion.choices[0].message.content)
+
+    async def afetch_organic_advice(self, disease_name):
+        """asyncio version of fetch_organic_advice (uncached, raises on API errors)."""
+        completion = await GROQ_CHAT.acall(self.async_client.chat.completions.create,
+                                           model=self.model,
+                                           messages=self._messages(disease_name),
+                                           temperature=0.2,
+                                           timeout=GROQ_CHAT.http_timeout)
+        return self.parse_sections(completion.choices[0].message.content)
+
+    def transcribe_audio(self, audio):
+        """
+        Transcribes audio (a file path or an AudioUpload) using Groq's Whisper-large-v3 model.
+        The file object is streamed in the multipart upload; transcripts are cached by content hash.
+        """
+        upload = audio if isinstance(audio, AudioUpload) else None
+        try:
+            if upload is None:
+                upload = AudioUpload.from_path(audio)
+            text = self._cached_transcript(upload)
+            if text is not None:
+                return text
+
+            def create():
+                # Rewound on every attempt, so a retry sends the whole file again
+                return self.client.audio.transcriptions.create(**self._whisper_args(upload))
+            text = GROQ_WHISPER.call(create).text
+            self._store_transcript(upload, text)
+            return text
         except Exception as e:
-            return f"Error: {str(e)}", "தகவல் பிழை.", "सूचना त्रुटि"
+            print(f"Transcription Error: {e}")
+            return None
+        finally:
+            if upload is not None and upload is not audio:
+                upload.close()
 
-    def transcribe_audio(self, audio_file_path):
-        """Transcribes audio using Groq's Whisper-large-v3 model."""
+    async def atranscribe_audio(self, audio):
+        """asyncio version of transcribe_audio."""
+        upload = audio if isinstance(audio, AudioUpload) else None
         try:
-            with open(audio_file_path, "rb") as file:
-                transcription = self.client.audio.transcriptions.create(
-                    file=(os.path.basename(audio_file_path), file.read()),
-                    model="whisper-large-v3",
-                    response_format="json",
-                    language="ta", # Primarily targeting Tamil as per current UI
-                    temperature=0.0
-                )
-                return transcription.text
+            if upload is None:
+                upload = AudioUpload.from_path(audio)
+            text = self._cached_transcript(upload)
+            if text is not None:
+                return text
+
+            async def create():
+                return await self.async_client.audio.transcriptions.create(**self._whisper_args(upload))
+            text = (await GROQ_WHISPER.acall(create)).text
+            self._store_transcript(upload, text)
+            return text
         except Exception as e:
             print(f"Transcription Error: {e}")
-            return None
\ No newline at end of file
+            return None
+        finally:
+            if upload is not None and upload is not audio:
+                upload.close()
+
+    def _cached_transcript(self, upload):
+        if self.transcripts is None:
+            return None
+        return self.transcripts.get(upload.sha256, self.whisper_model, self.language)
+
+    def _store_transcript(self, upload, text):
+        if self.transcripts is not None and text:
+            self.transcripts.put(upload.sha256, self.whisper_model, self.language, text)
+
+    def _whisper_args(self, upload):
+        return dict(
+            file=(upload.filename, upload.rewind()),
+            model=self.whisper_model,
+            response_format="json",
+            language=self.language,
+            temperature=0.0,
+            timeout=GROQ_WHISPER.http_timeout
+        )
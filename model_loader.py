@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Fast model startup.
+
+The .pth checkpoint is converted once to safetensors next to it. Workers then build
+the ConvNeXt skeleton on the meta device (no random init) and assign tensors that are
+memory-mapped straight from that file, so every Gunicorn worker shares the same page
+cache pages instead of holding a private copy of the weights.
+
+    python model_loader.py            # convert models/best_convnext_tiny.pth ahead of time
+"""
+import os
+import sys
+import time
+import zipfile
+import tempfile
+import threading
+
+MODEL_PATH = 'models/best_convnext_tiny.pth'
+ZIP_PATH = 'models/best_convnext_tiny.zip'
+
+
+def safetensors_path(pth_path):
+    return os.path.splitext(pth_path)[0] + ".safetensors"
+
+
+def ensure_checkpoint(pth_path=MODEL_PATH, zip_path=ZIP_PATH):
+    """Unzip the checkpoint for cloud deployments, unless a converted file already exists."""
+    if os.path.exists(pth_path) or os.path.exists(safetensors_path(pth_path)):
+        return
+    if os.path.exists(zip_path):
+        print("📦 Unzipping model file...")
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            zip_ref.extractall(os.path.dirname(pth_path) or '.')
+        print("✅ Model unzipped successfully")
+
+
+def convert_weights(pth_path=MODEL_PATH, out_path=None):
+    """Convert a .pth state dict to safetensors (atomic write). Returns the output path."""
+    import torch
+    from safetensors.torch import save_file
+    out_path = out_path or safetensors_path(pth_path)
+    state_dict = torch.load(pth_path, map_location="cpu", weights_only=True)
+    state_dict = {k: v.contiguous() for k, v in state_dict.items()}
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(out_path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        save_file(state_dict, tmp)
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return out_path
+
+
+def load_state_dict(pth_path=MODEL_PATH, convert=True):
+    """
+    Memory-mapped state dict. Prefers the safetensors file (converting the .pth on first
+    use when allowed), else falls back to torch.load(mmap=True).
+    """
+    import torch
+    st_path = safetensors_path(pth_path)
+    try:
+        from safetensors.torch import load_file
+    except ImportError:
+        load_file = None
+    if load_file is not None:
+        if not os.path.exists(st_path) and convert and os.path.exists(pth_path):
+            try:
+                convert_weights(pth_path, st_path)
+                print(f"✅ Converted weights to {st_path}")
+            except OSError as e:
+                print(f"⚠️  Could not write {st_path}: {e}")
+        if os.path.exists(st_path):
+            return load_file(st_path, device="cpu")
+    return torch.load(pth_path, map_location="cpu", mmap=True, weights_only=True)
+
+
+def build_model(pth_path=MODEL_PATH, num_classes=8, arch='convnext_tiny'):
+    """
+    Create the timm model without random initialisation and load the mmap'd weights
+    in place (assign=True keeps the mapped storage instead of copying it).
+    Returns (model, loaded) where loaded is False if no checkpoint was found.
+    """
+    import torch
+    import timm
+    ensure_checkpoint(pth_path)
+    if not (os.path.exists(pth_path) or os.path.exists(safetensors_path(pth_path))):
+        print(f"❌ Error: Model not found at {pth_path}")
+        return timm.create_model(arch, pretrained=False, num_classes=num_classes).eval(), False
+    with torch.device("meta"):
+        model = timm.create_model(arch, pretrained=False, num_classes=num_classes)
+    model.load_state_dict(load_state_dict(pth_path), assign=True)
+    return model.eval(), True
+
+
+class LazyResource:
+    """
+    Builds an expensive object on first use (or in a background warmup thread) and
+    reports readiness for the /ready endpoint.
+    """
+    def __init__(self, factory, name="model"):
+        self.factory = factory
+        self.name = name
+        self._value = None
+        self._error = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        self._warm_requested = False
+        # Gunicorn --preload can fork while the warmup thread holds the lock: the child
+        # gets a fresh lock and, if it has no value yet, a warmup thread of its own
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        if self._warm_requested and self._value is None:
+            self.warm()
+
+    @property
+    def ready(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is not None:
+            return self._value
+        with self._lock:
+            if self._value is None:
+                started = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                    self._error = None
+                except Exception as e:
+                    self._error = str(e)
+                    raise
+                self.load_seconds = round(time.perf_counter() - started, 3)
+                print(f"✅ {self.name} ready in {self.load_seconds}s")
+        return self._value
+
+    def warm(self, background=True):
+        """Build now or in a background thread; after a fork the child warms up again by itself."""
+        self._warm_requested = True
+
+        def run():
+            try:
+                self.get()
+            except Exception as e:
+                print(f"❌ {self.name} warmup failed: {e}")
+        if background:
+            threading.Thread(target=run, name=f"{self.name}-warmup", daemon=True).start()
+        else:
+            run()
+
+    def status(self):
+        return {"ready": self.ready, "load_seconds": self.load_seconds, "error": self._error}
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else MODEL_PATH
+    ensure_checkpoint(path)
+    if not os.path.exists(path):
+        print(f"❌ Model not found at {path}")
+        sys.exit(1)
+    print(f"✅ Wrote {convert_weights(path)}")
@@ -0,0 +1,435 @@
+"""
+Out-of-process model server: a few replica processes own the ConvNeXt, the web workers
+only decode and preprocess.
+
+    python model_server.py                  # MODEL_SERVER_ADDRESS, MODEL_SERVER_REPLICAS, INFERENCE_BACKEND
+    MODEL_SERVER_ADDRESS=$XDG_RUNTIME_DIR/caricacare/model.sock gunicorn -w 8 app:app
+
+Transport: every client channel owns a multiprocessing.shared_memory segment that holds
+MODEL_SERVER_MAX_ROWS normalised [3, 224, 224] rows. The client copies its batch into it
+and sends a small ("forward", n) message over a Unix socket; the replica wraps the same
+pages as a tensor (no pickling of pixel data) and answers with the [n, classes] logits,
+or with the 7x7 Grad-CAMs for ("cam", indices). Replicas are forked after the socket is
+bound and all accept on it, so the kernel spreads channels across them, and every
+connection to a replica goes through its micro-batching scheduler: batches form across
+web workers. HTTP workers and model replicas (and their memory) now scale separately.
+
+Messages are pickled, so the channel must only ever reach our own server: the socket has to
+live in a directory owned by this user (or root) that nobody else can write to (the default
+is a 0700 per-user directory), and every connection authenticates with a key. The key is
+MODEL_SERVER_AUTHKEY, or a random one the server writes to <address>.key (mode 0600).
+"""
+import os
+import stat
+import time
+import atexit
+import secrets
+import tempfile
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory, AuthenticationError
+from multiprocessing.connection import Listener, Client
+import numpy as np
+
+from preprocessing import INPUT_SIZE
+
+# Private per-user directory ($XDG_RUNTIME_DIR is already one), never a world-writable /tmp path
+DEFAULT_ADDRESS = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(),
+                               f"caricacare-{os.getuid()}", "model.sock")
+
+
+def _attach(name):
+    """Open the client's segment; the client created it and is the one to unlink it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers every attached segment with the resource tracker,
+        # which would unlink it (and warn) when the replica exits
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _authkey():
+    key = os.environ.get("MODEL_SERVER_AUTHKEY", "")
+    return key.encode() if key else None
+
+
+def key_path(address):
+    return address + ".key"
+
+
+def check_socket_dir(address, create=False):
+    """
+    Refuse a socket directory another user could plant a fake server in: it must be owned
+    by us (or root) and not writable by group or others. create=True makes a missing one 0700.
+    """
+    directory = os.path.dirname(os.path.abspath(address))
+    if create and not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    st = os.stat(directory)
+    if st.st_uid not in (os.getuid(), 0) or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"model server socket directory {directory} must be private "
+                              f"(owned by this user, not group/world-writable)")
+    return directory
+
+
+def write_key(address):
+    """Random authkey in <address>.key, readable by this user only."""
+    key = secrets.token_hex(32).encode()
+    path = key_path(address)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def read_key(address):
+    """The key the server wrote next to its socket (FileNotFoundError until it has started)."""
+    with open(key_path(address), "rb") as f:
+        return f.read().strip()
+
+
+class ModelReplica:
+    """One model (weights, backend, scheduler, Grad-CAM) serving channels on threads."""
+    def __init__(self, model_path, num_classes, backend=None, batching=True, threads=None):
+        import torch
+        from model_loader import build_model, safetensors_path
+        from inference_backends import load_backend, backend_from_env
+        from batch_scheduler import scheduler_from_env
+        from heatmap import GradCAM
+        from prediction_cache import model_version
+        from inference_service import configure_threads
+
+        self.threads = configure_threads(threads)
+        self.model, self.loaded = build_model(model_path, num_classes=num_classes)
+        self.backend = load_backend(backend, self.model) if backend else backend_from_env(self.model)
+        # Logits, not probabilities: the client applies softmax like any other backend's output
+        self.scheduler = scheduler_from_env(self.backend, softmax=False) if batching else None
+        self.gradcam = GradCAM(self.model, self.model.stages[-1].blocks[-1])
+        weights = model_path if os.path.exists(model_path) else safetensors_path(model_path)
+        self.version = f"{model_version(weights)}:{self.backend.name}"
+        self.num_classes = num_classes
+        self.requests = 0
+        self.rows = 0
+        self.cams = 0
+        self.errors = 0
+        self.channels = 0
+        self._lock = threading.Lock()
+        self._torch = torch
+        with torch.no_grad():
+            self.backend(torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE))
+
+    def info(self):
+        return {"version": self.version, "num_classes": self.num_classes, "backend": self.backend.name,
+                "loaded": self.loaded, "pid": os.getpid()}
+
+    def forward(self, batch):
+        if self.scheduler is not None:
+            return self.scheduler.infer(batch)
+        with self._torch.no_grad():
+            return self.backend(batch)
+
+    def stats(self):
+        stats = dict(self.info(), requests=self.requests, rows=self.rows, cams=self.cams,
+                     errors=self.errors, channels=self.channels, threads=self.threads)
+        if self.scheduler is not None:
+            stats["batching"] = self.scheduler.stats()
+        return stats
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def handle(self, conn):
+        """Serve one client channel until it disconnects."""
+        shm = inputs = None
+        self._count("channels")
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    break
+                op = message[0]
+                try:
+                    if op == "attach":
+                        _, name, rows, size = message
+                        shm = _attach(name)
+                        inputs = np.ndarray((rows, 3, size, size), dtype=np.float32, buffer=shm.buf)
+                        reply = self.info()
+                    elif op == "forward":
+                        batch = self._torch.from_numpy(inputs[:message[1]])
+                        reply = self.forward(batch).numpy()
+                        self._count("requests")
+                        self._count("rows", len(reply))
+                    elif op == "cam":
+                        indices = message[1]
+                        batch = self._torch.from_numpy(inputs[:len(indices)])
+                        reply = np.stack(self.gradcam.generate_many(batch, indices))
+                        self._count("cams", len(indices))
+                    elif op == "stats":
+                        reply = self.stats()
+                    else:
+                        raise ValueError(f"unknown op {op!r}")
+                    batch = None
+                    conn.send(("ok", reply))
+                except Exception as e:
+                    self._count("errors")
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+        finally:
+            self._count("channels", -1)
+            conn.close()
+            batch = inputs = None
+            if shm is not None:
+                try:
+                    shm.close()
+                except BufferError:
+                    pass
+
+
+def _exit_with_parent(parent):
+    # Replicas are only useful behind the parent's socket; don't outlive a killed parent
+    while os.getppid() == parent:
+        time.sleep(1.0)
+    os._exit(0)
+
+
+def _replica_main(listener, model_path, num_classes, backend, parent):
+    threading.Thread(target=_exit_with_parent, args=(parent,), name="parent-watch", daemon=True).start()
+    replica = ModelReplica(model_path, num_classes, backend=backend)
+    print(f"🧠 Model replica {os.getpid()} ready ({replica.version})")
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, EOFError, AuthenticationError) as e:
+            # A client that fails the authkey handshake (or hangs up mid-way) only costs that accept
+            print(f"⚠️ Model server accept failed: {e}")
+            continue
+        threading.Thread(target=replica.handle, args=(conn,), name="model-channel", daemon=True).start()
+
+
+def serve(address=DEFAULT_ADDRESS, replicas=1, model_path=None, num_classes=None, backend=None, authkey=None):
+    """
+    Bind the socket, fork the replicas and wait for them (Ctrl-C stops everything).
+    Without an authkey a random one is generated and written to <address>.key.
+    """
+    import signal
+    import multiprocessing
+    from inference_service import MODEL_PATH, CLASSES
+
+    check_socket_dir(address, create=True)
+    if os.path.exists(address):
+        os.unlink(address)  # stale socket from a previous run
+    generated = not authkey
+    if generated:
+        authkey = write_key(address)
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target=_replica_main, name=f"model-replica-{i}", daemon=True,
+                             args=(listener, model_path or MODEL_PATH, num_classes or len(CLASSES), backend,
+                                   os.getpid()))
+                 for i in range(max(1, int(replicas)))]
+    for process in processes:
+        process.start()
+    # SIGTERM (docker stop, systemd) takes the same path as Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"🚀 Model server on {address} with {len(processes)} replica(s)")
+    try:
+        while all(process.is_alive() for process in processes):
+            time.sleep(1.0)
+        print("❌ A model replica exited, shutting down")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        listener.close()
+        for path in (address, key_path(address)) if generated else (address,):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class _Channel:
+    """One connection to a replica plus the shared-memory input buffer it reads from."""
+    def __init__(self, address, rows, size, authkey):
+        import torch
+        self.conn = Client(address, family="AF_UNIX", authkey=authkey)
+        self.shm = shared_memory.SharedMemory(create=True, size=rows * 3 * size * size * 4)
+        self.inputs = torch.from_numpy(np.ndarray((rows, 3, size, size), dtype=np.float32, buffer=self.shm.buf))
+        try:
+            self.info = self.request("attach", self.shm.name, rows, size)
+        except Exception:
+            self.close()
+            raise
+
+    def request(self, *message):
+        self.conn.send(message)
+        status, reply = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"model server: {reply}")
+        return reply
+
+    def close(self):
+        self.conn.close()
+        self.inputs = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+        self.shm.unlink()
+
+
+class ModelServerClient:
+    """
+    Inference backend that runs the forward in the model server. Takes a normalised
+    [N, 3, 224, 224] batch and returns logits, like the in-process backends.
+    Up to `channels` requests per worker process are in flight at once; channels are
+    opened lazily per PID (sockets and segments are not shared across a fork).
+    """
+    name = "server"
+    supports_grad = False
+
+    def __init__(self, address=DEFAULT_ADDRESS, max_rows=32, size=INPUT_SIZE, channels=8,
+                 connect_timeout=30.0, authkey=None):
+        self.address = address
+        self.max_rows = max(1, int(max_rows))
+        self.size = size
+        self.channels = max(1, int(channels))
+        self.connect_timeout = connect_timeout
+        # None: read the key the server wrote to <address>.key
+        self.authkey = authkey
+        self._idle = []
+        self._open = 0
+        self._pid = None
+        self._cond = threading.Condition()
+        atexit.register(self.close)
+
+    def close(self):
+        """Close this process's idle channels and free their segments."""
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for channel in idle:
+            channel.close()
+
+    def _connect(self):
+        # The server may still be loading weights when the web workers start
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                # Checked before every connect: the directory is what keeps other users' sockets out
+                check_socket_dir(self.address)
+                return _Channel(self.address, self.max_rows, self.size, self.authkey or read_key(self.address))
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f"model server not reachable at {self.address}")
+                time.sleep(0.2)
+
+    @contextmanager
+    def _channel(self):
+        with self._cond:
+            if self._pid != os.getpid():
+                # Channels inherited from the parent belong to the parent
+                self._idle, self._open, self._pid = [], 0, os.getpid()
+            while not self._idle and self._open >= self.channels:
+                self._cond.wait()
+            channel = self._idle.pop() if self._idle else None
+            if channel is None:
+                self._open += 1
+        if channel is None:
+            try:
+                channel = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+        healthy = False
+        try:
+            yield channel
+            healthy = True
+        finally:
+            with self._cond:
+                if healthy:
+                    self._idle.append(channel)
+                else:
+                    self._open -= 1
+                self._cond.notify()
+            if not healthy:
+                channel.close()
+
+    def _chunks(self, batch):
+        for start in range(0, batch.shape[0], self.max_rows):
+            yield start, batch[start:start + self.max_rows]
+
+    def __call__(self, batch):
+        import torch
+        outputs = []
+        for _, chunk in self._chunks(batch):
+            with self._channel() as channel:
+                channel.inputs[:len(chunk)].copy_(chunk)
+                outputs.append(torch.from_numpy(channel.request("forward", len(chunk))))
+        return outputs[0] if len(outputs) == 1 else torch.cat(outputs)
+
+    def cams(self, batch, indices):
+        """Grad-CAMs (7x7 float arrays) for each row of the batch and its class index."""
+        cams = []
+        for start, chunk in self._chunks(batch):
+            with self._channel() as channel:
+                channel.inputs[:len(chunk)].copy_(chunk)
+                cams.extend(channel.request("cam", [int(i) for i in indices[start:start + len(chunk)]]))
+        return cams
+
+    def info(self):
+        """version / num_classes / backend / loaded of the replica behind a channel."""
+        with self._channel() as channel:
+            return channel.info
+
+    def stats(self):
+        with self._channel() as channel:
+            return dict(channel.request("stats"), address=self.address, channels_open=self._open)
+
+
+class RemoteGradCAM:
+    """GradCAM stand-in for HeatmapService when the model lives in the model server."""
+    model = None
+
+    def __init__(self, client):
+        self.client = client
+
+    def generate(self, tensor, idx):
+        return self.client.cams(tensor, [idx])[0]
+
+    def generate_many(self, batch, indices):
+        return self.client.cams(batch, indices)
+
+
+def model_server_from_env():
+    """MODEL_SERVER_ADDRESS (a Unix socket path) moves the model out of process; unset keeps it in-process."""
+    address = os.environ.get("MODEL_SERVER_ADDRESS", "").strip()
+    if not address:
+        return None
+    return ModelServerClient(
+        address,
+        max_rows=int(os.environ.get("MODEL_SERVER_MAX_ROWS", "32")),
+        channels=int(os.environ.get("MODEL_SERVER_CHANNELS", "8")),
+        connect_timeout=float(os.environ.get("MODEL_SERVER_CONNECT_TIMEOUT", "30")),
+        authkey=_authkey(),
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve the leaf model to the web workers over shared memory")
+    parser.add_argument("--address", default=os.environ.get("MODEL_SERVER_ADDRESS", "").strip() or DEFAULT_ADDRESS)
+    parser.add_argument("--replicas", type=int, default=int(os.environ.get("MODEL_SERVER_REPLICAS", "1")))
+    parser.add_argument("--weights", default=None, help="checkpoint (default: the app's model)")
+    parser.add_argument("--backend", default=None, help="default: INFERENCE_BACKEND")
+    args = parser.parse_args()
+    serve(args.address, args.replicas, model_path=args.weights, backend=args.backend, authkey=_authkey())
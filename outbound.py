@@ -0,0 +1,452 @@
+"""
+Outbound HTTP for Groq (chat, Whisper) and the SMS gateways (Fast2SMS, 2Factor).
+
+Every provider gets:
+  - pooled keep-alive connections (one requests.Session / httpx client per process)
+  - strict connect/read timeouts
+  - a concurrency cap: callers wait at most OUTBOUND_QUEUE_TIMEOUT for a slot, then fail
+    fast instead of piling up behind a slow upstream
+  - retries with full-jitter exponential backoff (only on connect errors, 429 and 5xx;
+    SMS sends are not idempotent, so they are only retried when nothing was delivered)
+  - a circuit breaker: after N consecutive failures calls fail immediately for a cool-down
+
+So one degraded provider can tie up at most its own slots for at most its own timeout,
+never the whole worker pool. Provider.call / Provider.stream are the sync interface;
+Provider.acall is the asyncio one.
+
+Per-provider overrides: OUTBOUND_<NAME>_{CONCURRENCY,CONNECT_TIMEOUT,READ_TIMEOUT,RETRIES,
+FAILURES,COOLDOWN}, e.g. OUTBOUND_GROQ_CHAT_READ_TIMEOUT=20.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+
+class OutboundError(Exception):
+    """Base class for failures raised by this layer itself (not by the upstream)."""
+
+
+class CircuitOpenError(OutboundError):
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} is unavailable (circuit open, retry in {retry_in:.0f}s)")
+        self.provider = provider
+
+
+class ProviderBusyError(OutboundError):
+    def __init__(self, provider):
+        super().__init__(f"{provider} is busy (too many concurrent requests)")
+        self.provider = provider
+
+
+class UpstreamError(OutboundError):
+    """Non-success HTTP status worth retrying / tripping the breaker on (429, 5xx)."""
+    def __init__(self, provider, status_code):
+        super().__init__(f"{provider} returned HTTP {status_code}")
+        self.provider = provider
+        self.status_code = status_code
+
+
+# Exception class names (requests / urllib3, httpx, builtins) that only occur while connecting,
+# i.e. the request never reached the server. requests.ConnectionError and groq's
+# APIConnectionError are not in here: they also wrap resets after the body went out, so
+# for those the wrapped cause decides.
+_NOT_SENT = ("ConnectTimeout", "ConnectError", "NameResolutionError", "NewConnectionError",
+             "ConnectTimeoutError", "ConnectionRefusedError")
+_TRANSIENT = _NOT_SENT + ("ConnectionError", "APIConnectionError", "ReadTimeout", "Timeout", "TimeoutException",
+                          "APITimeoutError", "ReadError", "RemoteProtocolError", "ChunkedEncodingError",
+                          "TimeoutError")
+
+
+def _status(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _names(exc):
+    return {cls.__name__ for cls in type(exc).__mro__}
+
+
+def _cause_names(exc, limit=16):
+    """Class names of exc and the errors it wraps (__cause__, urllib3's .reason, args)."""
+    names = set()
+    seen = []
+    pending = [exc]
+    while pending and len(seen) < limit:
+        current = pending.pop()
+        if not isinstance(current, BaseException) or any(current is e for e in seen):
+            continue
+        seen.append(current)
+        names |= _names(current)
+        pending += [current.__cause__, getattr(current, "reason", None)] + list(current.args)
+    return names
+
+
+def is_transient(exc):
+    """Upstream trouble (timeouts, connection errors, 429, 5xx) as opposed to a bad request."""
+    status = _status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return bool(_names(exc) & set(_TRANSIENT))
+
+
+def is_safe_to_retry(exc, idempotent):
+    """Transient, and for non-idempotent calls also certainly not processed upstream."""
+    if not is_transient(exc):
+        return False
+    if idempotent:
+        return True
+    status = _status(exc)
+    if status is not None:
+        return status in (429, 503)
+    names = _cause_names(exc)
+    # Only connect-phase failures; a read timeout or a reset may mean the SMS already went out
+    return bool(names & set(_NOT_SENT)) and not names & {"ReadTimeout", "ReadTimeoutError", "APITimeoutError"}
+
+
+def was_not_sent(exc):
+    """True if a failed non-idempotent call certainly never reached the provider (safe to send again)."""
+    return isinstance(exc, (CircuitOpenError, ProviderBusyError)) or is_safe_to_retry(exc, idempotent=False)
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures -> half-open after `cooldown` (one trial call)."""
+    def __init__(self, failures=5, cooldown=30.0):
+        self.failures = int(failures)
+        self.cooldown = float(cooldown)
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """True if a call may go out now; otherwise the seconds left until the next trial."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            waited = time.monotonic() - self._opened_at
+            if waited >= self.cooldown and not self._trial:
+                self._trial = True
+                return True
+            return max(self.cooldown - waited, 0.0)
+
+    def success(self):
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._trial = False
+
+    def release(self):
+        """Give back a half-open trial without a verdict (the caller stopped before the call finished)."""
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._trial or self._count >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class Provider:
+    def __init__(self, name, concurrency=8, connect_timeout=3.0, read_timeout=30.0, retries=2,
+                 backoff=0.25, max_backoff=4.0, failures=5, cooldown=30.0, idempotent=True,
+                 queue_timeout=None):
+        self.name = name
+        self.concurrency = int(concurrency)
+        self.connect_timeout = float(connect_timeout)
+        self.read_timeout = float(read_timeout)
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.idempotent = idempotent
+        self.queue_timeout = float(os.environ.get("OUTBOUND_QUEUE_TIMEOUT", "2") if queue_timeout is None else queue_timeout)
+        self.breaker = CircuitBreaker(failures, cooldown)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._async_slots = None
+        self._active = 0
+        self._stats_lock = threading.Lock()
+        self.stats_counts = {"calls": 0, "failures": 0, "retries": 0, "rejected_busy": 0, "rejected_open": 0}
+
+    @property
+    def timeout(self):
+        """(connect, read) tuple for requests."""
+        return (self.connect_timeout, self.read_timeout)
+
+    @property
+    def http_timeout(self):
+        """This provider's timeouts as an httpx.Timeout (per-request timeout= for httpx / the Groq SDK)."""
+        import httpx
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats_counts[key] += amount
+
+    def _delay(self, attempt):
+        # Full jitter keeps retries from many workers from arriving in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def _check_breaker(self):
+        allowed = self.breaker.allow()
+        if allowed is not True:
+            self._count("rejected_open")
+            raise CircuitOpenError(self.name, allowed)
+
+    def _finish(self, exc):
+        if exc is None:
+            self.breaker.success()
+        elif is_transient(exc):
+            self._count("failures")
+            self.breaker.failure()
+        else:
+            # The upstream answered (e.g. 4xx): it is healthy even though the call failed
+            self.breaker.success()
+
+    @contextmanager
+    def _slot(self):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._count("rejected_busy")
+            raise ProviderBusyError(self.name)
+        with self._stats_lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._stats_lock:
+                self._active -= 1
+            self._slots.release()
+
+    def _attempts(self, fn, args, kwargs):
+        for attempt in range(self.retries + 1):
+            self._check_breaker()
+            self._count("calls")
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self._finish(e)
+                if attempt >= self.retries or not is_safe_to_retry(e, self.idempotent):
+                    raise
+                self._count("retries")
+                time.sleep(self._delay(attempt))
+                continue
+            return result
+
+    def call(self, fn, *args, **kwargs):
+        """Run a blocking upstream call within the concurrency cap, with retries and the breaker."""
+        with self._slot():
+            result = self._attempts(fn, args, kwargs)
+            self._finish(None)
+            return result
+
+    def stream(self, fn, *args, **kwargs):
+        """
+        Like call() for a call that returns an iterator (streamed completions). Opening the
+        stream is retried; the slot is held until the stream is consumed or closed.
+        """
+        with self._slot():
+            iterator = self._attempts(fn, args, kwargs)
+            finished = False
+            try:
+                for item in iterator:
+                    yield item
+                finished = True
+                self._finish(None)
+            except Exception as e:
+                finished = True
+                self._finish(e)
+                raise
+            finally:
+                if not finished:
+                    # The consumer went away mid-stream (GeneratorExit): no verdict on the
+                    # upstream, but a half-open trial must not stay claimed forever
+                    self.breaker.release()
+
+    def _async_semaphore(self):
+        # Created lazily so it binds to the running event loop
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.concurrency)
+        return self._async_slots
+
+    @asynccontextmanager
+    async def _aslot(self):
+        slots = self._async_semaphore()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._count("rejected_busy")
+            raise ProviderBusyError(self.name)
+        with self._stats_lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._stats_lock:
+                self._active -= 1
+            slots.release()
+
+    async def _aattempts(self, fn, args, kwargs):
+        for attempt in range(self.retries + 1):
+            self._check_breaker()
+            self._count("calls")
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                self._finish(e)
+                if attempt >= self.retries or not is_safe_to_retry(e, self.idempotent):
+                    raise
+                self._count("retries")
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            return result
+
+    async def acall(self, fn, *args, **kwargs):
+        """asyncio version of call(); fn returns an awaitable."""
+        async with self._aslot():
+            result = await self._aattempts(fn, args, kwargs)
+            self._finish(None)
+            return result
+
+    async def astream(self, fn, *args, **kwargs):
+        """asyncio version of stream(); fn returns an awaitable resolving to an async iterator."""
+        async with self._aslot():
+            iterator = await self._aattempts(fn, args, kwargs)
+            finished = False
+            try:
+                async for item in iterator:
+                    yield item
+                finished = True
+                self._finish(None)
+            except Exception as e:
+                finished = True
+                self._finish(e)
+                raise
+            finally:
+                if not finished:
+                    # Client disconnect (aclose) or task cancellation, see stream()
+                    self.breaker.release()
+
+    def check(self, response):
+        """Raise UpstreamError for 429 / 5xx responses so they are retried and trip the breaker."""
+        status = getattr(response, "status_code", None)
+        if isinstance(status, int) and (status == 429 or status >= 500):
+            raise UpstreamError(self.name, status)
+        return response
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self.stats_counts, active=self._active, concurrency=self.concurrency,
+                        circuit=self.breaker.state)
+
+
+def _provider_from_env(name, **defaults):
+    prefix = "OUTBOUND_" + name.upper().replace("-", "_") + "_"
+    keys = {"concurrency": "CONCURRENCY", "connect_timeout": "CONNECT_TIMEOUT", "read_timeout": "READ_TIMEOUT",
+            "retries": "RETRIES", "failures": "FAILURES", "cooldown": "COOLDOWN", "queue_timeout": "QUEUE_TIMEOUT"}
+    for arg, suffix in keys.items():
+        value = os.environ.get(prefix + suffix)
+        if value:
+            defaults[arg] = float(value)
+    return Provider(name, **defaults)
+
+
+GROQ_CHAT = _provider_from_env("groq_chat", concurrency=8, read_timeout=30.0, retries=2)
+GROQ_WHISPER = _provider_from_env("groq_whisper", concurrency=4, read_timeout=60.0, retries=1)
+# Vision calls carry an image and take seconds: few in flight, the rest wait in the queue
+GROQ_VISION = _provider_from_env("groq_vision", concurrency=2, read_timeout=60.0, retries=1, queue_timeout=30.0)
+FAST2SMS = _provider_from_env("fast2sms", concurrency=4, read_timeout=10.0, retries=2, idempotent=False)
+TWO_FACTOR = _provider_from_env("2factor", concurrency=4, read_timeout=10.0, retries=2, idempotent=False)
+PROVIDERS = {p.name: p for p in (GROQ_CHAT, GROQ_WHISPER, GROQ_VISION, FAST2SMS, TWO_FACTOR)}
+
+# Connection pools are per process (sockets must not be shared across a fork)
+_local = {"pid": None}
+_local_lock = threading.Lock()
+
+
+def _per_process(key, factory):
+    with _local_lock:
+        if _local["pid"] != os.getpid():
+            _local.clear()
+            _local["pid"] = os.getpid()
+        if key not in _local:
+            _local[key] = factory()
+        return _local[key]
+
+
+def http_session():
+    """Shared keep-alive requests.Session for the SMS gateways."""
+    def make():
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        size = max(FAST2SMS.concurrency, TWO_FACTOR.concurrency)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return _per_process("session", make)
+
+
+def async_http_client():
+    """Shared httpx.AsyncClient for the SMS gateways (asyncio callers)."""
+    def make():
+        import httpx
+        size = max(FAST2SMS.concurrency, TWO_FACTOR.concurrency)
+        return httpx.AsyncClient(limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+                                 timeout=_connect_only(httpx, FAST2SMS, TWO_FACTOR))
+    return _per_process("async_http", make)
+
+
+def _connect_only(httpx, *providers):
+    """
+    Default timeout for a client shared by several providers: connect only. Every call
+    passes its own provider's http_timeout, so each keeps its own read timeout.
+    """
+    return httpx.Timeout(None, connect=max(p.connect_timeout for p in providers))
+
+
+def _groq_timeout(httpx):
+    return _connect_only(httpx, GROQ_CHAT, GROQ_WHISPER, GROQ_VISION)
+
+
+def groq_client(api_key):
+    """
+    Groq SDK client on a pooled httpx client. SDK retries are off; Provider does them.
+    Calls must pass timeout=<provider>.http_timeout (the client itself has no read timeout).
+    """
+    def make():
+        import httpx
+        from groq import Groq
+        size = GROQ_CHAT.concurrency + GROQ_WHISPER.concurrency + GROQ_VISION.concurrency
+        http = httpx.Client(limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+                            timeout=_groq_timeout(httpx))
+        return Groq(api_key=api_key, http_client=http, max_retries=0, timeout=_groq_timeout(httpx))
+    return _per_process(("groq", api_key), make)
+
+
+def async_groq_client(api_key):
+    def make():
+        import httpx
+        from groq import AsyncGroq
+        size = GROQ_CHAT.concurrency + GROQ_WHISPER.concurrency + GROQ_VISION.concurrency
+        http = httpx.AsyncClient(limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+                                 timeout=_groq_timeout(httpx))
+        return AsyncGroq(api_key=api_key, http_client=http, max_retries=0, timeout=_groq_timeout(httpx))
+    return _per_process(("async_groq", api_key), make)
+
+
+def stats():
+    return {name: provider.stats() for name, provider in PROVIDERS.items()}
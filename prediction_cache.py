@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def image_key(data, model_version, *options):
+    """Content address for an upload: sha256 of the bytes + model version + request options."""
+    h = hashlib.sha256(data)
+    h.update(str(model_version).encode("utf-8"))
+    for option in options:
+        h.update(b"\0" + str(option or "").encode("utf-8"))
+    return h.hexdigest()
+
+
+def _atomic_write(path, data):
+    # Write to a temp file in the same directory then rename, so other workers never see partial files
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class PredictionCache:
+    """
+    Cache of full /predict responses keyed by image content hash.
+    Tier 1 is a bounded in-process LRU; tier 2 (optional) is a directory of JSON files
+    shared by every Gunicorn worker. Heatmap URLs point into the ArtifactStore; an
+    entry whose heatmap has since been evicted counts as a miss. Entries older than
+    max_age seconds are misses, and the directory is trimmed (expired files, then the
+    oldest) to max_bytes every evict_every writes.
+    """
+    def __init__(self, max_entries=256, disk_dir=None, max_bytes=100 * 1024 * 1024, max_age=7 * 24 * 3600,
+                 evict_every=32):
+        self.max_entries = max(0, int(max_entries))
+        self.disk_dir = disk_dir or None
+        self.max_bytes = int(max_bytes)
+        self.max_age = float(max_age)
+        self.evict_every = max(1, int(evict_every))
+        self._writes = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.stores = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _artifact_ok(self, result):
+        url = result.get("heatmap")
+        return not url or os.path.exists(url.lstrip("/"))
+
+    def get(self, key, need_heatmap=False):
+        """Return a cached response dict or None. need_heatmap rejects entries cached without one."""
+        now = time.time()
+        with self._lock:
+            created, result = self._memory.get(key, (None, None))
+            if result is not None and now - created > self.max_age:
+                del self._memory[key]
+                result = None
+            if result is not None:
+                self._memory.move_to_end(key)
+        source = "memory"
+        if result is None and self.disk_dir:
+            path = os.path.join(self.disk_dir, key + ".json")
+            try:
+                created = os.stat(path).st_mtime
+                if now - created <= self.max_age:
+                    with open(path, "r", encoding="utf-8") as f:
+                        result = json.load(f)
+                    source = "disk"
+            except (OSError, ValueError):
+                result = None
+        if result is None or (need_heatmap and not result.get("heatmap")) or not self._artifact_ok(result):
+            self.misses += 1
+            return None
+        if source == "disk":
+            self.hits_disk += 1
+            self._remember(key, result, created)
+        else:
+            self.hits_memory += 1
+        return dict(result)
+
+    def put(self, key, result):
+        """Store a response and return the stored copy."""
+        result = dict(result)
+        self._remember(key, result, time.time())
+        if self.disk_dir:
+            _atomic_write(os.path.join(self.disk_dir, key + ".json"),
+                          json.dumps(result, ensure_ascii=False).encode("utf-8"))
+            with self._lock:
+                self._writes += 1
+                due = self._writes % self.evict_every == 0
+            if due:
+                self.evict()
+        self.stores += 1
+        return dict(result)
+
+    def evict(self):
+        """Delete expired entry files, then the oldest ones until the directory fits in max_bytes."""
+        if not self.disk_dir:
+            return 0
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def _remember(self, key, result, created):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._memory[key] = (created, result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "entries_memory": len(self._memory),
+            "max_entries": self.max_entries,
+            "disk_enabled": bool(self.disk_dir),
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_ratio": round((self.hits_memory + self.hits_disk) / lookups, 3) if lookups else 0.0,
+        }
+
+
+def model_version(path):
+    """MODEL_VERSION env var, else a fingerprint of the weights file (size + mtime)."""
+    version = os.environ.get("MODEL_VERSION")
+    if version:
+        return version
+    try:
+        st = os.stat(path)
+        return f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        return "untrained"
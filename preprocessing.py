@@ -0,0 +1,172 @@
+import os
+import struct
+import threading
+import cv2
+import numpy as np
+
+# ImageNet normalisation used by the ConvNeXt checkpoint
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+INPUT_SIZE = 224
+
+# Sharpening kernel used by the enhancement step
+SHARPEN_KERNEL = np.array([[-1, -1, -1],
+                           [-1,  9, -1],
+                           [-1, -1, -1]], dtype=np.float32)
+
+
+# JPEG frame markers that carry the image size (SOF0-SOF15 minus DHT/JPG/DAC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Reduced-resolution decode flags, largest reduction first
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def image_size(data):
+    """(width, height) from a JPEG or PNG header without decoding pixels, or None."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    n = len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+class Preprocessor:
+    """
+    Reusable image pipeline shared by the web app, LeafAnalyzer and the scripts.
+    CLAHE objects and the sharpening kernel are built once (CLAHE per thread, since
+    OpenCV's object keeps internal buffers), resizing and normalisation work directly
+    on numpy/torch buffers, and tensors can be written into preallocated batches.
+    """
+    def __init__(self, size=INPUT_SIZE, clip_limit=2.0, tile_grid=(8, 8), max_side=1024):
+        self.size = size
+        # Working resolution: uploads are decoded/downscaled so the longest side is at most this
+        self.max_side = int(max_side) if max_side else None
+        self.clip_limit = clip_limit
+        self.tile_grid = tile_grid
+        self._local = threading.local()
+        # Normalisation tensors are built on first use: decode / resize / enhance work
+        # without torch (the vision-LLM deployment does not install it)
+        self._shift = None
+        self._scale = None
+
+    def _normalizer(self):
+        if self._shift is None:
+            import torch
+            # uint8 -> normalised float in one fused step: (x - 255*mean) * 1/(255*std)
+            self._scale = torch.from_numpy(1.0 / (STD * 255.0)).view(1, 3, 1, 1)
+            self._shift = torch.from_numpy(MEAN * 255.0).view(1, 3, 1, 1)
+        return self._shift, self._scale
+
+    def _clahe(self):
+        clahe = getattr(self._local, "clahe", None)
+        if clahe is None:
+            clahe = self._local.clahe = cv2.createCLAHE(clipLimit=self.clip_limit, tileGridSize=self.tile_grid)
+        return clahe
+
+    def decode(self, data, max_side=None):
+        """
+        Decode an uploaded image (BGR) at working resolution. Big JPEGs are decoded with
+        IMREAD_REDUCED_COLOR_{2,4,8} so a 12-50 MP photo never materialises at full size;
+        anything still larger than max_side is then area-downscaled.
+        """
+        max_side = max_side or self.max_side
+        buf = np.frombuffer(data, np.uint8)
+        flag = cv2.IMREAD_COLOR
+        size = image_size(data) if max_side else None
+        if size and data[:2] == b"\xff\xd8":
+            longest = max(size)
+            for factor, reduced in _REDUCED_FLAGS:
+                if longest // factor >= max_side:
+                    flag = reduced
+                    break
+        img = cv2.imdecode(buf, flag)
+        if img is None:
+            raise ValueError("Could not decode image (unsupported or corrupt file)")
+        return self.limit(img, max_side)
+
+    def read(self, path, max_side=None):
+        """decode() for a file on disk."""
+        with open(path, "rb") as f:
+            return self.decode(f.read(), max_side)
+
+    @staticmethod
+    def limit(image, max_side):
+        """Area-downscale so the longest side is at most max_side (no upscaling)."""
+        if not max_side:
+            return image
+        h, w = image.shape[:2]
+        longest = max(h, w)
+        if longest <= max_side:
+            return image
+        scale = max_side / float(longest)
+        return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+    def enhance(self, image):
+        """Apply CLAHE (on the LAB lightness channel) and sharpening to an RGB uint8 image."""
+        lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
+        l = cv2.extractChannel(lab, 0)
+        cv2.insertChannel(self._clahe().apply(l), lab, 0)
+        enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+        sharpened = cv2.filter2D(enhanced, -1, SHARPEN_KERNEL)
+        # Blend original and sharpened (70% sharpened, 30% original)
+        return cv2.addWeighted(sharpened, 0.7, enhanced, 0.3, 0, dst=sharpened)
+
+    def resize(self, image):
+        """Resize an RGB uint8 image to the network input size."""
+        if image.shape[0] == self.size and image.shape[1] == self.size:
+            return image
+        return cv2.resize(image, (self.size, self.size), interpolation=cv2.INTER_AREA)
+
+    def buffer(self, n):
+        """Per-thread preallocated [n, 3, size, size] float tensor, reused across calls."""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        out = buffers.get(n)
+        if out is None:
+            import torch
+            out = buffers[n] = torch.empty(n, 3, self.size, self.size)
+        return out
+
+    def to_tensor(self, images, out=None):
+        """
+        Normalise RGB uint8 images of shape [H, W, 3] or [N, H, W, 3] (already at input
+        size) into a float tensor [N, 3, H, W]. Writes into out if given.
+        """
+        import torch
+        shift, scale = self._normalizer()
+        if images.ndim == 3:
+            images = images[None]
+        src = torch.from_numpy(np.ascontiguousarray(images)).permute(0, 3, 1, 2)
+        if out is None:
+            out = torch.empty(src.shape, dtype=torch.float32)
+        out.copy_(src)
+        return out.sub_(shift).mul_(scale)
+
+    def prepare(self, image, enhance=True):
+        """Full single-image path: optional enhancement, resize, normalise -> [1, 3, size, size]."""
+        if enhance:
+            image = self.enhance(image)
+        return self.to_tensor(self.resize(image))
+
+
+# Shared instance (CLAHE objects and buffers are per thread inside)
+PREPROCESSOR = Preprocessor(max_side=int(os.environ.get("PREPROCESS_MAX_SIDE", "1024")))
@@ -0,0 +1,243 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reminders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key TEXT UNIQUE,
+    phone TEXT NOT NULL,
+    body TEXT NOT NULL,
+    due_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_token TEXT,
+    lease_until REAL,
+    last_error TEXT,
+    message_id TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS reminders_due ON reminders (status, due_at);
+CREATE INDEX IF NOT EXISTS reminders_lease ON reminders (lease_token);
+"""
+
+
+class ReminderScheduler:
+    """
+    Durable SMS reminders in SQLite.
+    Reminders are rows ordered by the (status, due_at) index; one dispatcher thread per
+    process claims due rows in batches under a lease, sends them and marks them sent.
+    The lease is renewed before each send and rows another worker has reclaimed are
+    skipped, so a slow batch is not sent twice; a worker that dies mid-send leaves its
+    lease to expire, so the rows are claimed again (at-least-once). dedup_key is unique,
+    so scheduling the same reminder twice is a no-op, and a row is only ever completed
+    by the lease holder.
+    Several Gunicorn workers can share one database file.
+    """
+    def __init__(self, path, sender, batch_size=100, poll_seconds=5.0, lease_seconds=120.0,
+                 max_attempts=5, retry_seconds=60.0, retention_days=30, dispatch=True):
+        self.path = path
+        # dispatch=False: only store reminders (another process sends them)
+        self.dispatch = dispatch
+        self.sender = sender
+        self.batch_size = max(1, int(batch_size))
+        self.poll_seconds = float(poll_seconds)
+        self.lease_seconds = float(lease_seconds)
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_seconds = float(retry_seconds)
+        self.retention = float(retention_days) * 86400
+        self._last_purge = 0.0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # Databases created before reminders recorded the id of the SMS they were handed to
+        if "message_id" not in [row[1] for row in conn.execute("PRAGMA table_info(reminders)")]:
+            conn.execute("ALTER TABLE reminders ADD COLUMN message_id TEXT")
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def schedule(self, phone, body, due_at, dedup_key=None):
+        """Store a reminder. Returns (id, created); created is False for a duplicate dedup_key."""
+        conn = self._connect()
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO reminders (dedup_key, phone, body, due_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (dedup_key, phone, body, float(due_at), time.time()))
+        if cur.rowcount:
+            reminder_id, created = cur.lastrowid, True
+        else:
+            reminder_id = conn.execute("SELECT id FROM reminders WHERE dedup_key = ?", (dedup_key,)).fetchone()[0]
+            created = False
+        self.start()
+        self._wake.set()
+        return reminder_id, created
+
+    def get(self, reminder_id):
+        row = self._connect().execute(
+            "SELECT id, phone, due_at, status, attempts, last_error, message_id, created_at, sent_at "
+            "FROM reminders WHERE id = ?",
+            (reminder_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def claim(self, now=None):
+        """Lease up to batch_size due reminders (pending, or sending with an expired lease)."""
+        now = time.time() if now is None else now
+        token = uuid.uuid4().hex
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases first (a worker died mid-send), then the oldest due reminders
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM reminders WHERE status = 'sending' AND lease_until <= ? LIMIT ?",
+                (now, self.batch_size))]
+            if len(ids) < self.batch_size:
+                ids += [row[0] for row in conn.execute(
+                    "SELECT id FROM reminders WHERE status = 'pending' AND due_at <= ? ORDER BY due_at LIMIT ?",
+                    (now, self.batch_size - len(ids)))]
+            if ids:
+                marks = ",".join("?" * len(ids))
+                conn.execute(
+                    f"UPDATE reminders SET status = 'sending', lease_token = ?, lease_until = ?, "
+                    f"attempts = attempts + 1 WHERE id IN ({marks})",
+                    [token, now + self.lease_seconds] + ids)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not ids:
+            return token, []
+        rows = conn.execute(
+            f"SELECT id, phone, body, attempts FROM reminders WHERE lease_token = ? ORDER BY due_at", (token,))
+        return token, [dict(row) for row in rows]
+
+    def renew(self, reminder_id, token):
+        """Extend the lease on a reminder about to be sent. False if it is no longer ours."""
+        cur = self._connect().execute(
+            "UPDATE reminders SET lease_until = ? WHERE id = ? AND lease_token = ? AND status = 'sending'",
+            (time.time() + self.lease_seconds, reminder_id, token))
+        return cur.rowcount == 1
+
+    def complete(self, reminder_id, token, result):
+        """
+        Record a send result. Only the lease holder can complete a row. A sender that hands
+        the SMS to a queue returns its message_id, which is stored for status lookups.
+        """
+        conn = self._connect()
+        if result.get("status") == "success":
+            conn.execute("UPDATE reminders SET status = 'sent', sent_at = ?, last_error = NULL, lease_token = NULL, "
+                         "message_id = ? WHERE id = ? AND lease_token = ?",
+                         (time.time(), result.get("message_id"), reminder_id, token))
+            return
+        row = conn.execute("SELECT attempts FROM reminders WHERE id = ?", (reminder_id,)).fetchone()
+        attempts = row[0] if row else self.max_attempts
+        if attempts >= self.max_attempts:
+            conn.execute("UPDATE reminders SET status = 'failed', last_error = ?, lease_token = NULL "
+                         "WHERE id = ? AND lease_token = ?", (result.get("message"), reminder_id, token))
+        else:
+            # Back off linearly, then retry
+            conn.execute("UPDATE reminders SET status = 'pending', due_at = ?, last_error = ?, lease_token = NULL "
+                         "WHERE id = ? AND lease_token = ?",
+                         (time.time() + self.retry_seconds * attempts, result.get("message"), reminder_id, token))
+
+    def dispatch_once(self, now=None):
+        """Claim and send one batch. Returns the number of reminders handled."""
+        token, batch = self.claim(now)
+        for reminder in batch:
+            # Earlier sends in this batch may have outlasted the lease; a reclaimed row is
+            # the other worker's to send
+            if not self.renew(reminder["id"], token):
+                continue
+            try:
+                result = self.sender(reminder["phone"], reminder["body"])
+            except Exception as e:
+                result = {"status": "error", "message": str(e)}
+            self.complete(reminder["id"], token, result)
+            if result.get("status") == "success":
+                print(f"📨 Reminder {reminder['id']} sent to {reminder['phone']}")
+            else:
+                print(f"⚠️  Reminder {reminder['id']} failed (attempt {reminder['attempts']}): {result.get('message')}")
+        return len(batch)
+
+    def purge(self, now=None):
+        """Delete sent / failed reminders older than the retention period."""
+        now = time.time() if now is None else now
+        cur = self._connect().execute(
+            "DELETE FROM reminders WHERE status IN ('sent', 'failed') AND due_at < ?", (now - self.retention,))
+        return cur.rowcount
+
+    def _next_due(self):
+        row = self._connect().execute(
+            "SELECT MIN(due_at) FROM reminders WHERE status = 'pending'").fetchone()
+        return row[0]
+
+    def _run(self):
+        while True:
+            try:
+                if self.dispatch_once() >= self.batch_size:
+                    # A full batch: more may be due already
+                    continue
+                next_due = self._next_due()
+                if time.time() - self._last_purge > 3600:
+                    self._last_purge = time.time()
+                    self.purge()
+            except Exception as e:
+                print(f"❌ Reminder dispatcher error: {e}")
+                next_due = None
+            wait = self.poll_seconds
+            if next_due is not None:
+                wait = min(wait, max(0.0, next_due - time.time()))
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def start(self):
+        # Threads do not survive a fork (Gunicorn --preload), so start lazily per process
+        if not self.dispatch:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="reminder-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM reminders GROUP BY status").fetchall()
+        counts = {status: count for status, count in rows}
+        return {"pending": counts.get("pending", 0), "sending": counts.get("sending", 0),
+                "sent": counts.get("sent", 0), "failed": counts.get("failed", 0),
+                "next_due": self._next_due(), "dispatcher_alive": self._thread is not None and self._thread.is_alive()}
+
+
+def reminder_scheduler_from_env(sender):
+    """REMINDER_DB / REMINDER_BATCH_SIZE / REMINDER_POLL_SECONDS / REMINDER_MAX_ATTEMPTS /
+    REMINDER_RETENTION_DAYS / REMINDER_DISPATCHER."""
+    return ReminderScheduler(
+        os.environ.get("REMINDER_DB", "data/reminders.db"),
+        sender,
+        batch_size=int(os.environ.get("REMINDER_BATCH_SIZE", "100")),
+        poll_seconds=float(os.environ.get("REMINDER_POLL_SECONDS", "5")),
+        max_attempts=int(os.environ.get("REMINDER_MAX_ATTEMPTS", "5")),
+        retention_days=float(os.environ.get("REMINDER_RETENTION_DAYS", "30")),
+        dispatch=os.environ.get("REMINDER_DISPATCHER", "1").lower() not in ("0", "false", "off", "no"),
+    )
@@ -0,0 +1,434 @@
+"""
+Hybrid diagnosis router: the local ConvNeXt first, the Groq vision model only when needed.
+
+    local ready, not overloaded ---------------------------> local answer
+        confidence < ROUTER_MIN_CONFIDENCE ---------------> remote answer (local if it fails / runs out of budget)
+        no answer after ROUTER_HEDGE_MS ------------------> remote hedge, first answer wins
+    local still loading / failed / overloaded ------------> remote answer
+
+Each request has a latency budget (ROUTER_BUDGET_MS): the remote model is only asked when it
+is available (API key set, circuit not open) and there is budget left. Whenever both engines
+answer the same image their labels are compared, so /metrics/router shows how often the API
+would have changed the local diagnosis.
+"""
+import os
+import re
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from metrics import ROUTER_DECISIONS, timed
+
+MODES = ("local", "remote", "hybrid")
+# Label for remote answers outside the local label set (keeps metric labels and cache keys bounded)
+UNKNOWN = "Unknown"
+# Other names the vision model uses for the local classes (lower case)
+ALIASES = {
+    "leaf curl": "Curl", "papaya leaf curl": "Curl",
+    "ring spot": "Ringspot", "papaya ringspot": "Ringspot", "papaya ringspot virus": "Ringspot",
+    "mealy bug": "Mealybug", "mealybugs": "Mealybug", "papaya mealybug": "Mealybug",
+    "mites": "Mite disease", "mite": "Mite disease", "spider mites": "Mite disease",
+    "bacterial leaf spot": "Bacterial spot", "papaya mosaic": "Mosaic",
+}
+
+
+def parse_confidence(value):
+    """'95%', '0.95' or 95 -> 0.95 (None if unreadable)."""
+    try:
+        number = float(str(value).strip().rstrip("%"))
+    except (TypeError, ValueError):
+        return None
+    return number / 100.0 if number > 1.0 else number
+
+
+def _result(future):
+    """A finished future's result, None while it runs or if it failed."""
+    if future is None or not future.done() or future.exception() is not None:
+        return None
+    return future.result()
+
+
+class Route:
+    """Which engine answered and why. prediction is the local Prediction when the local model ran."""
+    def __init__(self, engine, reason, label, confidence, prediction=None, remote=None):
+        self.engine = engine
+        self.reason = reason
+        self.label = label
+        self.confidence = confidence
+        self.prediction = prediction
+        self.remote = remote
+
+
+class EngineStats:
+    def __init__(self, window=500):
+        self.calls = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds, ok):
+        self.calls += 1
+        if ok:
+            self.latencies.append(seconds)
+        else:
+            self.errors += 1
+
+    def to_dict(self):
+        latencies = sorted(self.latencies)
+        def pct(q):
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1) if latencies else None
+        return {"calls": self.calls, "errors": self.errors, "p50_ms": pct(0.5), "p95_ms": pct(0.95)}
+
+
+class HybridRouter:
+    def __init__(self, local, remote=None, labels=(), mode="hybrid", budget=10.0, min_confidence=0.6,
+                 hedge_after=None, local_capacity=0, workers=8):
+        """
+        local: LazyResource of the InferenceService; remote: VisionAdvisor (or None).
+        budget / hedge_after are seconds; local_capacity is the number of concurrent local
+        predictions after which new requests go to the remote model (0 = no limit).
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown router mode '{mode}' (use one of: {', '.join(MODES)})")
+        self.local = local
+        self.remote = remote
+        self.labels = list(labels)
+        self.mode = mode
+        self.budget = float(budget)
+        self.min_confidence = float(min_confidence)
+        self.hedge_after = float(hedge_after) if hedge_after else None
+        self.local_capacity = int(local_capacity or 0)
+        self.workers = int(workers)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._local_active = 0
+        self._warming = False
+        self.engines = {"local": EngineStats(), "remote": EngineStats()}
+        self.decisions = {}
+        self.agreement = {"compared": 0, "agreed": 0}
+        self.disagreements = {}
+
+    def _executor(self):
+        # Threads do not survive a fork, so each Gunicorn worker gets its own pool
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="router")
+                self._pid = os.getpid()
+            return self._pool
+
+    def _submit(self, fn, *args):
+        # Stage timings of the worker thread still land in the request's trace
+        return self._executor().submit(contextvars.copy_context().run, fn, *args)
+
+    def remote_available(self, hedge=False):
+        """API key set and circuit not open; hedges are also skipped while every remote slot is busy."""
+        if self.remote is None or not self.remote.api_key or self.mode == "local":
+            return False
+        from outbound import GROQ_VISION
+        stats = GROQ_VISION.stats()
+        if stats["circuit"] == "open":
+            return False
+        return not hedge or stats["active"] < stats["concurrency"]
+
+    def signature(self):
+        """Routing setup for cache keys: mode, confidence threshold and the remote model if it can answer."""
+        remote = self.remote.model if self.remote_available() else "local"
+        return f"{self.mode}:{self.min_confidence}:{remote}"
+
+    def local_available(self):
+        return self.mode != "remote" and self.local.ready
+
+    def local_overloaded(self):
+        return bool(self.local_capacity) and self._local_active >= self.local_capacity
+
+    def label_for(self, condition):
+        """
+        Map the remote model's free-text condition onto the local label set: an exact
+        (case-insensitive) label or alias, else the one label or alias that appears in it as
+        whole words. None if it matches none, or more than one label.
+        """
+        text = " ".join(re.findall(r"[a-z0-9]+", str(condition or "").lower()))
+        names = {label.lower(): label for label in self.labels}
+        names.update((alias, label) for alias, label in ALIASES.items() if label in self.labels)
+        if text in names:
+            return names[text]
+        found = {label for name, label in names.items() if re.search(r"\b" + re.escape(name) + r"\b", text)}
+        return found.pop() if len(found) == 1 else None
+
+    # Engines
+
+    def _run_local(self, data, options):
+        with self._lock:
+            self._local_active += 1
+        started = time.perf_counter()
+        ok = False
+        try:
+            with timed("engine_local"):
+                [prediction] = self.local.get().predict([data], options)
+            ok = True
+            return prediction
+        finally:
+            with self._lock:
+                self._local_active -= 1
+                self.engines["local"].record(time.perf_counter() - started, ok)
+
+    def _run_remote(self, data):
+        started = time.perf_counter()
+        ok = False
+        try:
+            with timed("engine_remote"):
+                result = self.remote.diagnose(data)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.engines["remote"].record(time.perf_counter() - started, ok)
+
+    def _local_route(self, prediction, reason):
+        return Route("local", reason, prediction.label, prediction.confidence, prediction=prediction)
+
+    def _remote_route(self, result, reason, prediction=None):
+        label = self.label_for(result.get("condition"))
+        if label is None and prediction is not None:
+            # A condition the local model does not know: its own answer is the better one
+            return self._local_route(prediction, "remote_unmatched")
+        confidence = parse_confidence(result.get("confidence"))
+        return Route("remote", reason, label or UNKNOWN,
+                     0.0 if confidence is None else confidence, prediction=prediction, remote=result)
+
+    def _matched(self, remote_future):
+        """Remote call succeeded with a condition from the local label set."""
+        result = _result(remote_future)
+        return result is not None and self.label_for(result.get("condition")) is not None
+
+    def _fallback_reason(self, remote_future):
+        return "remote_failed" if remote_future.exception() is not None else "remote_unmatched"
+
+    def _compare(self, local_future, remote_future):
+        """Record agreement once both engines have answered (also for answers that lost a hedge)."""
+        recorded = []
+        def done(_):
+            if not (local_future.done() and remote_future.done()):
+                return
+            if local_future.exception() is not None or remote_future.exception() is not None:
+                return
+            local_label = local_future.result().label
+            remote_label = self.label_for(remote_future.result().get("condition")) or UNKNOWN
+            with self._lock:
+                if recorded:
+                    return
+                recorded.append(True)
+                self.agreement["compared"] += 1
+                if local_label == remote_label:
+                    self.agreement["agreed"] += 1
+                else:
+                    pair = f"{local_label} -> {remote_label}"
+                    self.disagreements[pair] = self.disagreements.get(pair, 0) + 1
+        local_future.add_done_callback(done)
+        remote_future.add_done_callback(done)
+
+    def _decide(self, route):
+        with self._lock:
+            key = f"{route.engine}:{route.reason}"
+            self.decisions[key] = self.decisions.get(key, 0) + 1
+        ROUTER_DECISIONS.inc(engine=route.engine, reason=route.reason)
+        return route
+
+    # Routing
+
+    def _plan(self):
+        """("local" | "remote" | "hybrid", reason) for the next request."""
+        if self.mode == "local" or (self.mode == "hybrid" and not self.remote_available()):
+            # Nothing to fall back to: plain local inference
+            return "local", "local"
+        if not self.local_available() or self.local_overloaded():
+            if self.mode == "hybrid" and not self.local.ready and not self._warming:
+                # Lazily loaded model (MODEL_WARMUP=0): start loading it while the remote model answers
+                self._warming = True
+                self.local.warm()
+            return "remote", "remote" if self.mode == "remote" else \
+                ("local_overloaded" if self.local.ready else "local_unavailable")
+        return "hybrid", None
+
+    def route(self, data, options=None):
+        """Diagnose one upload (encoded bytes) within the budget. Returns a Route."""
+        started = time.monotonic()
+        deadline = started + self.budget
+        plan, reason = self._plan()
+        if plan == "local":
+            return self._decide(self._local_route(self._run_local(data, options), reason))
+        if plan == "remote":
+            try:
+                return self._decide(self._remote_route(self._run_remote(data), reason))
+            except Exception:
+                if self.mode == "remote" or not self.local.ready:
+                    raise
+                # Overloaded is still better than no answer
+                return self._decide(self._local_route(self._run_local(data, options), "remote_failed"))
+
+        local_future = self._submit(self._run_local, data, options)
+        remote_future = None
+        def remaining():
+            return max(deadline - time.monotonic(), 0)
+
+        # Hedge: a slow local answer (deep queue, busy CPU) races the remote model
+        if self.hedge_after is not None and self.hedge_after < self.budget:
+            wait([local_future], timeout=self.hedge_after)
+            if not local_future.done() and self.remote_available(hedge=True):
+                remote_future = self._submit(self._run_remote, data)
+                reason = "hedge"
+        if remote_future is None:
+            wait([local_future], timeout=remaining())
+            local = _result(local_future)
+            if local is not None and local.confidence >= self.min_confidence:
+                return self._decide(self._local_route(local, "confident"))
+            if remaining() > 0 and self.remote_available():
+                remote_future = self._submit(self._run_remote, data)
+                reason = "low_confidence" if local is not None else \
+                    ("local_failed" if local_future.done() else "local_slow")
+            elif local is not None:
+                return self._decide(self._local_route(local, "low_confidence"))
+
+        if remote_future is not None:
+            self._compare(local_future, remote_future)
+            # The remote answer wins when it arrives within the budget; a confident local
+            # answer (or a failed remote call) ends the wait early
+            pending = {local_future, remote_future}
+            while pending and remaining() > 0:
+                done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+                if remote_future in done and self._matched(remote_future):
+                    return self._decide(self._remote_route(remote_future.result(), reason, _result(local_future)))
+                local = _result(local_future)
+                if local is not None and local.confidence >= self.min_confidence:
+                    return self._decide(self._local_route(local, "confident"))
+                if local is not None and remote_future.done():
+                    return self._decide(self._local_route(local, self._fallback_reason(remote_future)))
+            local = _result(local_future)
+            if local is not None:
+                return self._decide(self._local_route(local, "budget"))
+
+        # Budget spent without any answer: whichever engine finishes first
+        futures = [f for f in (local_future, remote_future) if f is not None]
+        for future in as_completed(futures):
+            if future.exception() is None:
+                if future is remote_future:
+                    return self._decide(self._remote_route(future.result(), "over_budget", _result(local_future)))
+                return self._decide(self._local_route(future.result(), "over_budget"))
+        # Both failed: surface the local error (the one the app always had)
+        return local_future.result()
+
+    async def aroute(self, data, options=None, executor=None):
+        """
+        asyncio version of route(): the local model runs on executor (a bounded pool for
+        CPU-bound inference), the remote call is awaited on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.budget
+        def local():
+            # Stage timings of the worker thread still land in the request's trace
+            return loop.run_in_executor(executor, contextvars.copy_context().run, self._run_local, data, options)
+        def remaining():
+            return max(deadline - time.monotonic(), 0)
+
+        plan, reason = self._plan()
+        if plan == "local":
+            return self._decide(self._local_route(await local(), reason))
+        if plan == "remote":
+            try:
+                return self._decide(self._remote_route(await self._arun_remote(data, executor), reason))
+            except Exception:
+                if self.mode == "remote" or not self.local.ready:
+                    raise
+                return self._decide(self._local_route(await local(), "remote_failed"))
+
+        local_future = local()
+        remote_future = None
+        if self.hedge_after is not None and self.hedge_after < self.budget:
+            await asyncio.wait([local_future], timeout=self.hedge_after)
+            if not local_future.done() and self.remote_available(hedge=True):
+                remote_future = asyncio.ensure_future(self._arun_remote(data, executor))
+                reason = "hedge"
+        if remote_future is None:
+            await asyncio.wait([local_future], timeout=remaining())
+            prediction = _result(local_future)
+            if prediction is not None and prediction.confidence >= self.min_confidence:
+                return self._decide(self._local_route(prediction, "confident"))
+            if remaining() > 0 and self.remote_available():
+                remote_future = asyncio.ensure_future(self._arun_remote(data, executor))
+                reason = "low_confidence" if prediction is not None else \
+                    ("local_failed" if local_future.done() else "local_slow")
+            elif prediction is not None:
+                return self._decide(self._local_route(prediction, "low_confidence"))
+
+        if remote_future is not None:
+            self._compare(local_future, remote_future)
+            pending = {local_future, remote_future}
+            while pending and remaining() > 0:
+                done, pending = await asyncio.wait(pending, timeout=remaining(), return_when=asyncio.FIRST_COMPLETED)
+                if remote_future in done and self._matched(remote_future):
+                    return self._decide(self._remote_route(remote_future.result(), reason, _result(local_future)))
+                prediction = _result(local_future)
+                if prediction is not None and prediction.confidence >= self.min_confidence:
+                    return self._decide(self._local_route(prediction, "confident"))
+                if prediction is not None and remote_future.done():
+                    return self._decide(self._local_route(prediction, self._fallback_reason(remote_future)))
+            prediction = _result(local_future)
+            if prediction is not None:
+                return self._decide(self._local_route(prediction, "budget"))
+
+        pending = {f for f in (local_future, remote_future) if f is not None}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is remote_future:
+                        return self._decide(self._remote_route(future.result(), "over_budget", _result(local_future)))
+                    return self._decide(self._local_route(future.result(), "over_budget"))
+        return local_future.result()
+
+    async def _arun_remote(self, data, executor=None):
+        started = time.perf_counter()
+        ok = False
+        try:
+            with timed("engine_remote"):
+                result = await self.remote.adiagnose(data, executor)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.engines["remote"].record(time.perf_counter() - started, ok)
+
+    def stats(self):
+        with self._lock:
+            compared = self.agreement["compared"]
+            return {
+                "mode": self.mode,
+                "budget_ms": round(self.budget * 1000),
+                "min_confidence": self.min_confidence,
+                "hedge_ms": round(self.hedge_after * 1000) if self.hedge_after else None,
+                "local_active": self._local_active,
+                "engines": {name: stats.to_dict() for name, stats in self.engines.items()},
+                "decisions": dict(self.decisions),
+                "agreement": dict(self.agreement, rate=round(self.agreement["agreed"] / compared, 4) if compared else None),
+                "disagreements": dict(self.disagreements),
+            }
+
+
+def router_from_env(local, remote, labels):
+    """
+    ROUTER_MODE: hybrid (default) | local | remote
+    ROUTER_BUDGET_MS (default 10000): per-request latency budget
+    ROUTER_MIN_CONFIDENCE (default 0.6): local answers below this go to the remote model
+    ROUTER_HEDGE_MS: start the remote model too when the local one has not answered by then (unset = no hedging)
+    ROUTER_LOCAL_CAPACITY: concurrent local predictions before requests overflow to the remote model (0 = no limit)
+    """
+    hedge = float(os.environ.get("ROUTER_HEDGE_MS", "0") or 0)
+    return HybridRouter(local, remote, labels,
+                        mode=os.environ.get("ROUTER_MODE", "hybrid").strip().lower(),
+                        budget=float(os.environ.get("ROUTER_BUDGET_MS", "10000")) / 1000.0,
+                        min_confidence=float(os.environ.get("ROUTER_MIN_CONFIDENCE", "0.6")),
+                        hedge_after=hedge / 1000.0 if hedge else None,
+                        local_capacity=int(os.environ.get("ROUTER_LOCAL_CAPACITY", "0") or 0),
+                        workers=int(os.environ.get("ROUTER_WORKERS", "8")))
@@ -0,0 +1,362 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+from metrics import timed, record_error
+from outbound import was_not_sent
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sms_messages (
+    id TEXT PRIMARY KEY,
+    phone TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    provider TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_token TEXT,
+    lease_until REAL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS sms_messages_queue ON sms_messages (status, available_at);
+CREATE INDEX IF NOT EXISTS sms_messages_lease ON sms_messages (lease_token);
+"""
+
+# Gateways that accept many comma-separated numbers in one call
+BULK_PROVIDERS = ("fast2sms", "mock")
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average with bursts of up to `burst`."""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1.0):
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1.0):
+        """Block until `tokens` are available."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket kept in a SQLite table, so every worker process using the same database
+    draws from one bucket: the provider sees `rate` calls per second in total, not per worker.
+    """
+    def __init__(self, path, name, rate, burst=None):
+        super().__init__(rate, burst)
+        self.path = path
+        self.name = name
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _take(self, tokens):
+        """Take the tokens if the shared bucket has them. Returns 0.0, or the seconds to wait."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE name = ?", (self.name,)).fetchone()
+            level = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+            wait = 0.0
+            if level >= tokens:
+                level -= tokens
+            else:
+                wait = (tokens - level) / self.rate
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                         (self.name, level, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def try_acquire(self, tokens=1.0):
+        return self._take(tokens) == 0.0
+
+    def acquire(self, tokens=1.0):
+        """Block until `tokens` are available in the shared bucket."""
+        while True:
+            wait = self._take(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+
+class SMSQueue:
+    """
+    Outbound SMS queue in SQLite.
+    /send-sms only inserts a row and returns its message id. One dispatcher thread per
+    process waits a short window so bursts accumulate, leases a batch of queued rows,
+    groups them by identical body and sends each group as bulk provider calls
+    (comma-separated numbers for Fast2SMS, one call per number for 2Factor), each call
+    taking a token from that provider's bucket. Every row records its own delivery
+    status, so a message can be looked up by id later. Failed sends are only requeued
+    when the provider result says retry (nothing went out), the rest are marked failed.
+    The lease is renewed before each provider call and rows whose lease was lost are
+    skipped, so a slow batch is not sent twice; leases that expire because a worker died
+    mid-send are claimed again (at-least-once).
+    """
+    def __init__(self, path, service, batch_size=500, bulk_size=100, window_ms=300, poll_seconds=2.0,
+                 lease_seconds=120.0, max_attempts=3, retry_seconds=30.0, rates=None, dispatch=True):
+        self.path = path
+        self.service = service
+        self.batch_size = max(1, int(batch_size))
+        self.bulk_size = max(1, int(bulk_size))
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.poll_seconds = float(poll_seconds)
+        self.lease_seconds = float(lease_seconds)
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_seconds = float(retry_seconds)
+        # provider -> TokenBucket; providers without one are not limited
+        self.buckets = rates or {}
+        self.dispatch = dispatch
+        self.calls_total = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, phone, body, send_at=None):
+        """Queue a message. Returns its id."""
+        message_id = uuid.uuid4().hex
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO sms_messages (id, phone, body, available_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (message_id, str(phone).strip(), body, now if send_at is None else float(send_at), now))
+        self.start()
+        self._wake.set()
+        return message_id
+
+    def get(self, message_id):
+        row = self._connect().execute(
+            "SELECT id, phone, status, provider, attempts, error, created_at, sent_at FROM sms_messages WHERE id = ?",
+            (message_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def claim(self, now=None):
+        """Lease up to batch_size sendable messages. Returns (token, rows)."""
+        now = time.time() if now is None else now
+        token = uuid.uuid4().hex
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM sms_messages WHERE status = 'sending' AND lease_until <= ? LIMIT ?",
+                (now, self.batch_size))]
+            if len(ids) < self.batch_size:
+                ids += [row[0] for row in conn.execute(
+                    "SELECT id FROM sms_messages WHERE status = 'queued' AND available_at <= ? "
+                    "ORDER BY available_at LIMIT ?", (now, self.batch_size - len(ids)))]
+            if ids:
+                marks = ",".join("?" * len(ids))
+                conn.execute(
+                    f"UPDATE sms_messages SET status = 'sending', lease_token = ?, lease_until = ?, "
+                    f"attempts = attempts + 1 WHERE id IN ({marks})",
+                    [token, now + self.lease_seconds] + ids)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not ids:
+            return token, []
+        rows = conn.execute("SELECT id, phone, body, attempts FROM sms_messages WHERE lease_token = ? "
+                            "ORDER BY available_at", (token,))
+        return token, [dict(row) for row in rows]
+
+    def _complete(self, rows, token, provider, result):
+        conn = self._connect()
+        now = time.time()
+        if result.get("status") == "success":
+            conn.executemany(
+                "UPDATE sms_messages SET status = 'sent', provider = ?, sent_at = ?, error = NULL, lease_token = NULL "
+                "WHERE id = ? AND lease_token = ?", [(provider, now, row["id"], token) for row in rows])
+            return
+        error = result.get("message")
+        if not result.get("retry"):
+            # The provider may have sent it (read timeout, 5xx after the request went out): never resend
+            error = f"delivery unknown, not retried: {error}"
+        for row in rows:
+            if row["attempts"] >= self.max_attempts or not result.get("retry"):
+                conn.execute("UPDATE sms_messages SET status = 'failed', provider = ?, error = ?, lease_token = NULL "
+                             "WHERE id = ? AND lease_token = ?", (provider, error, row["id"], token))
+            else:
+                conn.execute("UPDATE sms_messages SET status = 'queued', provider = ?, error = ?, available_at = ?, "
+                             "lease_token = NULL WHERE id = ? AND lease_token = ?",
+                             (provider, error, now + self.retry_seconds * row["attempts"], row["id"], token))
+
+    def _renew(self, rows, token):
+        """Extend the lease on rows about to be sent. False if another dispatcher took any of them."""
+        ids = [row["id"] for row in rows]
+        marks = ",".join("?" * len(ids))
+        cur = self._connect().execute(
+            f"UPDATE sms_messages SET lease_until = ? WHERE lease_token = ? AND status = 'sending' AND id IN ({marks})",
+            [time.time() + self.lease_seconds, token] + ids)
+        return cur.rowcount == len(ids)
+
+    def _throttle(self, provider):
+        bucket = self.buckets.get(provider)
+        if bucket is not None:
+            bucket.acquire()
+
+    def _send(self, numbers, body, provider):
+        with self._lock:
+            self.calls_total += 1
+        try:
+            with timed("sms"):
+                results = self.service.send_bulk(numbers, body)
+        except Exception as e:
+            results = [{"status": "error", "message": str(e), "retry": was_not_sent(e)}] * len(numbers)
+        for result in results:
+            if result.get("status") != "success":
+                record_error("sms")
+        return results
+
+    def dispatch_once(self, now=None):
+        """Claim one batch, send it grouped by body. Returns the number of messages handled."""
+        token, rows = self.claim(now)
+        if not rows:
+            return 0
+        provider = self.service.provider
+        chunk = self.bulk_size if provider in BULK_PROVIDERS else 1
+        groups = OrderedDict()
+        for row in rows:
+            groups.setdefault(row["body"], OrderedDict()).setdefault(row["phone"], []).append(row)
+        for body, by_phone in groups.items():
+            phones = list(by_phone)
+            for i in range(0, len(phones), chunk):
+                self._throttle(provider)
+                # Waiting on the bucket (and earlier calls) can outlast the claim's lease; numbers
+                # whose rows were reclaimed by another dispatcher are that dispatcher's to send
+                numbers = [number for number in phones[i:i + chunk] if self._renew(by_phone[number], token)]
+                if not numbers:
+                    continue
+                results = self._send(numbers, body, provider)
+                for number, result in zip(numbers, results):
+                    # The same number + body twice in one batch is delivered once, both rows get the result
+                    self._complete(by_phone[number], token, provider, result)
+                sent = sum(r.get("status") == "success" for r in results)
+                print(f"📤 SMS batch via {provider}: {sent}/{len(numbers)} number(s) sent")
+        return len(rows)
+
+    def _next_available(self):
+        row = self._connect().execute(
+            "SELECT MIN(available_at) FROM sms_messages WHERE status = 'queued'").fetchone()
+        return row[0]
+
+    def _run(self):
+        while True:
+            try:
+                if self.dispatch_once() >= self.batch_size:
+                    continue
+                next_at = self._next_available()
+            except Exception as e:
+                print(f"❌ SMS dispatcher error: {e}")
+                next_at = None
+            wait = self.poll_seconds
+            if next_at is not None:
+                wait = min(wait, max(0.0, next_at - time.time()))
+            if self._wake.wait(wait):
+                # Let a burst of /send-sms calls pile up into one bulk call
+                time.sleep(self.window)
+            self._wake.clear()
+
+    def start(self):
+        # Threads do not survive a fork (Gunicorn --preload), so start lazily per process
+        if not self.dispatch:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="sms-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM sms_messages GROUP BY status").fetchall()
+        counts = {status: count for status, count in rows}
+        return {"queued": counts.get("queued", 0), "sending": counts.get("sending", 0),
+                "sent": counts.get("sent", 0), "failed": counts.get("failed", 0),
+                "provider_calls": self.calls_total, "provider": self.service.provider,
+                "dispatcher_alive": self._thread is not None and self._thread.is_alive()}
+
+
+def sms_queue_from_env(service):
+    """
+    SMS_QUEUE_DB, SMS_BATCH_WINDOW_MS, SMS_BULK_SIZE, SMS_MAX_ATTEMPTS, SMS_DISPATCHER and the
+    per-provider call rates SMS_RATE_FAST2SMS / SMS_RATE_2FACTOR (calls per second, burst = SMS_RATE_BURST).
+    The rate buckets live in the queue database, so the limits hold across all workers.
+    """
+    path = os.environ.get("SMS_QUEUE_DB", "data/sms.db")
+    burst = float(os.environ.get("SMS_RATE_BURST", "5"))
+    rates = {
+        "fast2sms": SharedTokenBucket(path, "fast2sms", float(os.environ.get("SMS_RATE_FAST2SMS", "2")), burst),
+        "2factor": SharedTokenBucket(path, "2factor", float(os.environ.get("SMS_RATE_2FACTOR", "5")), burst),
+    }
+    return SMSQueue(
+        path,
+        service,
+        bulk_size=int(os.environ.get("SMS_BULK_SIZE", "100")),
+        window_ms=float(os.environ.get("SMS_BATCH_WINDOW_MS", "300")),
+        max_attempts=int(os.environ.get("SMS_MAX_ATTEMPTS", "3")),
+        rates=rates,
+        dispatch=os.environ.get("SMS_DISPATCHER", "1").lower() not in ("0", "false", "off", "no"),
+    )
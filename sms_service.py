@@ -1,4 +1,4 @@
-import requests
+from outbound import FAST2SMS, TWO_FACTOR, http_session, async_http_client, was_not_sent
 
 class SMSService:
     def __init__(self, api_key=None):
@@ -7,25 +7,32 @@ class SMSService:
         self.url = "https://www.fast2sms.com/dev/bulkV2"
         self.factor_url = "https://2factor.in/API/V1/{api_key}/SMS/{number}/{message}"
 
-    def send_sms(self, number, message):
+    def _is_mock(self):
+        return not self.api_key or self.api_key == "YOUR_API_KEY"
+
+    def _is_2factor(self):
+        # 2Factor keys look like a long hash with dashes
+        return "-" in self.api_key and len(self.api_key) > 30
+
+    @property
+    def provider(self):
+        """Which gateway send_sms would use: mock | 2factor | fast2sms."""
+        if self._is_mock():
+            return "mock"
+        return "2factor" if self._is_2factor() else "fast2sms"
+
+    def send_bulk(self, numbers, message):
         """
-        Sends an SMS using Fast2SMS API (Free Tier / Bulk V2).
-        Requires a valid India phone number.
+        Send one message body to several numbers. Fast2SMS takes them comma-separated in a
+        single bulkV2 call; 2Factor has no bulk API, so it gets one call per number.
+        Returns one result dict per number, in order.
         """
-        if not self.api_key or self.api_key == "YOUR_API_KEY":
-            print(f"\n📢 [MOCK SMS] To: {number}\n📝 Message: {message}\n")
-            return {"status": "success", "message": "[MOCK] Sent successfully to terminal"}
-
-        # Try 2Factor if the key looks like a 2Factor key (long hash)
-        if "-" in self.api_key and len(self.api_key) > 30:
-            try:
-                final_url = self.factor_url.format(api_key=self.api_key, number=number, message=message)
-                response = requests.get(final_url)
-                return {"status": "success", "message": "SMS sent via 2Factor"}
-            except Exception as e:
-                return {"status": "error", "message": f"2Factor Error: {str(e)}"}
+        if self.provider == "2factor":
+            return [self.send_sms(number, message) for number in numbers]
+        result = self.send_sms(",".join(numbers), message)
+        return [result] * len(numbers)
 
-        # Default to Fast2SMS
+    def _fast2sms_request(self, number, message):
         payload = {
             "message": message,
             "language": "english",
@@ -37,18 +44,76 @@ class SMSService:
             "authorization": self.api_key,
             "Content-Type": "application/json"
         }
+        return payload, headers
+
+    @staticmethod
+    def _fast2sms_result(response_data):
+        if response_data.get("return"):
+            return {"status": "success", "message": "SMS sent successfully"}
+        else:
+            # The gateway answered and rejected the message: nothing went out
+            return {"status": "error", "message": response_data.get("message", "Unknown error"), "retry": True}
+
+    @staticmethod
+    def _error(message, exc):
+        # retry: the call failed before reaching the gateway, so sending again cannot duplicate the SMS
+        return {"status": "error", "message": message, "retry": was_not_sent(exc)}
+
+    def send_sms(self, number, message):
+        """
+        Sends an SMS using Fast2SMS API (Free Tier / Bulk V2).
+        Requires a valid India phone number.
+        Calls go through a pooled session with timeouts, retries and a circuit breaker (outbound.py).
+        """
+        if self._is_mock():
+            print(f"\n📢 [MOCK SMS] To: {number}\n📝 Message: {message}\n")
+            return {"status": "success", "message": "[MOCK] Sent successfully to terminal"}
 
+        # Try 2Factor if the key looks like a 2Factor key (long hash)
+        if self._is_2factor():
+            try:
+                final_url = self.factor_url.format(api_key=self.api_key, number=number, message=message)
+                TWO_FACTOR.call(lambda: TWO_FACTOR.check(http_session().get(final_url, timeout=TWO_FACTOR.timeout)))
+                return {"status": "success", "message": "SMS sent via 2Factor"}
+            except Exception as e:
+                return self._error(f"2Factor Error: {str(e)}", e)
+
+        # Default to Fast2SMS
+        payload, headers = self._fast2sms_request(number, message)
         try:
-            response = requests.post(self.url, json=payload, headers=headers)
-            response_data = response.json()
-            
-            if response_data.get("return"):
-                return {"status": "success", "message": "SMS sent successfully"}
-            else:
-                return {"status": "error", "message": response_data.get("message", "Unknown error")}
+            response = FAST2SMS.call(lambda: FAST2SMS.check(
+                http_session().post(self.url, json=payload, headers=headers, timeout=FAST2SMS.timeout)))
+            return self._fast2sms_result(response.json())
                 
         except Exception as e:
-            return {"status": "error", "message": str(e)}
+            return self._error(str(e), e)
+
+    async def asend_sms(self, number, message):
+        """asyncio version of send_sms (shared httpx.AsyncClient)."""
+        if self._is_mock():
+            print(f"\n📢 [MOCK SMS] To: {number}\n📝 Message: {message}\n")
+            return {"status": "success", "message": "[MOCK] Sent successfully to terminal"}
+
+        if self._is_2factor():
+            async def send_2factor():
+                final_url = self.factor_url.format(api_key=self.api_key, number=number, message=message)
+                return TWO_FACTOR.check(await async_http_client().get(final_url, timeout=TWO_FACTOR.http_timeout))
+            try:
+                await TWO_FACTOR.acall(send_2factor)
+                return {"status": "success", "message": "SMS sent via 2Factor"}
+            except Exception as e:
+                return self._error(f"2Factor Error: {str(e)}", e)
+
+        payload, headers = self._fast2sms_request(number, message)
+
+        async def send_fast2sms():
+            return FAST2SMS.check(await async_http_client().post(self.url, json=payload, headers=headers,
+                                                                 timeout=FAST2SMS.http_timeout))
+        try:
+            response = await FAST2SMS.acall(send_fast2sms)
+            return self._fast2sms_result(response.json())
+        except Exception as e:
+            return self._error(str(e), e)
 
 # Global instance
 sms_handler = SMSService()
@@ -32,7 +32,7 @@ async function uploadImage(input) {
         // Update UI Visuals
         document.getElementById('resCond').innerText = data.condition;
         document.getElementById('resAcc').innerText = data.accuracy;
-        document.getElementById('heatmapImg').src = data.heatmap + "?v=" + Date.now();
+        document.getElementById('heatmapImg').src = data.heatmap;
         document.getElementById('resultsArea').style.display = 'block';
 
     } catch (error) {
@@ -0,0 +1,110 @@
+from advice_cache import AdviceCache
+from llm_advisor import CaricaCareAdvisor, ERROR_ADVICE, PROMPT_VERSION, advice_failed
+import shutil
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+from types import SimpleNamespace
+
+
+def completion(text):
+    response = MagicMock()
+    response.choices[0].message.content = text
+    return response
+
+
+RESPONSE = "###ENGLISH_SECTION###\nen text\n###TAMIL_SECTION###\nta text\n###HINDI_SECTION###\nhi text"
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+def broken_stream(**kwargs):
+    # The English section completes, then the connection drops
+    yield chunk("###ENGLISH_SECTION###\nen text\n###TAMIL_SECTION###\nta te")
+    raise ConnectionResetError("stream dropped")
+
+
+async def abroken_stream(**kwargs):
+    async def chunks():
+        yield chunk("###ENGLISH_SECTION###\nen text\n###TAMIL_SECTION###\nta te")
+        raise ConnectionResetError("stream dropped")
+    return chunks()
+
+
+class TestAdviceCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def advisor(self, cache):
+        advisor = CaricaCareAdvisor(api_key="test_key", cache=cache)
+        advisor.client = MagicMock()
+        return advisor
+
+    def test_second_call_is_served_from_cache(self):
+        advisor = self.advisor(AdviceCache(cache_dir=self.tmp))
+        advisor.client.chat.completions.create.return_value = completion(RESPONSE)
+
+        self.assertEqual(advisor.get_organic_advice("Curl"), ("en text", "ta text", "hi text"))
+        self.assertEqual(advisor.get_organic_advice("Curl"), ("en text", "ta text", "hi text"))
+        self.assertEqual(advisor.client.chat.completions.create.call_count, 1)
+
+    def test_cache_is_shared_through_disk(self):
+        AdviceCache(cache_dir=self.tmp).put("Curl", "m", "1", ("en", "ta", "hi"))
+        self.assertEqual(AdviceCache(cache_dir=self.tmp).get("Curl", "m", "1"), ("en", "ta", "hi"))
+        self.assertIsNone(AdviceCache(cache_dir=self.tmp).get("Curl", "m", "2"))
+
+    @patch("advice_cache.time.time")
+    def test_expired_entry_is_stale_fallback_on_error(self, mock_time):
+        mock_time.return_value = 1000.0
+        advisor = self.advisor(AdviceCache(cache_dir=self.tmp, ttl=60))
+        advisor.client.chat.completions.create.return_value = completion(RESPONSE)
+        advisor.get_organic_advice("Curl")
+
+        mock_time.return_value = 2000.0
+        advisor.client.chat.completions.create.side_effect = Exception("Connection error")
+        self.assertEqual(advisor.get_organic_advice("Curl"), ("en text", "ta text", "hi text"))
+        self.assertEqual(advisor.cache.stats()["stale_hits"], 1)
+
+    def test_error_without_cached_advice(self):
+        advisor = self.advisor(AdviceCache(cache_dir=self.tmp))
+        advisor.client.chat.completions.create.side_effect = Exception("Connection error")
+        self.assertTrue(advisor.get_organic_advice("Curl")[0].startswith("Error:"))
+
+    def test_stream_failing_partway_is_flagged_and_not_cached(self):
+        advisor = self.advisor(AdviceCache(cache_dir=self.tmp))
+        advisor.client.chat.completions.create = broken_stream
+        sections = dict(advisor.stream_organic_advice("Curl"))
+        self.assertEqual(sections, {"en": "en text", "ta": ERROR_ADVICE[0], "hi": ERROR_ADVICE[1]})
+        self.assertTrue(advice_failed(sections["en"], sections["ta"], sections["hi"]))
+        self.assertIsNone(advisor.cache.get("Curl", advisor.model, PROMPT_VERSION))
+
+        advisor.async_client = MagicMock()
+        advisor.async_client.chat.completions.create = abroken_stream
+        async def collect():
+            return {lang: text async for lang, text in advisor.astream_organic_advice("Curl")}
+        self.assertEqual(asyncio.run(collect()), sections)
+        self.assertFalse(advice_failed("en text", "ta text", "hi text"))
+
+    def test_disk_eviction_keeps_newest_entries(self):
+        cache = AdviceCache(cache_dir=self.tmp, max_entries=2)
+        for disease in ("Curl", "Mosaic", "Ringspot"):
+            cache.put(disease, "m", "1", ("en", "ta", "hi"))
+        self.assertIsNone(AdviceCache(cache_dir=self.tmp).get("Curl", "m", "1"))
+        self.assertIsNotNone(AdviceCache(cache_dir=self.tmp).get("Ringspot", "m", "1"))
+
+    def test_warm_cache_fetches_each_class_once(self):
+        advisor = self.advisor(AdviceCache(cache_dir=self.tmp))
+        advisor.client.chat.completions.create.return_value = completion(RESPONSE)
+        advisor.warm_cache(["Curl", "Mosaic"], background=False)
+        advisor.warm_cache(["Curl", "Mosaic"], background=False)
+        self.assertEqual(advisor.client.chat.completions.create.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# Keep the app from loading weights, calling Groq or starting dispatchers at import
+TMP = tempfile.mkdtemp()
+for name, value in {"MODEL_WARMUP": "0", "ADVICE_WARMUP": "0", "SMS_DISPATCHER": "0", "REMINDER_DISPATCHER": "0",
+                    "GROQ_API_KEY": "", "SMS_QUEUE_DB": os.path.join(TMP, "sms.db"),
+                    "REMINDER_DB": os.path.join(TMP, "reminders.db"), "ADVICE_CACHE_DIR": os.path.join(TMP, "advice"),
+                    "TRANSCRIPT_CACHE_DIR": os.path.join(TMP, "transcripts"),
+                    "HEATMAP_STORE_DIR": os.path.join(TMP, "heatmaps")}.items():
+    os.environ[name] = value
+
+import app
+import asgi_app
+from router import Route
+from starlette.testclient import TestClient
+from prediction_cache import PredictionCache
+
+
+def tearDownModule():
+    shutil.rmtree(TMP)
+
+
+class TestPredictStream(unittest.TestCase):
+    def test_cached_stream_matches_live_stream(self):
+        route = Route("remote", "low_confidence", "Curl", 0.87)
+        advice = [("en", "english"), ("ta", "tamil"), ("hi", "hindi")]
+        with mock.patch.object(app, "CACHE", PredictionCache()), \
+                mock.patch.object(app.ROUTER, "route", return_value=route), \
+                mock.patch.object(app.ADVISOR, "stream_organic_advice", return_value=iter(advice)):
+            miss = list(app.diagnose(b"leaf", "none", ("identity",), "k", stream_advice=True))
+            hit = list(app.replay(app.cached_prediction("k", "none")))
+        self.assertEqual(miss, hit)
+        self.assertEqual(hit[0], ("diagnosis", {"condition": "Curl", "accuracy": "87.0%", "engine": "remote"}))
+
+
+class TestJsonEndpoints(unittest.TestCase):
+    def test_flask_and_asgi_answer_bad_bodies_alike(self):
+        flask_client, asgi_client = app.app.test_client(), TestClient(asgi_app.app)
+        for path in ("/send-sms", "/schedule-reminder"):
+            for body in (b"{not json", b"", b"[1, 2]"):
+                headers = {"Content-Type": "application/json"}
+                flask = flask_client.post(path, data=body, headers=headers)
+                asgi = asgi_client.post(path, content=body, headers=headers)
+                self.assertEqual(flask.status_code, 400, (path, body))
+                self.assertEqual((flask.status_code, flask.get_json()), (asgi.status_code, asgi.json()), (path, body))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+from artifact_store import ArtifactStore
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+
+
+class TestArtifactStore(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def image(self, value):
+        return np.full((32, 32, 3), value, dtype=np.uint8)
+
+    def test_urls_are_content_addressed(self):
+        store = ArtifactStore(root="heatmaps")
+        a = store.put_image(self.image(10))
+        b = store.put_image(self.image(200))
+        self.assertNotEqual(a, b)
+        self.assertEqual(a, store.put_image(self.image(10)))
+        self.assertTrue(a.startswith("/heatmaps/") and a.endswith(".jpg"))
+        self.assertTrue(store.exists(a))
+
+    def test_formats(self):
+        for fmt, ext in (("png", ".png"), ("jpeg", ".jpg"), ("webp", ".webp")):
+            self.assertTrue(ArtifactStore(root="heatmaps", fmt=fmt).put_image(self.image(1)).endswith(ext))
+        with self.assertRaises(ValueError):
+            ArtifactStore(root="heatmaps", fmt="gif")
+
+    def test_size_eviction_drops_oldest_first(self):
+        store = ArtifactStore(root="heatmaps", fmt="png", max_bytes=1, evict_every=1000)
+        old = store.put_image(self.image(1))
+        os.utime(store.path_for(old), (time.time() - 60, time.time() - 60))
+        new = store.put_image(self.image(2))
+        store.max_bytes = os.path.getsize(store.path_for(new))
+        store.evict()
+        self.assertFalse(store.exists(old))
+        self.assertTrue(store.exists(new))
+
+    def test_age_eviction_leaves_foreign_files_alone(self):
+        store = ArtifactStore(root="heatmaps", max_age=10, evict_every=1000)
+        url = store.put_image(self.image(1))
+        foreign = os.path.join("heatmaps", "heat_sample.jpg")
+        with open(foreign, "wb") as f:
+            f.write(b"x")
+        past = time.time() - 100
+        os.utime(store.path_for(url), (past, past))
+        os.utime(foreign, (past, past))
+        self.assertEqual(store.evict(), 1)
+        self.assertFalse(store.exists(url))
+        self.assertTrue(os.path.exists(foreign))
+
+
+if __name__ == '__main__':
+    unittest.main()
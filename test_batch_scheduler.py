@@ -0,0 +1,57 @@
+from batch_scheduler import InferenceScheduler
+import threading
+import unittest
+import torch
+
+
+class TestInferenceScheduler(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(3 * 4 * 4, 8)).eval()
+
+    def expected(self, batch):
+        with torch.no_grad():
+            return torch.nn.functional.softmax(self.model(batch), dim=1)
+
+    def test_single_request_matches_direct_forward(self):
+        scheduler = InferenceScheduler(self.model, max_batch_size=8, max_wait_ms=1)
+        batch = torch.randn(4, 3, 4, 4)
+        probs = scheduler.infer(batch, timeout=5)
+        self.assertEqual(tuple(probs.shape), (4, 8))
+        self.assertTrue(torch.allclose(probs, self.expected(batch), atol=1e-6))
+
+    def test_concurrent_requests_get_their_own_rows(self):
+        scheduler = InferenceScheduler(self.model, max_batch_size=64, max_wait_ms=50)
+        batches = [torch.randn(k, 3, 4, 4) for k in (1, 2, 3, 4, 4)]
+        results = [None] * len(batches)
+
+        def run(i):
+            results[i] = scheduler.infer(batches[i], timeout=5)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(batches))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for batch, probs in zip(batches, results):
+            self.assertTrue(torch.allclose(probs, self.expected(batch), atol=1e-5))
+        stats = scheduler.stats()
+        self.assertEqual(stats["requests_total"], len(batches))
+        self.assertEqual(stats["rows_total"], 14)
+        self.assertLess(stats["batches_total"], len(batches))
+
+    def test_oversized_request_is_not_split(self):
+        scheduler = InferenceScheduler(self.model, max_batch_size=2, max_wait_ms=1)
+        probs = scheduler.infer(torch.randn(5, 3, 4, 4), timeout=5)
+        self.assertEqual(probs.shape[0], 5)
+
+    def test_errors_propagate_to_caller(self):
+        scheduler = InferenceScheduler(self.model, max_batch_size=8, max_wait_ms=1)
+        with self.assertRaises(RuntimeError):
+            scheduler.infer(torch.randn(1, 5), timeout=5)
+        self.assertEqual(scheduler.stats()["errors_total"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
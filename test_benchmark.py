@@ -0,0 +1,55 @@
+from benchmark import compare, summarize, bench_predict
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+
+def report(**p50s):
+    return {"results": [{"stage": stage, "backend": "eager", "threads": 1, "image_size": None,
+                         "batch_size": 1, "p50_ms": value} for stage, value in p50s.items()]}
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_summarize_percentiles_and_throughput(self):
+        stats = summarize([0.010] * 99 + [0.110], items=4)
+        self.assertEqual(stats["n"], 100)
+        self.assertAlmostEqual(stats["p50_ms"], 10.0)
+        self.assertAlmostEqual(stats["mean_ms"], 11.0)
+        self.assertAlmostEqual(stats["throughput_per_s"], 4000.0 / 11.0, places=2)
+        self.assertGreater(stats["p99_ms"], stats["p95_ms"])
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        rows, regressions = compare(report(forward=112.0, tta=104.0, gradcam=50.0),
+                                    report(forward=100.0, tta=100.0), tolerance=0.10)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual([r["stage"] for r in regressions], ["forward"])
+
+    def test_predict_bench_imports_the_app_without_background_work(self):
+        seen = {}
+
+        class Client:
+            def post(self, *args, **kwargs):
+                return mock.Mock(status_code=200)
+
+        class App(types.ModuleType):
+            def __getattr__(self, name):
+                # Whatever the app reads from the environment at import time
+                seen.update({key: os.environ.get(key) for key in
+                             ("ADVICE_WARMUP", "SMS_DISPATCHER", "REMINDER_DISPATCHER", "ROUTER_MODE")})
+                if name == "app":
+                    return mock.Mock(test_client=Client)
+                return mock.Mock()
+
+        results = []
+        with mock.patch.dict(os.environ, {"GROQ_API_KEY": "live-key"}), \
+                mock.patch.dict(sys.modules, {"app": App("app")}):
+            bench_predict(results, [(64, 48)], "eager", 1, 0, 2, 0)
+        self.assertEqual(seen, {"ADVICE_WARMUP": "0", "SMS_DISPATCHER": "0",
+                                "REMINDER_DISPATCHER": "0", "ROUTER_MODE": "local"})
+        self.assertEqual(results[0]["stage"], "predict")
+
+
+if __name__ == '__main__':
+    unittest.main()
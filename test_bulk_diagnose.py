@@ -0,0 +1,162 @@
+from bulk_diagnose import ResultWriter, list_images, read_done, output_format
+import bulk_diagnose
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import cv2
+import numpy as np
+import torch
+
+LABELS = ["Healthy", "Curl"]
+
+
+class TestBulkDiagnose(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def row(self, path):
+        return {"path": path, "label": "Healthy", "confidence": 0.9, "prob_Healthy": 0.9,
+                "prob_Curl": 0.1, "heatmap": "", "error": ""}
+
+    def test_list_images_directory_and_manifest(self):
+        os.makedirs(os.path.join(self.tmp, "sub"))
+        for name in ("a.jpg", "sub/b.PNG", "notes.txt"):
+            open(os.path.join(self.tmp, name), "w").close()
+        found = list_images(self.tmp)
+        self.assertEqual([os.path.basename(p) for p in found], ["a.jpg", "b.PNG"])
+        manifest = os.path.join(self.tmp, "m.txt")
+        with open(manifest, "w") as f:
+            f.write("# season 1\nx.jpg\n\ny.jpg\n")
+        self.assertEqual(list_images(manifest), ["x.jpg", "y.jpg"])
+
+    def test_resume_csv(self):
+        out = os.path.join(self.tmp, "out.csv")
+        writer = ResultWriter(out, "csv", LABELS)
+        writer.write([self.row("a.jpg"), self.row("b.jpg")])
+        writer.close()
+        writer = ResultWriter(out, "csv", LABELS)
+        writer.write([self.row("c.jpg")])
+        writer.close()
+        self.assertEqual(read_done(out, "csv"), {"a.jpg", "b.jpg", "c.jpg"})
+        with open(out) as f:
+            self.assertEqual(sum(line.startswith("path,") for line in f), 1)
+
+    def test_resume_jsonl_ignores_torn_line(self):
+        out = os.path.join(self.tmp, "out.jsonl")
+        writer = ResultWriter(out, "jsonl", LABELS)
+        writer.write([self.row("a.jpg")])
+        writer.close()
+        with open(out, "a") as f:
+            f.write('{"path": "b.j')
+        self.assertEqual(read_done(out, "jsonl"), {"a.jpg"})
+        writer = ResultWriter(out, "jsonl", LABELS)
+        writer.write([self.row("c.jpg")])
+        writer.close()
+        self.assertEqual(read_done(out, "jsonl"), {"a.jpg", "c.jpg"})
+
+    def test_resume_csv_drops_torn_row(self):
+        out = os.path.join(self.tmp, "out.csv")
+        writer = ResultWriter(out, "csv", LABELS)
+        writer.write([self.row("a.jpg")])
+        writer.close()
+        with open(out, "a") as f:
+            f.write("b.jpg,Healthy,0.9")
+        self.assertEqual(read_done(out, "csv"), {"a.jpg"})
+        writer = ResultWriter(out, "csv", LABELS)
+        writer.write([self.row("c.jpg")])
+        writer.close()
+        with open(out, newline="") as f:
+            self.assertEqual([row["path"] for row in csv.DictReader(f)], ["a.jpg", "c.jpg"])
+
+    def test_error_rows_are_retried(self):
+        out = os.path.join(self.tmp, "out.csv")
+        failed = dict(self.row("b.jpg"), label="", confidence="", error="Could not read image")
+        writer = ResultWriter(out, "csv", LABELS)
+        writer.write([self.row("a.jpg"), failed])
+        writer.close()
+        self.assertEqual(read_done(out, "csv"), {"a.jpg"})
+        writer = ResultWriter(out, "csv", LABELS)
+        writer.write([self.row("b.jpg")])
+        writer.close()
+        with open(out, newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([(row["path"], row["error"]) for row in rows], [("a.jpg", ""), ("b.jpg", "")])
+
+    def test_output_format(self):
+        self.assertEqual(output_format("x.parquet"), "parquet")
+        with self.assertRaises(ValueError):
+            output_format("x.xlsx")
+
+
+class TestBulkRun(unittest.TestCase):
+    """End to end: an untrained ConvNeXt checkpoint, a few images and one unreadable file."""
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        import timm
+        torch.manual_seed(0)
+        cls.weights = os.path.join(cls.tmp, "model.pth")
+        torch.save(timm.create_model("convnext_tiny", pretrained=False, num_classes=len(bulk_diagnose.CLASSES)).state_dict(),
+                   cls.weights)
+        cls.images = os.path.join(cls.tmp, "images")
+        os.makedirs(cls.images)
+        rng = np.random.default_rng(0)
+        for i in range(5):
+            cv2.imwrite(os.path.join(cls.images, f"leaf{i}.png"), rng.integers(0, 255, (120, 160, 3), dtype=np.uint8))
+        with open(os.path.join(cls.images, "broken.jpg"), "wb") as f:
+            f.write(b"not an image")
+        cls.threads = torch.get_num_threads()
+
+    @classmethod
+    def tearDownClass(cls):
+        torch.set_num_threads(cls.threads)
+        shutil.rmtree(cls.tmp)
+
+    def options(self, heatmap_dir=None):
+        return {"weights": self.weights, "labels": bulk_diagnose.CLASSES, "threads": self.threads, "pin": False,
+                "decode_threads": 2, "batch_size": 2, "enhance": False, "heatmap_dir": heatmap_dir}
+
+    def test_run_task_scores_batches_and_reports_decode_errors(self):
+        heatmaps = os.path.join(self.tmp, "heatmaps")
+        bulk_diagnose.init_worker(self.options(heatmaps), multiprocessing.Value("i", 0))
+        paths = list_images(self.images)
+        rows = bulk_diagnose.run_task(paths)
+        # prefetch keeps the input order; the failed decode does not break its batch
+        self.assertEqual([row["path"] for row in rows if not row["error"]], [p for p in paths if "broken" not in p])
+        [failed] = [row for row in rows if row["error"]]
+        self.assertTrue(failed["path"].endswith("broken.jpg"))
+        analyzer = bulk_diagnose._analyzer
+        good = [p for p in paths if "broken" not in p]
+        probs = analyzer.predict_batch([analyzer.load(p)[1] for p in good])
+        for row, p in zip([row for row in rows if not row["error"]], probs.tolist()):
+            self.assertAlmostEqual(sum(row[f"prob_{label}"] for label in bulk_diagnose.CLASSES), 1.0, places=4)
+            self.assertAlmostEqual(row["confidence"], max(p), places=4)
+            self.assertTrue(os.path.exists(os.path.join(heatmaps, row["heatmap"])))
+
+    def test_main_resumes_and_retries_failed_images(self):
+        out = os.path.join(self.tmp, "results.csv")
+        args = [self.images, "--out", out, "--weights", self.weights, "--workers", "1", "--no-pin",
+                "--threads", str(self.threads), "--batch-size", "2"]
+        self.assertEqual(bulk_diagnose.main(args), 0)
+        self.assertEqual(len(read_done(out, "csv")), 5)
+        broken = os.path.join(self.images, "broken.jpg")
+        try:
+            cv2.imwrite(broken, np.zeros((64, 64, 3), dtype=np.uint8))
+            self.assertEqual(bulk_diagnose.main(args), 0)
+        finally:
+            with open(broken, "wb") as f:
+                f.write(b"not an image")
+        with open(out, newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 6)
+        self.assertFalse([row for row in rows if row["error"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
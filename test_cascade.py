@@ -0,0 +1,61 @@
+from cascade import Cascade, CascadeStage, Ensemble, margin
+import unittest
+import torch
+
+
+class FixedEngine:
+    def __init__(self, probs):
+        self.prob = torch.tensor(probs)
+        self.calls = []
+
+    def predict_many(self, images, augmentations=None):
+        self.calls.append(augmentations)
+        return torch.stack([self.prob] * len(images))
+
+
+class TestCascade(unittest.TestCase):
+    def test_margin(self):
+        self.assertAlmostEqual(margin(torch.tensor([0.1, 0.7, 0.2])), 0.5, places=5)
+
+    def test_confident_fast_stage_exits_early(self):
+        fast, full = FixedEngine([0.9, 0.05, 0.05]), FixedEngine([0.2, 0.8, 0.0])
+        cascade = Cascade([CascadeStage("fast", fast, 0.5, ("identity",)), CascadeStage("tta", full)])
+        prob, idx, cam, stage = cascade.predict("img", ("identity", "hflip"))
+        self.assertEqual((idx, cam, stage), (0, None, "fast"))
+        self.assertEqual(fast.calls, [("identity",)])
+        self.assertEqual(full.calls, [])
+
+    def test_low_margin_is_escalated(self):
+        fast, full = FixedEngine([0.5, 0.4, 0.1]), FixedEngine([0.2, 0.8, 0.0])
+        cascade = Cascade([CascadeStage("fast", fast, 0.5, ("identity",)), CascadeStage("tta", full)])
+        _, idx, _, stage = cascade.predict("img", ("identity", "hflip"))
+        self.assertEqual((idx, stage), (1, "tta"))
+        self.assertEqual(full.calls, [("identity", "hflip")])
+        stats = {s["name"]: s for s in cascade.stats()["stages"]}
+        self.assertEqual((stats["fast"]["entered"], stats["fast"]["exited"]), (1, 0))
+        self.assertEqual(stats["tta"]["hit_rate"], 1.0)
+
+    def test_ensemble_reuses_the_tta_result(self):
+        main, other = FixedEngine([0.5, 0.5]), FixedEngine([0.0, 1.0])
+        ensemble = Ensemble([main, other], weights=[3, 1])
+        cascade = Cascade([CascadeStage("tta", main, 0.3), CascadeStage("ensemble", ensemble)])
+        prob, idx, _, stage = cascade.predict("img")
+        self.assertEqual((idx, stage), (1, "ensemble"))
+        self.assertTrue(torch.allclose(prob, torch.tensor([0.375, 0.625])))
+        self.assertEqual(len(main.calls), 1)
+
+    def test_batch_only_escalates_undecided_images(self):
+        class Margins(FixedEngine):
+            def predict_many(self, images, augmentations=None):
+                self.calls.append(list(images))
+                return torch.stack([torch.tensor([0.9, 0.1]) if image == "clear" else torch.tensor([0.5, 0.5])
+                                    for image in images])
+        fast, full = Margins([0.0, 0.0]), FixedEngine([0.1, 0.9])
+        cascade = Cascade([CascadeStage("fast", fast, 0.5), CascadeStage("tta", full)])
+        results = cascade.predict_many(["clear", "blurry", "clear"])
+        self.assertEqual([stage for _, _, _, stage in results], ["fast", "tta", "fast"])
+        self.assertEqual(len(full.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+from heatmap import GradCAM, HeatmapService
+from artifact_store import ArtifactStore
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+import torch
+
+
+class TinyNet(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.features = torch.nn.Conv2d(3, 4, 3, padding=1)
+        self.head = torch.nn.Linear(4, 3)
+
+    def forward(self, x):
+        return self.head(self.features(x).mean(dim=(2, 3)))
+
+
+class FakeCAM:
+    def __init__(self, error=None):
+        self.error = error
+        self.release = threading.Event()
+
+    def generate(self, tensor, idx):
+        self.release.wait(2)
+        if self.error:
+            raise self.error
+        return np.ones((7, 7), dtype=np.float32)
+
+
+class TestGradCAM(unittest.TestCase):
+    def test_hook_is_removed_after_generate(self):
+        model = TinyNet()
+        cam = GradCAM(model, model.features)
+        result = cam.generate(torch.randn(1, 3, 8, 8), 1)
+        self.assertEqual(result.shape, (8, 8))
+        self.assertEqual(len(model.features._forward_hooks), 0)
+        self.assertEqual(len(cam.generate_many(torch.randn(2, 3, 8, 8), [0, 2])), 2)
+        self.assertEqual(len(model.features._forward_hooks), 0)
+
+    def test_capture_ignores_no_grad_forwards(self):
+        model = TinyNet()
+        cam = GradCAM(model, model.features)
+        with cam.capture() as captured:
+            with torch.no_grad():
+                model(torch.randn(1, 3, 8, 8))
+        self.assertIsNone(captured.activations)
+
+
+class TestAsyncHeatmaps(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = ArtifactStore(os.path.join(self.tmp, "heatmaps"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def wait_for(self, service, job_id):
+        for _ in range(200):
+            status = service.status(job_id)
+            if status["status"] != "pending":
+                return status
+            time.sleep(0.01)
+        self.fail("heatmap job did not finish")
+
+    def test_job_status_is_visible_to_other_workers(self):
+        cam = FakeCAM()
+        worker = HeatmapService(None, None, self.store, cam=cam)
+        # Another Gunicorn worker: same store directory, its own (empty) job table
+        other = HeatmapService(None, None, ArtifactStore(self.store.root), cam=FakeCAM())
+        job_id = worker.submit(np.zeros((32, 32, 3), dtype=np.uint8), None, 0)
+        self.assertEqual(other.status(job_id), {"status": "pending"})
+        cam.release.set()
+        ready = self.wait_for(worker, job_id)
+        self.assertEqual(ready["status"], "ready")
+        self.assertTrue(os.path.exists(os.path.join(self.store.root, os.path.basename(ready["heatmap"]))))
+        self.assertEqual(other.status(job_id), ready)
+
+    def test_failed_job_and_unknown_ids(self):
+        cam = FakeCAM(error=RuntimeError("boom"))
+        cam.release.set()
+        worker = HeatmapService(None, None, self.store, cam=cam)
+        job_id = worker.submit(np.zeros((32, 32, 3), dtype=np.uint8), None, 0)
+        self.assertEqual(self.wait_for(worker, job_id), {"status": "error", "message": "boom"})
+        self.assertEqual(self.store.get_job(job_id)["status"], "error")
+        self.assertIsNone(worker.status("0" * 32))
+        self.assertIsNone(worker.status("../../etc/passwd"))
+
+
+if __name__ == "__main__":
+    unittest.main()
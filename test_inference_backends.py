@@ -0,0 +1,102 @@
+from inference_backends import EagerBackend, load_backend, backend_from_env
+from export_model import (export_torchscript, export_int8_dynamic, export_onnx, parity,
+                          split_paths, calibration_batches)
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import cv2
+import numpy as np
+import torch
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+class TinyNet(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv2d(3, 8, 7, stride=8)
+        self.mlp = torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.GELU(), torch.nn.Linear(16, 8))
+
+    def forward(self, x):
+        return self.mlp(self.conv(x).mean(dim=(2, 3)))
+
+
+class TestLoadBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.model = TinyNet().eval()
+        self.batches = [torch.randn(4, 3, 224, 224) for _ in range(2)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_eager_and_errors(self):
+        backend = load_backend("EAGER", self.model)
+        self.assertIsInstance(backend, EagerBackend)
+        self.assertTrue(backend.supports_grad)
+        with self.assertRaises(ValueError):
+            load_backend("tensorrt", self.model)
+        with self.assertRaises(FileNotFoundError):
+            load_backend("torchscript", path=os.path.join(self.tmp, "missing.ts"))
+
+    def test_backend_from_env_falls_back_to_eager(self):
+        env = {"INFERENCE_BACKEND": "torchscript", "INFERENCE_BACKEND_PATH": os.path.join(self.tmp, "missing.ts")}
+        with mock.patch.dict(os.environ, env):
+            self.assertEqual(backend_from_env(self.model).name, "eager")
+
+    def test_torchscript_matches_eager(self):
+        path = os.path.join(self.tmp, "tiny.ts")
+        export_torchscript(self.model, path)
+        backend = load_backend("torchscript", path=path)
+        self.assertFalse(backend.supports_grad)
+        report = parity(self.model, backend, self.batches)
+        self.assertEqual(report["agreement"], 1.0)
+        self.assertLess(report["max_prob_diff"], 1e-5)
+
+    def test_int8_dynamic_stays_close_to_eager(self):
+        path = os.path.join(self.tmp, "tiny_int8.ts")
+        export_int8_dynamic(self.model, path)
+        report = parity(self.model, load_backend("int8-dynamic", path=path), self.batches)
+        self.assertEqual(report["samples"], 8)
+        self.assertLess(report["max_prob_diff"], 0.05)
+
+    @unittest.skipIf(onnxruntime is None, "onnxruntime not installed")
+    def test_onnx_matches_eager(self):
+        path = os.path.join(self.tmp, "tiny.onnx")
+        export_onnx(self.model, path)
+        report = parity(self.model, load_backend("onnx", path=path, threads=1), self.batches)
+        self.assertEqual(report["agreement"], 1.0)
+        self.assertLess(report["max_prob_diff"], 1e-4)
+
+
+class TestParitySet(unittest.TestCase):
+    def test_holdout_is_disjoint_from_calibration(self):
+        paths = [f"img{i}.jpg" for i in range(10)]
+        calibration, holdout = split_paths(paths, 0.25)
+        self.assertEqual(holdout, ["img3.jpg", "img7.jpg"])
+        self.assertFalse(set(calibration) & set(holdout))
+        self.assertEqual(split_paths(paths, 0), (paths, []))
+
+    def test_calibration_batches_use_separate_images(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            for i in range(8):
+                cv2.imwrite(os.path.join(tmp, f"leaf{i}.png"), np.full((64, 96, 3), i * 30, dtype=np.uint8))
+            calibration, check = calibration_batches(tmp, 64, batch_size=4, holdout_fraction=0.25)
+            self.assertEqual(sum(b.shape[0] for b in calibration), 6)
+            self.assertEqual(sum(b.shape[0] for b in check), 2)
+            # No images at all: two different random sets
+            calibration, check = calibration_batches(os.path.join(tmp, "empty"), 8, batch_size=4)
+            self.assertFalse(torch.equal(calibration[0], check[0]))
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    unittest.main()
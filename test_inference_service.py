@@ -0,0 +1,71 @@
+from inference_service import InferenceService, CLASSES
+from artifact_store import ArtifactStore
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+
+
+class TestInferenceService(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        # No checkpoint: an untrained ConvNeXt is enough to check the plumbing
+        torch.manual_seed(0)
+        cls.service = InferenceService(os.path.join(cls.tmp, "missing.pth"), CLASSES, backend="eager",
+                                       batching=False, cascade=False,
+                                       store=ArtifactStore(os.path.join(cls.tmp, "heatmaps")), warmup=False)
+        rng = np.random.default_rng(0)
+        cls.images = [rng.integers(0, 255, (300, 260, 3), dtype=np.uint8) for _ in range(3)]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def test_batch_matches_single_image_predictions(self):
+        options = {"tta": "identity,hflip"}
+        batch = self.service.predict(self.images, options)
+        self.assertEqual(len(batch), 3)
+        for image, prediction in zip(self.images, batch):
+            [single] = self.service.predict([image], options)
+            self.assertTrue(torch.allclose(single.prob, prediction.prob, atol=1e-5))
+            self.assertEqual(prediction.label, CLASSES[prediction.index])
+            self.assertEqual(prediction.stage, "tta")
+
+    def test_sync_heatmap_reuses_the_classification_forward(self):
+        [prediction] = self.service.predict(self.images[:1], {"tta": "none", "heatmap": "sync"})
+        self.assertIsNotNone(prediction.cam)
+        self.assertTrue(prediction.heatmap_url.endswith(".jpg"))
+        result = prediction.to_dict()
+        self.assertAlmostEqual(sum(result["probabilities"].values()), 1.0, places=4)
+
+    def test_accepts_encoded_bytes(self):
+        import cv2
+        data = cv2.imencode(".png", self.images[0])[1].tobytes()
+        [from_bytes] = self.service.predict([data], {"tta": "none"})
+        [from_array] = self.service.predict([self.images[0]], {"tta": "none"})
+        self.assertEqual(from_bytes.index, from_array.index)
+
+    def test_default_config_predict_goes_through_the_scheduler(self):
+        # Batching on + sync heatmap (the web app's defaults): the CAM must not bypass the scheduler
+        service = InferenceService(os.path.join(self.tmp, "missing.pth"), CLASSES, backend="eager",
+                                   cascade=False, store=self.service.heatmaps.store, warmup=False)
+        self.assertIsNotNone(service.scheduler)
+        [prediction] = service.predict(self.images[:1], {"tta": "identity,hflip", "heatmap": "sync"})
+        # hflip went through the scheduler, the identity view gave the CAM (no second Grad-CAM forward)
+        self.assertEqual(service.scheduler.stats()["requests_total"], 1)
+        self.assertIsNotNone(prediction.cam)
+        self.assertTrue(prediction.heatmap_url.endswith(".jpg"))
+        [plain] = service.predict(self.images[:1], {"tta": "identity,hflip"})
+        self.assertTrue(torch.allclose(plain.prob, prediction.prob, atol=1e-5))
+
+    def test_leaf_analyzer_refuses_to_run_without_weights(self):
+        from model_engine import LeafAnalyzer
+        with self.assertRaises(FileNotFoundError):
+            LeafAnalyzer(os.path.join(self.tmp, "missing.pth"), CLASSES, store=self.service.heatmaps.store)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+from metrics import Counter, Histogram, Registry, STAGE_ERRORS, STAGE_SECONDS, start_trace, timed
+import unittest
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = Registry()
+        hist = Histogram("demo_seconds", "Demo", ("stage",), buckets=(0.1, 1.0), registry=registry)
+        for value in (0.05, 0.5, 0.5, 3.0):
+            hist.observe(value, stage="decode")
+        text = registry.render()
+        self.assertIn('# TYPE demo_seconds histogram', text)
+        self.assertIn('demo_seconds_bucket{stage="decode",le="0.1"} 1', text)
+        self.assertIn('demo_seconds_bucket{stage="decode",le="1"} 3', text)
+        self.assertIn('demo_seconds_bucket{stage="decode",le="+Inf"} 4', text)
+        self.assertIn('demo_seconds_count{stage="decode"} 4', text)
+
+    def test_counter_labels_are_escaped_and_checked(self):
+        registry = Registry()
+        counter = Counter("demo_total", "Demo", ("condition",), registry=registry)
+        counter.inc(condition='Bacterial "spot"')
+        self.assertIn('demo_total{condition="Bacterial \\"spot\\""} 1', registry.render())
+        with self.assertRaises(ValueError):
+            counter.inc(stage="x")
+
+    def test_timed_records_errors_and_trace_spans(self):
+        trace = start_trace("t1")
+        before = STAGE_ERRORS.value(stage="unit-test")
+        with timed("unit-test"):
+            pass
+        with self.assertRaises(RuntimeError):
+            with timed("unit-test"):
+                raise RuntimeError("boom")
+        self.assertEqual(STAGE_ERRORS.value(stage="unit-test"), before + 1)
+        self.assertEqual(STAGE_SECONDS.count(stage="unit-test"), 2)
+        self.assertEqual([stage for stage, _ in trace.spans], ["unit-test", "unit-test"])
+        self.assertTrue(trace.server_timing().startswith("unit-test;dur="))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+from model_loader import LazyResource
+import os
+import time
+import unittest
+
+
+class TestLazyResource(unittest.TestCase):
+    def test_builds_once_and_reports_ready(self):
+        calls = []
+        resource = LazyResource(lambda: calls.append(1) or "model", "test")
+        self.assertFalse(resource.ready)
+        self.assertEqual(resource.get(), "model")
+        self.assertEqual(resource.get(), "model")
+        self.assertEqual(len(calls), 1)
+        status = resource.status()
+        self.assertTrue(status["ready"])
+        self.assertIsNone(status["error"])
+
+    def test_error_is_reported_and_next_get_retries(self):
+        attempts = []
+
+        def factory():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise OSError("weights not there yet")
+            return "model"
+        resource = LazyResource(factory, "test")
+        resource.warm(background=False)
+        self.assertFalse(resource.ready)
+        self.assertEqual(resource.status()["error"], "weights not there yet")
+        self.assertEqual(resource.get(), "model")
+        self.assertIsNone(resource.status()["error"])
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs fork")
+    def test_fork_while_loading_does_not_deadlock_the_child(self):
+        resource = LazyResource(lambda: "model", "test")
+        resource._warm_requested = True
+        # The parent's warmup thread holds the lock at the moment of the fork
+        resource._lock.acquire()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                deadline = time.time() + 5
+                while not resource.ready and time.time() < deadline:
+                    time.sleep(0.01)
+                os._exit(0 if resource.ready and resource.get() == "model" else 1)
+            except BaseException:
+                os._exit(2)
+        resource._lock.release()
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+                return
+            time.sleep(0.05)
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+        self.fail("child deadlocked on the inherited lock")
+
+
+if __name__ == '__main__':
+    unittest.main()
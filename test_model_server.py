@@ -0,0 +1,98 @@
+from model_server import ModelServerClient, check_socket_dir, key_path
+from inference_service import InferenceService, CLASSES
+from artifact_store import ArtifactStore
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+from multiprocessing import AuthenticationError
+import numpy as np
+import timm
+import torch
+
+
+class TestModelServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        # An untrained ConvNeXt saved as a checkpoint, so both sides load identical weights
+        torch.manual_seed(0)
+        weights = os.path.join(cls.tmp, "model.pth")
+        torch.save(timm.create_model("convnext_tiny", pretrained=False, num_classes=len(CLASSES)).state_dict(), weights)
+        address = os.path.join(cls.tmp, "model.sock")
+        cls.server = subprocess.Popen([sys.executable, "model_server.py", "--address", address,
+                                       "--weights", weights, "--backend", "eager"],
+                                      env=dict(os.environ, BATCH_MAX_WAIT_MS="1"))
+        cls.client = ModelServerClient(address, max_rows=2, channels=2, connect_timeout=60)
+        store = ArtifactStore(os.path.join(cls.tmp, "heatmaps"))
+        options = dict(backend="eager", batching=False, cascade=False, store=store, warmup=False)
+        cls.local = InferenceService(weights, CLASSES, server=False, **options)
+        cls.remote = InferenceService(weights, CLASSES, server=cls.client, **options)
+        rng = np.random.default_rng(0)
+        cls.images = [rng.integers(0, 255, (300, 260, 3), dtype=np.uint8) for _ in range(3)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+        shutil.rmtree(cls.tmp)
+
+    def test_remote_predictions_match_in_process_model(self):
+        # Three rows with max_rows=2 also exercises chunking over the shared-memory buffer
+        options = {"tta": "identity,hflip"}
+        for local, remote in zip(self.local.predict(self.images, options), self.remote.predict(self.images, options)):
+            self.assertTrue(torch.allclose(local.prob, remote.prob, atol=1e-4))
+            self.assertEqual(local.label, remote.label)
+        self.assertIsNone(self.remote.model)
+        self.assertTrue(self.remote.version.endswith(":server"))
+
+    def test_remote_gradcam_matches_in_process_gradcam(self):
+        batch = torch.randn(3, 3, 224, 224)
+        local = self.local.heatmaps.cam.generate_many(batch, [0, 1, 2])
+        remote = self.client.cams(batch, [0, 1, 2])
+        for a, b in zip(local, remote):
+            self.assertEqual(b.shape, (7, 7))
+            self.assertTrue(np.allclose(a, b, atol=1e-4))
+        [prediction] = self.remote.predict(self.images[:1], {"tta": "none", "heatmap": "sync"})
+        self.assertTrue(prediction.heatmap_url.endswith(".jpg"))
+
+    def test_server_errors_are_raised_in_the_client(self):
+        with self.assertRaises(RuntimeError):
+            self.client.cams(torch.zeros(1, 3, 224, 224), [len(CLASSES)])
+        self.assertEqual(len(self.client(torch.zeros(1, 3, 224, 224))[0]), len(CLASSES))
+        self.assertGreaterEqual(self.client.stats()["errors"], 1)
+
+    def test_server_generates_a_private_authkey(self):
+        path = key_path(self.client.address)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        wrong = ModelServerClient(self.client.address, connect_timeout=1, authkey=b"guess")
+        with self.assertRaises(AuthenticationError):
+            wrong.info()
+
+
+class TestSocketDirectory(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_shared_directories_are_refused(self):
+        shared = os.path.join(self.tmp, "shared")
+        os.makedirs(shared)
+        os.chmod(shared, 0o1777)
+        with self.assertRaises(PermissionError):
+            check_socket_dir(os.path.join(shared, "model.sock"))
+        client = ModelServerClient(os.path.join(shared, "model.sock"), connect_timeout=1)
+        with self.assertRaises(PermissionError):
+            client.info()
+
+    def test_missing_directory_is_created_private(self):
+        directory = check_socket_dir(os.path.join(self.tmp, "run", "model.sock"), create=True)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+
+if __name__ == "__main__":
+    unittest.main()
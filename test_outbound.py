@@ -0,0 +1,154 @@
+from outbound import (CircuitOpenError, Provider, ProviderBusyError, UpstreamError,
+                      is_safe_to_retry, is_transient, groq_client, GROQ_CHAT, GROQ_WHISPER, GROQ_VISION)
+import asyncio
+import threading
+import unittest
+
+
+class ConnectTimeout(Exception):
+    pass
+
+
+class ReadTimeout(Exception):
+    pass
+
+
+class TestOutbound(unittest.TestCase):
+    def provider(self, **kwargs):
+        options = dict(retries=2, backoff=0.0, failures=3, cooldown=60, queue_timeout=0.05)
+        options.update(kwargs)
+        return Provider("test", **options)
+
+    def test_retries_transient_errors_then_succeeds(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise UpstreamError("test", 503)
+            return "ok"
+        provider = self.provider()
+        self.assertEqual(provider.call(flaky), "ok")
+        self.assertEqual(provider.stats()["retries"], 2)
+        self.assertEqual(provider.breaker.state, "closed")
+
+    def test_client_errors_are_not_retried(self):
+        provider = self.provider()
+        with self.assertRaises(ValueError):
+            provider.call(lambda: (_ for _ in ()).throw(ValueError("bad request")))
+        self.assertEqual(provider.stats()["calls"], 1)
+
+    def test_breaker_opens_and_fails_fast(self):
+        provider = self.provider(retries=0)
+        for _ in range(3):
+            with self.assertRaises(UpstreamError):
+                provider.call(lambda: (_ for _ in ()).throw(UpstreamError("test", 500)))
+        with self.assertRaises(CircuitOpenError):
+            provider.call(lambda: "never called")
+        self.assertEqual(provider.stats()["circuit"], "open")
+
+    def test_non_idempotent_calls_skip_ambiguous_retries(self):
+        self.assertTrue(is_safe_to_retry(ConnectTimeout(), idempotent=False))
+        self.assertFalse(is_safe_to_retry(ReadTimeout(), idempotent=False))
+        self.assertTrue(is_safe_to_retry(ReadTimeout(), idempotent=True))
+        self.assertFalse(is_transient(UpstreamError("test", 404)))
+
+    def test_only_connect_phase_errors_count_as_not_sent(self):
+        import requests
+        from urllib3.exceptions import ProtocolError, NewConnectionError
+        refused = requests.exceptions.ConnectionError(NewConnectionError(None, "Connection refused"))
+        aborted = requests.exceptions.ConnectionError(ProtocolError("Connection aborted.", ConnectionResetError(104)))
+        self.assertTrue(is_safe_to_retry(refused, idempotent=False))
+        self.assertTrue(is_safe_to_retry(ConnectionRefusedError(), idempotent=False))
+        # The body may have been delivered before the connection dropped
+        self.assertFalse(is_safe_to_retry(aborted, idempotent=False))
+        self.assertFalse(is_safe_to_retry(ConnectionResetError(), idempotent=False))
+        self.assertTrue(is_safe_to_retry(aborted, idempotent=True))
+
+    def test_busy_provider_rejects_instead_of_queueing(self):
+        provider = self.provider(concurrency=1)
+        entered, release = threading.Event(), threading.Event()
+
+        def slow():
+            entered.set()
+            release.wait(2)
+        worker = threading.Thread(target=provider.call, args=(slow,))
+        worker.start()
+        entered.wait(2)
+        with self.assertRaises(ProviderBusyError):
+            provider.call(lambda: "queued")
+        release.set()
+        worker.join()
+
+    def test_async_call_retries(self):
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise ConnectTimeout()
+            return "ok"
+        provider = self.provider()
+        self.assertEqual(asyncio.run(provider.acall(flaky)), "ok")
+        self.assertEqual(len(attempts), 2)
+
+    def test_abandoned_stream_releases_the_half_open_trial(self):
+        provider = self.provider(retries=0, failures=1, cooldown=0)
+        with self.assertRaises(UpstreamError):
+            provider.call(lambda: (_ for _ in ()).throw(UpstreamError("test", 500)))
+        self.assertEqual(provider.breaker.state, "half-open")
+        # The trial call is a stream whose client disconnects after the first chunk
+        stream = provider.stream(lambda: iter(["a", "b"]))
+        self.assertEqual(next(stream), "a")
+        stream.close()
+        self.assertEqual(provider.call(lambda: "ok"), "ok")
+
+        async def abandon():
+            with self.assertRaises(UpstreamError):
+                await provider.acall(self.async_fail)
+            async def open_stream():
+                async def chunks():
+                    yield "a"
+                    yield "b"
+                return chunks()
+            stream = provider.astream(open_stream)
+            self.assertEqual(await stream.__anext__(), "a")
+            await stream.aclose()
+            return await provider.acall(self.async_ok)
+        self.assertEqual(asyncio.run(abandon()), "ok")
+
+    @staticmethod
+    async def async_fail():
+        raise UpstreamError("test", 500)
+
+    @staticmethod
+    async def async_ok():
+        return "ok"
+
+    def test_groq_providers_keep_their_own_read_timeouts(self):
+        # The shared client only bounds connecting; each call passes its provider's timeout
+        client = groq_client("test-key")
+        self.assertIsNone(client._client.timeout.read)
+        self.assertIsNotNone(client._client.timeout.connect)
+        for provider in (GROQ_CHAT, GROQ_WHISPER, GROQ_VISION):
+            self.assertEqual(provider.http_timeout.read, provider.read_timeout)
+            self.assertEqual(provider.http_timeout.connect, provider.connect_timeout)
+
+    def test_groq_sdk_applies_the_per_call_timeout(self):
+        import httpx
+        seen = []
+
+        def handler(request):
+            seen.append(request.extensions["timeout"])
+            return httpx.Response(200, json={"text": "ok"})
+        from groq import Groq
+        client = Groq(api_key="test", max_retries=0, timeout=httpx.Timeout(None, connect=3.0),
+                      http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+        client.audio.transcriptions.create(file=("a.wav", b"RIFF"), model="whisper-large-v3",
+                                           timeout=httpx.Timeout(12.0, connect=2.0))
+        self.assertEqual(seen[0]["read"], 12.0)
+        self.assertEqual(seen[0]["connect"], 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
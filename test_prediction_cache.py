@@ -0,0 +1,94 @@
+from prediction_cache import PredictionCache, image_key
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+
+class TestPredictionCache(unittest.TestCase):
+    def setUp(self):
+        # Heatmap URLs are relative to the app root, so work inside a scratch directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        self.heatmap = "heatmap.png"
+        with open(self.heatmap, "wb") as f:
+            f.write(b"png-bytes")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def result(self, heatmap=""):
+        return {"condition": "Curl", "accuracy": "91.0%", "advice_en": "en", "heatmap": heatmap}
+
+    def test_key_depends_on_bytes_model_and_options(self):
+        base = image_key(b"abc", "v1", "identity")
+        self.assertEqual(base, image_key(b"abc", "v1", "identity"))
+        self.assertNotEqual(base, image_key(b"abd", "v1", "identity"))
+        self.assertNotEqual(base, image_key(b"abc", "v2", "identity"))
+        self.assertNotEqual(base, image_key(b"abc", "v1", "identity,hflip"))
+
+    def test_memory_hit_and_miss_counters(self):
+        cache = PredictionCache(max_entries=4)
+        self.assertIsNone(cache.get("k"))
+        cache.put("k", self.result())
+        self.assertEqual(cache.get("k")["condition"], "Curl")
+        stats = cache.stats()
+        self.assertEqual((stats["hits_memory"], stats["misses"], stats["stores"]), (1, 1, 1))
+
+    def test_lru_eviction(self):
+        cache = PredictionCache(max_entries=2)
+        for key in ("a", "b"):
+            cache.put(key, self.result())
+        cache.get("a")
+        cache.put("c", self.result())
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+
+    def test_evicted_heatmap_counts_as_miss(self):
+        cache = PredictionCache()
+        cache.put("k", self.result(heatmap="/" + self.heatmap))
+        self.assertEqual(cache.get("k", need_heatmap=True)["heatmap"], "/" + self.heatmap)
+        os.remove(self.heatmap)
+        self.assertIsNone(cache.get("k"))
+
+    def test_entry_without_heatmap_misses_when_one_is_needed(self):
+        cache = PredictionCache()
+        cache.put("k", self.result())
+        self.assertIsNone(cache.get("k", need_heatmap=True))
+        self.assertIsNotNone(cache.get("k"))
+
+    def test_disk_tier_is_shared_between_instances(self):
+        disk = "disk"
+        PredictionCache(disk_dir=disk).put("k", self.result())
+        other = PredictionCache(disk_dir=disk)
+        self.assertEqual(other.get("k")["condition"], "Curl")
+        self.assertEqual(other.get("k")["condition"], "Curl")
+        stats = other.stats()
+        self.assertEqual((stats["hits_disk"], stats["hits_memory"]), (1, 1))
+
+    def test_disk_tier_expires_old_entries(self):
+        cache = PredictionCache(max_entries=0, disk_dir="disk", max_age=60)
+        cache.put("k", self.result())
+        old = time.time() - 120
+        os.utime(os.path.join("disk", "k.json"), (old, old))
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(os.listdir("disk"), [])
+
+    def test_disk_tier_is_trimmed_to_max_bytes(self):
+        cache = PredictionCache(max_entries=0, disk_dir="disk", max_bytes=250, evict_every=1)
+        for i, key in enumerate(("a", "b", "c", "d")):
+            cache.put(key, self.result())
+            # Distinct mtimes so the oldest entries go first
+            stamp = time.time() - 100 + i
+            os.utime(os.path.join("disk", key + ".json"), (stamp, stamp))
+        self.assertLessEqual(sum(os.path.getsize(os.path.join("disk", n)) for n in os.listdir("disk")), 250)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("d"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+from preprocessing import Preprocessor, MEAN, STD, image_size
+import cv2
+import unittest
+import numpy as np
+import torch
+
+
+class TestPreprocessor(unittest.TestCase):
+    def setUp(self):
+        self.pre = Preprocessor()
+        rng = np.random.default_rng(0)
+        self.image = rng.integers(0, 256, (300, 400, 3), dtype=np.uint8)
+
+    def test_to_tensor_matches_reference_normalisation(self):
+        small = self.pre.resize(self.image)
+        expected = (small.astype(np.float32) / 255.0 - MEAN) / STD
+        expected = torch.from_numpy(expected).permute(2, 0, 1).unsqueeze(0)
+        self.assertTrue(torch.allclose(self.pre.to_tensor(small), expected, atol=1e-5))
+
+    def test_prepare_shape(self):
+        self.assertEqual(tuple(self.pre.prepare(self.image).shape), (1, 3, 224, 224))
+
+    def test_buffer_is_reused_per_thread(self):
+        views = np.stack([self.pre.resize(self.image)] * 4)
+        out = self.pre.buffer(4)
+        result = self.pre.to_tensor(views, out=out)
+        self.assertEqual(result.data_ptr(), out.data_ptr())
+        self.assertIs(self.pre.buffer(4), out)
+
+    def test_enhance_keeps_shape_and_dtype(self):
+        enhanced = self.pre.enhance(self.image)
+        self.assertEqual(enhanced.shape, self.image.shape)
+        self.assertEqual(enhanced.dtype, np.uint8)
+
+    def test_decode_large_jpeg_to_working_size(self):
+        big = cv2.resize(self.image, (3000, 2000))
+        ok, jpg = cv2.imencode('.jpg', cv2.cvtColor(big, cv2.COLOR_RGB2BGR))
+        data = jpg.tobytes()
+        self.assertEqual(image_size(data), (3000, 2000))
+        pre = Preprocessor(max_side=512)
+        self.assertEqual(pre.decode(data).shape, (341, 512, 3))
+
+    def test_decode_small_image_untouched(self):
+        ok, png = cv2.imencode('.png', self.image)
+        self.assertEqual(self.pre.decode(png.tobytes()).shape, self.image.shape)
+
+    def test_decode_rejects_garbage(self):
+        with self.assertRaises(ValueError):
+            self.pre.decode(b"not an image")
+
+
+if __name__ == '__main__':
+    unittest.main()
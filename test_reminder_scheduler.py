@@ -0,0 +1,95 @@
+from reminder_scheduler import ReminderScheduler
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TestReminderScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.sent = []
+        self.results = []
+        self.scheduler = self.make()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make(self):
+        def sender(phone, body):
+            self.sent.append(phone)
+            return self.results.pop(0) if self.results else {"status": "success"}
+        return ReminderScheduler(os.path.join(self.tmp, "r.db"), sender, batch_size=2,
+                                 retry_seconds=10, max_attempts=2, dispatch=False)
+
+    def test_only_due_reminders_are_sent_in_order(self):
+        now = time.time()
+        self.scheduler.schedule("2", "b", now - 5)
+        self.scheduler.schedule("1", "a", now - 10)
+        self.scheduler.schedule("3", "c", now + 3600)
+        self.assertEqual(self.scheduler.dispatch_once(), 2)
+        self.assertEqual(self.sent, ["1", "2"])
+        self.assertEqual(self.scheduler.dispatch_once(), 0)
+        self.assertEqual(self.scheduler.stats()["pending"], 1)
+
+    def test_dedup_key(self):
+        first = self.scheduler.schedule("1", "a", time.time(), dedup_key="1:7:today")
+        second = self.scheduler.schedule("1", "a", time.time(), dedup_key="1:7:today")
+        self.assertEqual(first[0], second[0])
+        self.assertEqual((first[1], second[1]), (True, False))
+
+    def test_survives_restart(self):
+        reminder_id, _ = self.scheduler.schedule("1", "a", time.time() - 1)
+        restarted = self.make()
+        restarted.dispatch_once()
+        self.assertEqual(restarted.get(reminder_id)["status"], "sent")
+
+    def test_expired_lease_is_reclaimed(self):
+        reminder_id, _ = self.scheduler.schedule("1", "a", time.time() - 1)
+        token, batch = self.scheduler.claim()
+        self.assertEqual(len(batch), 1)
+        # The claiming worker died: nothing else is due until the lease runs out
+        self.assertEqual(self.scheduler.claim()[1], [])
+        late_token, batch = self.scheduler.claim(now=time.time() + 1000)
+        self.assertEqual([r["id"] for r in batch], [reminder_id])
+        # The stale holder can no longer complete it
+        self.scheduler.complete(reminder_id, token, {"status": "success"})
+        self.assertEqual(self.scheduler.get(reminder_id)["status"], "sending")
+
+    def test_failures_retry_then_give_up(self):
+        reminder_id, _ = self.scheduler.schedule("1", "a", time.time() - 1)
+        self.results = [{"status": "error", "message": "down"}, {"status": "error", "message": "down"}]
+        self.scheduler.dispatch_once()
+        reminder = self.scheduler.get(reminder_id)
+        self.assertEqual((reminder["status"], reminder["last_error"]), ("pending", "down"))
+        self.scheduler.dispatch_once(now=time.time() + 60)
+        self.assertEqual(self.scheduler.get(reminder_id)["status"], "failed")
+
+    def test_rows_reclaimed_mid_batch_are_not_sent_twice(self):
+        now = time.time()
+        first, _ = self.scheduler.schedule("1", "a", now - 2)
+        second, _ = self.scheduler.schedule("2", "b", now - 1)
+        other = self.make()
+        reclaimed = []
+        sender = self.scheduler.sender
+
+        def slow_sender(phone, body):
+            # The first send outlasts the lease and another worker takes the batch
+            reclaimed.extend(r["id"] for r in other.claim(now=time.time() + 1000)[1])
+            return sender(phone, body)
+        self.scheduler.sender = slow_sender
+        self.scheduler.dispatch_once()
+        self.assertEqual(self.sent, ["1"])
+        self.assertEqual(sorted(reclaimed), [first, second])
+        self.assertEqual(self.scheduler.get(second)["status"], "sending")
+
+    def test_queued_message_id_is_recorded(self):
+        reminder_id, _ = self.scheduler.schedule("1", "a", time.time() - 1)
+        self.results = [{"status": "success", "message_id": "abc123"}]
+        self.scheduler.dispatch_once()
+        self.assertEqual(self.scheduler.get(reminder_id)["message_id"], "abc123")
+
+
+if __name__ == '__main__':
+    unittest.main()
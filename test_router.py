@@ -0,0 +1,150 @@
+from router import HybridRouter, parse_confidence
+import time
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+LABELS = ["Anthracnose", "Curl", "Healthy"]
+
+
+class FakeLocal:
+    """LazyResource-like wrapper around a fake InferenceService."""
+    def __init__(self, label="Curl", confidence=0.9, delay=0.0, ready=True):
+        self.label = label
+        self.confidence = confidence
+        self.delay = delay
+        self.ready = ready
+        self.calls = 0
+        self.warmed = False
+
+    def get(self):
+        return self
+
+    def warm(self):
+        self.warmed = True
+
+    def predict(self, images, options=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [SimpleNamespace(label=self.label, confidence=self.confidence)]
+
+
+class FakeRemote:
+    def __init__(self, condition="Healthy", confidence="92%", delay=0.0, error=None):
+        self.api_key = "test"
+        self.model = "vision-test"
+        self.condition = condition
+        self.confidence = confidence
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def diagnose(self, data):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"condition": self.condition, "confidence": self.confidence}
+
+    async def adiagnose(self, data, executor=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"condition": self.condition, "confidence": self.confidence}
+
+
+def router(local, remote, **kwargs):
+    return HybridRouter(local, remote, LABELS, **dict({"budget": 2.0, "min_confidence": 0.6}, **kwargs))
+
+
+class TestHybridRouter(unittest.TestCase):
+    def test_confident_local_answer_never_calls_remote(self):
+        remote = FakeRemote()
+        route = router(FakeLocal(confidence=0.9), remote).route(b"img")
+        self.assertEqual((route.engine, route.reason, route.label), ("local", "confident", "Curl"))
+        self.assertEqual(remote.calls, 0)
+
+    def test_low_confidence_goes_remote_and_records_agreement(self):
+        r = router(FakeLocal(confidence=0.3), FakeRemote(condition="healthy leaf"))
+        route = r.route(b"img")
+        self.assertEqual((route.engine, route.reason, route.label), ("remote", "low_confidence", "Healthy"))
+        self.assertAlmostEqual(route.confidence, 0.92)
+        self.assertIsNotNone(route.prediction)
+        time.sleep(0.05)
+        stats = r.stats()
+        self.assertEqual(stats["agreement"]["compared"], 1)
+        self.assertEqual(stats["disagreements"], {"Curl -> Healthy": 1})
+
+    def test_remote_failure_falls_back_to_local(self):
+        route = router(FakeLocal(confidence=0.3), FakeRemote(error=RuntimeError("down"))).route(b"img")
+        self.assertEqual((route.engine, route.reason), ("local", "remote_failed"))
+
+    def test_unmatched_remote_condition_is_not_used_as_a_label(self):
+        r = router(FakeLocal(confidence=0.3), FakeRemote(condition="Some new blight, probably"))
+        route = r.route(b"img")
+        self.assertEqual((route.engine, route.reason, route.label), ("local", "remote_unmatched", "Curl"))
+        route = asyncio.run(r.aroute(b"img"))
+        self.assertEqual((route.engine, route.reason, route.label), ("local", "remote_unmatched", "Curl"))
+        # Nothing local to fall back to: a fixed label instead of the free text
+        route = router(FakeLocal(ready=False), FakeRemote(condition="Some new blight")).route(b"img")
+        self.assertEqual((route.engine, route.label), ("remote", "Unknown"))
+        time.sleep(0.05)
+        self.assertEqual(r.stats()["disagreements"], {"Curl -> Unknown": 2})
+
+    def test_signature_names_the_engines_that_can_answer(self):
+        # Part of the prediction cache key: remote answers must not be served to a local-only setup
+        self.assertEqual(router(FakeLocal(), FakeRemote()).signature(), "hybrid:0.6:vision-test")
+        self.assertEqual(router(FakeLocal(), FakeRemote(), mode="local").signature(), "local:0.6:local")
+        self.assertEqual(router(FakeLocal(), None).signature(), "hybrid:0.6:local")
+
+    def test_label_for_only_accepts_whole_labels(self):
+        r = router(FakeLocal(), FakeRemote())
+        self.assertEqual(r.label_for("CURL"), "Curl")
+        self.assertEqual(r.label_for("Healthy leaf."), "Healthy")
+        self.assertEqual(r.label_for("Papaya leaf curl disease"), "Curl")
+        for text in ("a", "c", "spot", "cur", "heal", "", None, "anthracnose or curl", "curly leaves"):
+            self.assertIsNone(r.label_for(text), text)
+        route = router(FakeLocal(confidence=0.3), FakeRemote(condition="spot")).route(b"img")
+        self.assertEqual((route.engine, route.reason, route.label), ("local", "remote_unmatched", "Curl"))
+
+    def test_model_loading_uses_remote(self):
+        local = FakeLocal(ready=False)
+        route = router(local, FakeRemote()).route(b"img")
+        self.assertEqual((route.engine, route.reason), ("remote", "local_unavailable"))
+        self.assertEqual(local.calls, 0)
+        self.assertTrue(local.warmed)
+
+    def test_hedge_returns_first_answer(self):
+        r = router(FakeLocal(delay=0.5), FakeRemote(delay=0.05), hedge_after=0.05)
+        route = r.route(b"img")
+        self.assertEqual((route.engine, route.reason), ("remote", "hedge"))
+
+    def test_budget_keeps_low_confidence_local_answer(self):
+        route = router(FakeLocal(confidence=0.3), FakeRemote(delay=1.0), budget=0.2).route(b"img")
+        self.assertEqual((route.engine, route.reason), ("local", "budget"))
+
+    def test_without_remote_everything_is_local(self):
+        remote = FakeRemote()
+        remote.api_key = ""
+        route = router(FakeLocal(confidence=0.1), remote).route(b"img")
+        self.assertEqual((route.engine, route.reason), ("local", "local"))
+        self.assertEqual(remote.calls, 0)
+
+    def test_async_route_matches_sync_route(self):
+        r = router(FakeLocal(confidence=0.3), FakeRemote())
+        route = asyncio.run(r.aroute(b"img"))
+        self.assertEqual((route.engine, route.reason, route.label), ("remote", "low_confidence", "Healthy"))
+        route = asyncio.run(router(FakeLocal(delay=0.5), FakeRemote(delay=0.05), hedge_after=0.05).aroute(b"img"))
+        self.assertEqual((route.engine, route.reason), ("remote", "hedge"))
+        route = asyncio.run(router(FakeLocal(confidence=0.3), FakeRemote(error=RuntimeError("down"))).aroute(b"img"))
+        self.assertEqual((route.engine, route.reason), ("local", "remote_failed"))
+
+    def test_parse_confidence(self):
+        self.assertAlmostEqual(parse_confidence("95%"), 0.95)
+        self.assertAlmostEqual(parse_confidence(0.4), 0.4)
+        self.assertIsNone(parse_confidence("high"))
+
+
+if __name__ == "__main__":
+    unittest.main()
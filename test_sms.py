@@ -6,7 +6,7 @@ class TestSMSService(unittest.TestCase):
     def setUp(self):
         self.sms = SMSService(api_key="test_key")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_send_sms_success(self, mock_post):
 
         mock_response = MagicMock()
@@ -17,7 +17,7 @@ class TestSMSService(unittest.TestCase):
         self.assertEqual(result["status"], "success")
         self.assertEqual(result["message"], "SMS sent successfully")
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_send_sms_failure(self, mock_post):
     
         mock_response = MagicMock()
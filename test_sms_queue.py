@@ -0,0 +1,133 @@
+from sms_queue import SMSQueue, TokenBucket, SharedTokenBucket
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class FakeService:
+    def __init__(self, provider="fast2sms"):
+        self.provider = provider
+        self.calls = []
+        self.results = []
+        self.on_call = None
+
+    def send_bulk(self, numbers, message):
+        self.calls.append((list(numbers), message))
+        if self.on_call is not None:
+            self.on_call()
+        result = self.results.pop(0) if self.results else {"status": "success"}
+        return [result] * len(numbers)
+
+
+class TestSMSQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.service = FakeService()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make(self, **kwargs):
+        return SMSQueue(os.path.join(self.tmp, "sms.db"), self.service, bulk_size=2, retry_seconds=0,
+                        max_attempts=2, dispatch=False, **kwargs)
+
+    def test_identical_bodies_are_grouped_into_bulk_calls(self):
+        queue = self.make()
+        ids = [queue.enqueue(phone, "spray today") for phone in ("1", "2", "3")]
+        queue.enqueue("4", "other")
+        self.assertEqual(queue.get(ids[0])["status"], "queued")
+        self.assertEqual(queue.dispatch_once(), 4)
+        self.assertEqual(self.service.calls, [(["1", "2"], "spray today"), (["3"], "spray today"), (["4"], "other")])
+        self.assertEqual([queue.get(i)["status"] for i in ids], ["sent"] * 3)
+        self.assertEqual(queue.get(ids[0])["provider"], "fast2sms")
+
+    def test_2factor_sends_one_call_per_number(self):
+        self.service.provider = "2factor"
+        queue = self.make()
+        for phone in ("1", "2"):
+            queue.enqueue(phone, "hi")
+        queue.dispatch_once()
+        self.assertEqual(self.service.calls, [(["1"], "hi"), (["2"], "hi")])
+
+    def test_failed_messages_are_retried_then_marked_failed(self):
+        queue = self.make()
+        message_id = queue.enqueue("1", "hi")
+        self.service.results = [{"status": "error", "message": "down", "retry": True}] * 2
+        queue.dispatch_once()
+        self.assertEqual(queue.get(message_id)["status"], "queued")
+        queue.dispatch_once()
+        message = queue.get(message_id)
+        self.assertEqual((message["status"], message["error"], message["attempts"]), ("failed", "down", 2))
+
+    def test_possibly_delivered_messages_are_not_resent(self):
+        queue = self.make()
+        message_id = queue.enqueue("1", "hi")
+        # e.g. a read timeout: the gateway may already have sent it
+        self.service.results = [{"status": "error", "message": "read timed out", "retry": False}]
+        queue.dispatch_once()
+        message = queue.get(message_id)
+        self.assertEqual((message["status"], message["attempts"]), ("failed", 1))
+        self.assertIn("read timed out", message["error"])
+        self.assertEqual(queue.dispatch_once(), 0)
+        self.assertEqual(len(self.service.calls), 1)
+
+    def test_sms_service_marks_only_unsent_failures_retryable(self):
+        from sms_service import SMSService
+        from outbound import CircuitOpenError
+        import requests
+        error = SMSService._error
+        self.assertTrue(error("x", requests.exceptions.ConnectTimeout("connect"))["retry"])
+        self.assertTrue(error("x", CircuitOpenError("fast2sms", 5))["retry"])
+        self.assertFalse(error("x", requests.exceptions.ReadTimeout("read"))["retry"])
+        self.assertTrue(SMSService._fast2sms_result({"return": False, "message": "bad number"})["retry"])
+
+    def test_expired_lease_is_claimed_again(self):
+        queue = self.make()
+        message_id = queue.enqueue("1", "hi")
+        token, rows = queue.claim()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(queue.claim()[1], [])
+        self.assertEqual(queue.claim(now=time.time() + queue.lease_seconds + 1)[1][0]["id"], message_id)
+
+    def test_rows_reclaimed_mid_batch_are_not_sent_twice(self):
+        queue = self.make()
+        first = queue.enqueue("1", "spray today")
+        second = queue.enqueue("2", "water today")
+        other = self.make()
+        reclaimed = []
+        # While the first call is in flight the lease runs out and another dispatcher takes the batch
+        self.service.on_call = lambda: reclaimed.extend(other.claim(now=time.time() + queue.lease_seconds + 1)[1])
+        queue.dispatch_once()
+        self.assertEqual(self.service.calls, [(["1"], "spray today")])
+        self.assertEqual(sorted(r["id"] for r in reclaimed), sorted([first, second]))
+        self.assertEqual(queue.get(second)["status"], "sending")
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_limited(self):
+        bucket = TokenBucket(rate=1000, burst=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        bucket.rate = 0.001
+        self.assertFalse(bucket.try_acquire())
+
+    def test_shared_bucket_is_one_limit_across_instances(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "sms.db")
+            # Two workers on one database share the provider's budget
+            first = SharedTokenBucket(path, "2factor", rate=0.001, burst=2)
+            second = SharedTokenBucket(path, "2factor", rate=0.001, burst=2)
+            self.assertTrue(first.try_acquire())
+            self.assertTrue(second.try_acquire())
+            self.assertFalse(first.try_acquire())
+            self.assertFalse(second.try_acquire())
+            self.assertTrue(SharedTokenBucket(path, "fast2sms", rate=0.001, burst=1).try_acquire())
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
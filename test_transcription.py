@@ -0,0 +1,89 @@
+from transcription import AudioUpload, AudioLimitError, TranscriptCache, audio_duration
+from llm_advisor import CaricaCareAdvisor
+import io
+import struct
+import shutil
+import tempfile
+import unittest
+import wave
+from types import SimpleNamespace
+
+
+def wav_bytes(seconds, rate=8000):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buf.getvalue()
+
+
+def ebml(element_id, payload):
+    return element_id + bytes([0x80 | len(payload)]) + payload
+
+
+def webm_bytes(last_block_ms):
+    # MediaRecorder style: Segment and Cluster of unknown size, no Duration element
+    unknown = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+    blocks = b"".join(ebml(b"\xa3", b"\x81" + struct.pack(">h", t) + b"\x80" + b"x" * 10) for t in (0, 500, last_block_ms))
+    return (ebml(b"\x1a\x45\xdf\xa3", b"\x42\x82\x84webm") + b"\x18\x53\x80\x67" + unknown
+            + ebml(b"\x15\x49\xa9\x66", ebml(b"\x2a\xd7\xb1", (1000000).to_bytes(3, "big")))
+            + b"\x1f\x43\xb6\x75" + unknown + ebml(b"\xe7", (2000).to_bytes(2, "big")) + blocks)
+
+
+class FakeWhisper:
+    def __init__(self):
+        self.uploads = []
+        self.audio = SimpleNamespace(transcriptions=self)
+
+    def create(self, file, **kwargs):
+        self.uploads.append(file[1].read())
+        return SimpleNamespace(text="வணக்கம்")
+
+
+class TestAudioUpload(unittest.TestCase):
+    def test_duration_from_container_headers(self):
+        self.assertAlmostEqual(audio_duration(io.BytesIO(wav_bytes(1.5))), 1.5)
+        self.assertAlmostEqual(audio_duration(io.BytesIO(webm_bytes(1200))), 3.2)
+        self.assertIsNone(audio_duration(io.BytesIO(b"ID3 not parsed")))
+
+    def test_limits(self):
+        with self.assertRaises(AudioLimitError):
+            AudioUpload.from_stream(io.BytesIO(b"x" * 2048), max_bytes=1024)
+        with self.assertRaises(AudioLimitError):
+            AudioUpload.from_stream(io.BytesIO(wav_bytes(3)), max_seconds=2)
+        with AudioUpload.from_stream(io.BytesIO(wav_bytes(1)), max_seconds=2) as audio:
+            self.assertAlmostEqual(audio.duration, 1.0)
+
+    def test_non_seekable_stream_is_spooled(self):
+        data = wav_bytes(0.5)
+        reader = io.BufferedReader(io.BytesIO(data))
+        reader.seekable = lambda: False
+        with AudioUpload.from_stream(reader, "a.wav") as audio:
+            self.assertEqual(audio.rewind().read(), data)
+            self.assertEqual(audio.size, len(data))
+
+
+class TestTranscriptCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_same_audio_is_transcribed_once(self):
+        advisor = CaricaCareAdvisor(api_key="test", transcripts=TranscriptCache(self.tmp))
+        advisor.client = FakeWhisper()
+        data = wav_bytes(0.5)
+        for _ in range(2):
+            with AudioUpload.from_stream(io.BytesIO(data), "a.wav") as audio:
+                self.assertEqual(advisor.transcribe_audio(audio), "வணக்கம்")
+        self.assertEqual(advisor.client.uploads, [data])
+        # Shared through the cache directory
+        fresh = TranscriptCache(self.tmp)
+        self.assertEqual(fresh.get(audio.sha256, advisor.whisper_model, advisor.language), "வணக்கம்")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+from tta_engine import TTAEngine, parse_augmentations
+import unittest
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+
+def leaf_image(w=480, h=320):
+    """Smooth, non-square synthetic image (sharp edges would only measure resampling noise)."""
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    r = 128 + 100 * np.sin(x / 37.0) * np.cos(y / 53.0)
+    g = 128 + 100 * np.cos((x + y) / 61.0)
+    b = 255 * (x / w) * (1 - y / h)
+    return np.clip(np.dstack([r, g, b]), 0, 255).astype(np.uint8)
+
+
+# The per-view pipeline TTAEngine replaced: augment the full image, then resize and normalise
+OLD_TRANSFORM = transforms.Compose([
+    transforms.ToPILImage(),
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+])
+
+
+def old_view(image, name):
+    if name == "hflip":
+        image = np.fliplr(image).copy()
+    elif name in ("rot+5", "rot-5"):
+        angle = 5 if name == "rot+5" else -5
+        image = np.array(Image.fromarray(image).rotate(angle, expand=False, fillcolor=(0, 0, 0)))
+    return OLD_TRANSFORM(image)
+
+
+class TinyNet(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv2d(3, 4, 5, stride=4)
+        self.head = torch.nn.Linear(4, 8)
+
+    def forward(self, x):
+        return self.head(torch.relu(self.conv(x)).mean(dim=(2, 3)))
+
+
+class TestParity(unittest.TestCase):
+    def test_views_match_per_view_pipeline(self):
+        image = leaf_image()
+        engine = TTAEngine(None)
+        batch = engine.build_batch(image, engine.augmentations)
+        for i, name in enumerate(engine.augmentations):
+            diff = (batch[i] - old_view(image, name)).abs()
+            # Away from the black corners both pipelines sample the same geometry
+            inner = diff[:, 20:-20, 20:-20]
+            self.assertLess(inner.mean().item(), 0.05, name)
+
+    def test_rotation_keeps_source_aspect_ratio(self):
+        # On a wide image, rotating the resized square view without correction shears the
+        # result; the correction must be clearly closer to the old pipeline than that
+        image = leaf_image(640, 200)
+        engine = TTAEngine(None)
+        fixed = engine.build_batch(image, ("rot+5",))[0]
+        square = TTAEngine(None).build_batch(engine.resize(image), ("rot+5",))[0]
+        expected = old_view(image, "rot+5")
+        self.assertLess((fixed - expected).abs().mean().item(),
+                        (square - expected).abs().mean().item() / 2)
+
+    def test_predict_matches_per_view_average(self):
+        image = leaf_image()
+        model = TinyNet().eval()
+        engine = TTAEngine(model)
+        with torch.no_grad():
+            old = torch.stack([
+                torch.softmax(model(old_view(image, name).unsqueeze(0)), dim=1)[0]
+                for name in engine.augmentations
+            ]).mean(dim=0)
+        new = engine.predict(image)
+        self.assertLess((new - old).abs().max().item(), 0.02)
+        many = engine.predict_many([image, leaf_image(300, 300)])
+        self.assertTrue(torch.allclose(many[0], new, atol=1e-5))
+
+
+class TestParseAugmentations(unittest.TestCase):
+    def test_values(self):
+        self.assertIsNone(parse_augmentations(None))
+        self.assertIsNone(parse_augmentations("default"))
+        self.assertEqual(parse_augmentations("none"), ("identity",))
+        self.assertEqual(parse_augmentations("hflip, rot-5"), ("hflip", "rot-5"))
+
+    def test_unknown_view_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            parse_augmentations("identity,zoom")
+
+
+if __name__ == "__main__":
+    unittest.main()
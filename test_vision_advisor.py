@@ -0,0 +1,107 @@
+from vision_advisor import VisionAdvisor, shrink_image, parse_json
+from prediction_cache import PredictionCache
+from outbound import GROQ_VISION
+import cv2
+import json
+import asyncio
+import time
+import threading
+import unittest
+import numpy as np
+from types import SimpleNamespace
+
+
+def jpeg(width, height):
+    image = np.random.RandomState(0).randint(0, 255, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+
+class FakeVision:
+    def __init__(self, content='{"condition": "Curl", "confidence": "90%"}', delay=0.0):
+        self.content = content
+        self.delay = delay
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        time.sleep(self.delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.content))])
+
+
+class FakeAsyncVision(FakeVision):
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.content))])
+
+
+def advisor(client, cache=None):
+    vision = VisionAdvisor("test", "Diagnose this leaf", max_side=256, quality=70, cache=cache)
+    vision.client = client
+    return vision
+
+
+class TestVisionAdvisor(unittest.TestCase):
+    def test_shrink_image_bounds_resolution(self):
+        small = shrink_image(jpeg(2000, 1000), max_side=256, quality=70)
+        image = cv2.imdecode(np.frombuffer(small, np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(max(image.shape[:2]), 256)
+        with self.assertRaises(ValueError):
+            shrink_image(b"not an image")
+
+    def test_parse_json_strips_markdown(self):
+        self.assertEqual(parse_json('```json\n{"condition": "Curl"}\n```'), {"condition": "Curl"})
+
+    def test_sends_shrunk_jpeg_and_caches_result(self):
+        client = FakeVision()
+        vision = advisor(client, PredictionCache(max_entries=8))
+        data = jpeg(2000, 1500)
+        self.assertEqual(vision.diagnose(data)["condition"], "Curl")
+        self.assertEqual(vision.diagnose(data)["condition"], "Curl")
+        self.assertEqual(client.calls[0]["timeout"].read, GROQ_VISION.read_timeout)
+        self.assertEqual(len(client.calls), 1)
+        url = client.calls[0]["messages"][0]["content"][1]["image_url"]["url"]
+        self.assertTrue(url.startswith("data:image/jpeg;base64,"))
+        self.assertLess(vision.bytes_out, vision.bytes_in)
+
+    def test_identical_uploads_in_flight_share_one_call(self):
+        client = FakeVision(delay=0.2)
+        vision = advisor(client)
+        data = jpeg(640, 480)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(vision.diagnose(data))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(vision.coalesced, 3)
+
+    def test_async_diagnose_shares_cache_and_in_flight_calls(self):
+        client = FakeAsyncVision(delay=0.1)
+        vision = advisor(None, PredictionCache(max_entries=8))
+        vision.async_client = client
+        data = jpeg(640, 480)
+        async def run():
+            return await asyncio.gather(*(vision.adiagnose(data) for _ in range(3)))
+        results = asyncio.run(run())
+        self.assertEqual([r["condition"] for r in results], ["Curl"] * 3)
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(asyncio.run(vision.adiagnose(data))["condition"], "Curl")
+        self.assertEqual(len(client.calls), 1)
+
+    def test_errors_are_not_cached(self):
+        client = FakeVision(content="no json here")
+        vision = advisor(client, PredictionCache(max_entries=8))
+        data = jpeg(320, 240)
+        with self.assertRaises(json.JSONDecodeError):
+            vision.diagnose(data)
+        client.content = '{"condition": "Healthy"}'
+        self.assertEqual(vision.diagnose(data)["condition"], "Healthy")
+        self.assertEqual(len(client.calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
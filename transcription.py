@@ -0,0 +1,308 @@
+"""
+Audio uploads for /transcribe.
+
+AudioUpload hashes the upload in chunks (no full read into memory), enforces the size
+and duration limits and hands Whisper a file object, so the multipart request is
+streamed from memory or a per-request spooled temp file. The duration comes from the
+container header (WebM/Matroska from Chrome, Ogg from Firefox, WAV); other containers
+are only checked for size. TranscriptCache maps the audio hash to its transcript, so
+the same recording is never sent to Whisper twice.
+"""
+import os
+import json
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+CHUNK = 64 * 1024
+
+
+class AudioLimitError(ValueError):
+    """The audio is over the size or duration limit."""
+
+
+_UNKNOWN = -1
+# Matroska element IDs (marker bits kept)
+_SEGMENT, _INFO, _CLUSTER, _BLOCK_GROUP = 0x18538067, 0x1549A966, 0x1F43B675, 0xA0
+_TIMECODE_SCALE, _DURATION, _CLUSTER_TIMECODE, _SIMPLE_BLOCK, _BLOCK = 0x2AD7B1, 0x4489, 0xE7, 0xA3, 0xA1
+# Descended into instead of skipped (MediaRecorder writes Segment / Cluster with unknown size)
+_CONTAINERS = (_SEGMENT, _INFO, _CLUSTER, _BLOCK_GROUP)
+
+
+def _vint(f, marker=False):
+    """Read an EBML variable-length integer; None at EOF, _UNKNOWN for an unknown size."""
+    first = f.read(1)
+    if not first:
+        return None
+    length, mask = 1, 0x80
+    while length <= 8 and not first[0] & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        raise ValueError("Bad EBML length")
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        return None
+    value = first[0] if marker else first[0] & (mask - 1)
+    for byte in rest:
+        value = (value << 8) | byte
+    if not marker and value == (1 << (7 * length)) - 1:
+        return _UNKNOWN
+    return value
+
+
+def _matroska_seconds(f):
+    scale = 1000000  # ns per tick
+    cluster = last = 0
+    declared = None
+    while True:
+        element = _vint(f, marker=True)
+        size = _vint(f) if element is not None else None
+        if size is None:
+            break
+        if element in _CONTAINERS:
+            if element == _CLUSTER and declared:
+                # Info (with the Duration element) always comes before the clusters
+                break
+            continue
+        if size == _UNKNOWN:
+            break
+        start = f.tell()
+        if element == _TIMECODE_SCALE:
+            scale = int.from_bytes(f.read(size), "big")
+        elif element == _DURATION and size in (4, 8):
+            declared = struct.unpack(">f" if size == 4 else ">d", f.read(size))[0]
+        elif element == _CLUSTER_TIMECODE:
+            cluster = int.from_bytes(f.read(size), "big")
+        elif element in (_SIMPLE_BLOCK, _BLOCK):
+            # Track number, then a signed 16-bit timecode relative to the cluster
+            _vint(f)
+            relative = f.read(2)
+            if len(relative) == 2:
+                last = max(last, cluster + struct.unpack(">h", relative)[0])
+        f.seek(start + size)
+    return (declared or last) * scale / 1e9
+
+
+def _ogg_seconds(f):
+    head = f.read(CHUNK)
+    if b"OpusHead" in head:
+        i = head.index(b"OpusHead")
+        rate, skip = 48000, struct.unpack("<H", head[i + 10:i + 12])[0]
+    elif b"\x01vorbis" in head:
+        i = head.index(b"\x01vorbis")
+        rate, skip = struct.unpack("<I", head[i + 12:i + 16])[0], 0
+    else:
+        return None
+    # The last page's granule position is the total sample count
+    f.seek(0, os.SEEK_END)
+    f.seek(max(0, f.tell() - CHUNK))
+    tail = f.read()
+    i = tail.rfind(b"OggS")
+    if i < 0 or len(tail) < i + 14 or not rate:
+        return None
+    return max(0, struct.unpack("<q", tail[i + 6:i + 14])[0] - skip) / rate
+
+
+def _wav_seconds(f):
+    f.seek(12)
+    byte_rate = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk, size = header[:4], struct.unpack("<I", header[4:])[0]
+        if chunk == b"fmt ":
+            byte_rate = struct.unpack("<I", f.read(size)[8:12])[0]
+            f.seek(size & 1, os.SEEK_CUR)
+        elif chunk == b"data":
+            return size / byte_rate if byte_rate else None
+        else:
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+def audio_duration(f):
+    """Duration in seconds from the container header, or None if it cannot be read."""
+    f.seek(0)
+    magic = f.read(12)
+    f.seek(0)
+    try:
+        if magic[:4] == b"\x1a\x45\xdf\xa3":
+            return _matroska_seconds(f)
+        if magic[:4] == b"OggS":
+            return _ogg_seconds(f)
+        if magic[:4] == b"RIFF" and magic[8:12] == b"WAVE":
+            return _wav_seconds(f)
+    except (ValueError, struct.error, OSError):
+        return None
+    finally:
+        f.seek(0)
+    return None
+
+
+class AudioUpload:
+    """One audio file to transcribe: a seekable file object plus its content hash, size and duration."""
+    def __init__(self, file, filename, sha256, size, duration=None, owned=False):
+        self.file = file
+        self.filename = filename or "recording.webm"
+        self.sha256 = sha256
+        self.size = size
+        self.duration = duration
+        self._owned = owned
+
+    @classmethod
+    def from_stream(cls, stream, filename=None, max_bytes=None, max_seconds=None, spool_bytes=1024 * 1024):
+        """
+        Hash a stream in chunks, stopping as soon as it goes over max_bytes.
+        A seekable stream (Werkzeug already spools multipart files) is used in place;
+        anything else is copied into a SpooledTemporaryFile that stays in memory up to spool_bytes.
+        """
+        owned = not (hasattr(stream, "seekable") and stream.seekable())
+        file = tempfile.SpooledTemporaryFile(max_size=spool_bytes) if owned else stream
+        if not owned:
+            file.seek(0)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            while True:
+                chunk = stream.read(CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise AudioLimitError(f"Audio is larger than {max_bytes / (1024 * 1024):.0f} MB")
+                digest.update(chunk)
+                if owned:
+                    file.write(chunk)
+            if size == 0:
+                raise AudioLimitError("Audio file is empty")
+            duration = audio_duration(file)
+            if max_seconds and duration is not None and duration > max_seconds:
+                raise AudioLimitError(f"Audio is longer than {max_seconds:.0f} seconds")
+        except Exception:
+            if owned:
+                file.close()
+            raise
+        return cls(file, filename, digest.hexdigest(), size, duration, owned)
+
+    @classmethod
+    def from_path(cls, path, max_bytes=None, max_seconds=None):
+        f = open(path, "rb")
+        try:
+            upload = cls.from_stream(f, os.path.basename(path), max_bytes, max_seconds)
+        except Exception:
+            f.close()
+            raise
+        upload._owned = True
+        return upload
+
+    def rewind(self):
+        """The file positioned at the start, ready to be (re)sent."""
+        self.file.seek(0)
+        return self.file
+
+    def close(self):
+        if self._owned:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TranscriptCache:
+    """
+    Transcripts keyed by (audio sha256, Whisper model, language). Whisper runs at
+    temperature 0, so entries never expire; the oldest are dropped past max_entries.
+    Kept in memory and, if a directory is given, as JSON files shared by all workers.
+    """
+    def __init__(self, cache_dir=None, max_entries=256):
+        self.cache_dir = cache_dir or None
+        self.max_entries = max(1, int(max_entries))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(sha256, model, language):
+        return hashlib.sha1(f"{sha256}|{model}|{language}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _remember(self, key, text):
+        with self._lock:
+            self._memory[key] = text
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, sha256, model, language):
+        key = self.key(sha256, model, language)
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+        if text is None and self.cache_dir:
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    text = json.load(f)["text"]
+                self._remember(key, text)
+            except (OSError, ValueError, KeyError):
+                text = None
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    def put(self, sha256, model, language, text):
+        key = self.key(sha256, model, language)
+        self._remember(key, text)
+        if self.cache_dir:
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"sha256": sha256, "model": model, "language": language, "text": text},
+                          f, ensure_ascii=False)
+            os.replace(tmp, self._path(key))
+            self._evict_disk()
+
+    def _evict_disk(self):
+        files = [os.path.join(self.cache_dir, n) for n in os.listdir(self.cache_dir) if n.endswith(".json")]
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda p: os.path.getmtime(p))
+        for path in files[:len(files) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"entries_memory": len(self._memory), "hits": self.hits, "misses": self.misses}
+
+
+def transcript_cache_from_env():
+    """TRANSCRIPT_CACHE_DIR / TRANSCRIPT_CACHE_SIZE; TRANSCRIPT_CACHE=0 disables it."""
+    if os.environ.get("TRANSCRIPT_CACHE", "1").lower() in ("0", "false", "off", "no"):
+        return None
+    return TranscriptCache(
+        cache_dir=os.environ.get("TRANSCRIPT_CACHE_DIR", "cache/transcripts"),
+        max_entries=int(os.environ.get("TRANSCRIPT_CACHE_SIZE", "256")),
+    )
+
+
+def audio_limits_from_env():
+    """TRANSCRIBE_MAX_BYTES (default 10 MB) / TRANSCRIBE_MAX_SECONDS (default 120) / TRANSCRIBE_SPOOL_BYTES."""
+    return dict(
+        max_bytes=int(os.environ.get("TRANSCRIBE_MAX_BYTES", str(10 * 1024 * 1024))),
+        max_seconds=float(os.environ.get("TRANSCRIBE_MAX_SECONDS", "120")),
+        spool_bytes=int(os.environ.get("TRANSCRIBE_SPOOL_BYTES", str(1024 * 1024))),
+    )
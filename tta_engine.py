@@ -0,0 +1,157 @@
+import os
+import cv2
+import torch
+import numpy as np
+from preprocessing import PREPROCESSOR, INPUT_SIZE
+
+# Every view the engine knows how to build, keyed by name
+AUGMENTATIONS = ("identity", "hflip", "rot+5", "rot-5")
+DEFAULT_AUGMENTATIONS = AUGMENTATIONS
+
+
+def parse_augmentations(value):
+    """Parse a comma separated augmentation list. 'none' / 'off' / '0' means no TTA."""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        names = [str(v).strip() for v in value]
+    else:
+        value = str(value).strip().lower()
+        if value in ("", "default", "1", "true", "on"):
+            return None
+        if value in ("none", "off", "0", "false", "fast"):
+            return ("identity",)
+        names = [v.strip() for v in value.split(",")]
+    names = tuple(n for n in names if n)
+    unknown = [n for n in names if n not in AUGMENTATIONS]
+    if unknown:
+        raise ValueError(f"Unknown TTA augmentation(s): {', '.join(unknown)}")
+    return names or ("identity",)
+
+
+def _rotate(image, angle, source_size=None):
+    """
+    Rotate around the centre without expanding, black fill (same as PIL rotate).
+    source_size=(w, h) is the size the image had before it was resized to its current
+    shape: the rotation is then done in that image's coordinates, so rotating the resized
+    view gives the same geometry as rotating the original and resizing afterwards.
+    """
+    h, w = image.shape[:2]
+    cx, cy = w / 2.0, h / 2.0
+    # PIL rotates counter-clockwise for positive angles, so does cv2
+    matrix = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+    if source_size is not None:
+        # Conjugate with the resize scale: S * R * S^-1, still centred
+        ratio = (w / float(source_size[0])) / (h / float(source_size[1]))
+        matrix[0, 1] *= ratio
+        matrix[1, 0] /= ratio
+        matrix[0, 2] = cx - matrix[0, 0] * cx - matrix[0, 1] * cy
+        matrix[1, 2] = cy - matrix[1, 0] * cx - matrix[1, 1] * cy
+    return cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+
+
+def make_view(image, name, source_size=None):
+    """Build one augmented view of an RGB uint8 image (source_size: see _rotate)."""
+    if name == "identity":
+        return image
+    if name == "hflip":
+        return cv2.flip(image, 1)
+    if name == "rot+5":
+        return _rotate(image, 5, source_size)
+    if name == "rot-5":
+        return _rotate(image, -5, source_size)
+    raise ValueError(f"Unknown TTA augmentation: {name}")
+
+
+class TTAEngine:
+    """
+    Test-Time Augmentation in a single forward pass.
+    All views are stacked into one [N, 3, 224, 224] batch instead of N batch-1 forwards.
+    """
+    def __init__(self, model, augmentations=None, size=INPUT_SIZE, scheduler=None, preprocessor=None):
+        self.model = model
+        self.size = size
+        self.pre = preprocessor or PREPROCESSOR
+        # Optional InferenceScheduler: batches views from concurrent requests together
+        self.scheduler = scheduler
+        if augmentations is None:
+            augmentations = parse_augmentations(os.environ.get("TTA_AUGMENTATIONS")) or DEFAULT_AUGMENTATIONS
+        self.augmentations = parse_augmentations(augmentations) or DEFAULT_AUGMENTATIONS
+
+    def resize(self, image):
+        """Resize an RGB uint8 image to the network input size (once, before augmenting)."""
+        return self.pre.resize(image)
+
+    def views(self, image, augmentations):
+        """Resize once, then build every view; rotations keep the original aspect ratio."""
+        source_size = (image.shape[1], image.shape[0])
+        base = self.resize(image)
+        return [make_view(base, name, source_size) for name in augmentations]
+
+    def build_batch(self, image, augmentations=None, reuse=False):
+        """
+        Return a normalised float tensor of shape [N, 3, size, size] for the given views.
+        reuse=True writes into this thread's preallocated buffer, so the result is only
+        valid until the thread's next call.
+        """
+        augmentations = augmentations or self.augmentations
+        views = np.stack(self.views(image, augmentations))
+        out = self.pre.buffer(len(augmentations)) if reuse else None
+        return self.pre.to_tensor(views, out=out)
+
+    def _forward(self, batch):
+        if self.scheduler is not None:
+            return self.scheduler.infer(batch)
+        with torch.no_grad():
+            return torch.nn.functional.softmax(self.model(batch), dim=1)
+
+    def predict(self, image, augmentations=None):
+        """Average softmax probabilities over every view, in one batched forward."""
+        augmentations = parse_augmentations(augmentations) or self.augmentations
+        batch = self.build_batch(image, augmentations, reuse=True)
+        return self._forward(batch).mean(dim=0)
+
+    def predict_many(self, images, augmentations=None):
+        """
+        predict() for several images: every view of every image goes into one
+        [N * views, 3, size, size] forward. Returns [N, num_classes] probabilities.
+        """
+        augmentations = parse_augmentations(augmentations) or self.augmentations
+        if len(images) == 1:
+            return self.predict(images[0], augmentations).unsqueeze(0)
+        views = np.stack([view for image in images for view in self.views(image, augmentations)])
+        probs = self._forward(self.pre.to_tensor(views))
+        return probs.view(len(images), len(augmentations), -1).mean(dim=1)
+
+    def predict_with_cam(self, image, gradcam, augmentations=None):
+        """
+        Average probabilities and a Grad-CAM from one grad-enabled batched forward.
+        The CAM is taken from the identity view, i.e. the same enhanced input the
+        decision was made on, reusing the activations captured during that forward.
+        With a scheduler only the identity view runs here with gradients; the other
+        views are still batched with concurrent requests.
+        Returns (avg_prob, class_idx, cam).
+        """
+        augmentations = parse_augmentations(augmentations) or self.augmentations
+        if self.scheduler is not None:
+            others = tuple(name for name in augmentations if name != "identity")
+            probs = [self.scheduler.infer(self.build_batch(image, others))] if others else []
+            views = ("identity",)
+        else:
+            probs = []
+            views = tuple(augmentations)
+            if "identity" not in views:
+                # Needed for the CAM only; excluded from the average below
+                views = views + ("identity",)
+        batch = self.build_batch(image, views, reuse=True)
+        with torch.enable_grad(), gradcam.capture() as captured:
+            output = gradcam.model(batch)
+        if self.scheduler is None or "identity" in augmentations:
+            rows = len(augmentations) if self.scheduler is None else 1
+            probs.append(torch.nn.functional.softmax(output.detach(), dim=1)[:rows])
+        avg_prob = torch.cat(probs).mean(dim=0)
+        idx = torch.argmax(avg_prob).item()
+        row = views.index("identity")
+        cam = gradcam.cam_from(captured.activations, output[row, idx], row=row)
+        return avg_prob, idx, cam
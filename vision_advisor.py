@@ -0,0 +1,226 @@
+"""
+Vision-LLM diagnosis: the Groq-only deployment (app_groq_only.py, the Procfile app) and the
+remote engine of the hybrid router in app.py.
+
+    advisor = vision_advisor_from_env(GROQ_API_KEY)
+    result = advisor.diagnose(upload_bytes)   # parsed JSON dict
+
+Uploads are decoded at reduced resolution and re-encoded as a bounded JPEG before they are
+base64'd, so a 4 MB phone photo goes upstream as ~100 KB. Parsed results are cached by the
+hash of the original bytes, identical uploads already in flight wait for the first call,
+and calls go through the GROQ_VISION provider (a few in flight, the rest queue).
+"""
+import os
+import json
+import base64
+import asyncio
+import threading
+from concurrent.futures import Future
+from outbound import GROQ_VISION, groq_client, async_groq_client
+from prediction_cache import PredictionCache, image_key
+from metrics import timed
+# Same label set as the local model (importing it does not load torch)
+from inference_service import CLASSES
+
+VISION_MODEL = "llama-3.2-11b-vision-preview"
+# Bump whenever the prompt or the expected JSON changes so cached results are regenerated
+PROMPT_VERSION = "1"
+
+CATEGORY_LIST = "\n".join(f"{i}. {name}" for i, name in enumerate(CLASSES, 1))
+
+PROMPT = """You are an expert plant pathologist. Analyze this leaf image.
+
+Identify the disease from these 8 categories ONLY:
+""" + CATEGORY_LIST + """
+
+Return valid JSON with this structure:
+{
+    "condition": "Disease Name",
+    "confidence": "95%",
+    "advice_en": { "about": "...", "cause": "...", "prevention": "...", "treatment": "..." },
+    "advice_ta": { "about": "...", "cause": "...", "prevention": "...", "treatment": "..." },
+    "advice_hi": { "about": "...", "cause": "...", "prevention": "...", "treatment": "..." }
+}
+Please ensure the JSON is valid and keys match exactly.
+"""
+
+
+def shrink_image(data, max_side=768, quality=80):
+    """JPEG bytes of an upload with the longest side at most max_side (reduced decode for big JPEGs)."""
+    import cv2
+    from preprocessing import PREPROCESSOR
+    image = PREPROCESSOR.decode(data, max_side)
+    ok, buf = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("Could not re-encode image")
+    return buf.tobytes()
+
+
+def parse_json(content):
+    """Dict from the model's reply; tolerates the reply being wrapped in a markdown block."""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        return json.loads(content.strip().replace("```json", "").replace("```", ""))
+
+
+class VisionAdvisor:
+    def __init__(self, api_key, prompt=PROMPT, model=VISION_MODEL, max_side=768, quality=80, max_tokens=1000, cache=None):
+        self.api_key = api_key
+        self.prompt = prompt
+        self.model = model
+        self.max_side = int(max_side)
+        self.quality = int(quality)
+        self.max_tokens = int(max_tokens)
+        self.cache = cache
+        self._client = None
+        self._async_client = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            return groq_client(self.api_key)
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            return async_groq_client(self.api_key)
+        return self._async_client
+
+    @async_client.setter
+    def async_client(self, value):
+        self._async_client = value
+
+    def key(self, data):
+        return image_key(data, f"{self.model}:{PROMPT_VERSION}", self.max_side, self.quality)
+
+    def _claim(self, data):
+        """(key, cached result, in-flight future, owner) for an upload."""
+        key = self.key(data)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return key, cached, None, False
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        return key, None, future, owner
+
+    def _settle(self, key, future, result=None, error=None):
+        try:
+            if error is not None:
+                future.set_exception(error)
+                return
+            if self.cache is not None:
+                self.cache.put(key, result)
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def diagnose(self, data):
+        """Parsed result for an upload: cache, then an identical in-flight call, then one vision call."""
+        key, cached, future, owner = self._claim(data)
+        if cached is not None:
+            return cached
+        if not owner:
+            return dict(future.result())
+        try:
+            result = self._call(data)
+        except Exception as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return dict(result)
+
+    async def adiagnose(self, data, executor=None):
+        """asyncio version of diagnose(); the JPEG re-encode runs on executor (default pool if None)."""
+        key, cached, future, owner = self._claim(data)
+        if cached is not None:
+            return cached
+        if not owner:
+            return dict(await asyncio.wrap_future(future))
+        try:
+            jpeg = await asyncio.get_running_loop().run_in_executor(executor, self._shrink, data)
+            with timed("vision"):
+                response = await GROQ_VISION.acall(self.async_client.chat.completions.create, **self._request(jpeg))
+            result = self._parse(response)
+        except Exception as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return dict(result)
+
+    def messages(self, jpeg):
+        url = "data:image/jpeg;base64," + base64.b64encode(jpeg).decode("ascii")
+        return [{"role": "user", "content": [
+            {"type": "text", "text": self.prompt},
+            {"type": "image_url", "image_url": {"url": url}},
+        ]}]
+
+    def _request(self, jpeg):
+        return dict(model=self.model, messages=self.messages(jpeg), temperature=0.1,
+                    max_tokens=self.max_tokens, response_format={"type": "json_object"},
+                    timeout=GROQ_VISION.http_timeout)
+
+    def _shrink(self, data):
+        with timed("vision_encode"):
+            jpeg = shrink_image(data, self.max_side, self.quality)
+        with self._lock:
+            self.calls += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(jpeg)
+        return jpeg
+
+    @staticmethod
+    def _parse(response):
+        content = response.choices[0].message.content
+        print(f"✅ AI Response: {content[:100]}...")
+        return parse_json(content)
+
+    def _call(self, data):
+        jpeg = self._shrink(data)
+        with timed("vision"):
+            response = GROQ_VISION.call(self.client.chat.completions.create, **self._request(jpeg))
+        return self._parse(response)
+
+    def stats(self):
+        stats = {"model": self.model, "max_side": self.max_side, "quality": self.quality,
+                 "calls": self.calls, "coalesced": self.coalesced,
+                 "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                 "in_flight": len(self._inflight), "provider": GROQ_VISION.stats()}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+
+def vision_advisor_from_env(api_key, prompt=PROMPT):
+    """
+    VISION_MODEL, VISION_MAX_SIDE (default 768), VISION_JPEG_QUALITY (default 80), VISION_MAX_TOKENS;
+    results cached in memory (VISION_CACHE_SIZE, 0 disables) and in VISION_CACHE_DIR when set.
+    Concurrency / queueing: OUTBOUND_GROQ_VISION_CONCURRENCY and OUTBOUND_GROQ_VISION_QUEUE_TIMEOUT.
+    """
+    size = int(os.environ.get("VISION_CACHE_SIZE", "256"))
+    disk = os.environ.get("VISION_CACHE_DIR")
+    cache = PredictionCache(max_entries=size, disk_dir=disk) if size or disk else None
+    return VisionAdvisor(api_key, prompt,
+                         model=os.environ.get("VISION_MODEL", VISION_MODEL),
+                         max_side=int(os.environ.get("VISION_MAX_SIDE", "768")),
+                         quality=int(os.environ.get("VISION_JPEG_QUALITY", "80")),
+                         max_tokens=int(os.environ.get("VISION_MAX_TOKENS", "1000")),
+                         cache=cache)